@@ -0,0 +1,89 @@
+import argparse
+import numpy as np
+import time
+
+from photometry import *
+
+def legacy_photometry(points):
+
+    ''' Info : The previous get_photometry decoding, kept here for comparison: a Python loop over the points into lists, then an astropy QTable
+        Input : list of photometry dictionaries (flux format)
+        Returns : Astropy QTable
+    '''
+
+    from astropy.table import QTable
+
+    flux = []
+    fluxerr = []
+    band = []
+    mjd = []
+    zpsys = []
+    zp = []
+
+    for d in points:
+        if d['flux'] != None and (d['filter'] == 'ztfg' or d['filter'] == 'ztfr'):
+            flux.append(d['flux'])
+            fluxerr.append(d['fluxerr'])
+            band.append(d['filter'])
+            mjd.append(d['mjd'])
+            zpsys.append(d['magsys'])
+            zp.append(d['zp'])
+
+    return QTable([mjd, band, flux, fluxerr, zp, zpsys], names=('mjd', 'filter', 'flux','fluxerr', 'zp', 'zpsys'))
+
+def make_points(n, seed=0):
+
+    ''' Info : Builds fake Fritz photometry in flux format, with a mix of filters and missing fluxes (non-detections)
+        Input : number of points, random seed
+        Returns : list of photometry dictionaries
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    filters = rng.choice(['ztfg', 'ztfr', 'ztfi', 'sdssu'], size=n, p=[0.45, 0.45, 0.07, 0.03])
+    detected = rng.random(n) > 0.2
+    mjds = 59000 + np.sort(rng.random(n))*1000
+
+    return [{'id': i, 'obj_id': 'ZTF00bench', 'mjd': float(mjds[i]), 'filter': str(filters[i]),
+             'flux': float(rng.normal(1000, 100)) if detected[i] else None, 'fluxerr': float(rng.normal(30, 3)),
+             'zp': 23.9, 'magsys': 'ab', 'instrument_id': 1, 'ra': None, 'dec': None} for i in range(n)]
+
+def time_call(func, repeat):
+
+    ''' Info : Best wall time of a function over several runs
+        Input : function with no arguments, number of runs
+        Returns : seconds
+    '''
+
+    times = []
+
+    for r in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+if __name__ == '__main__':
+
+    # e.g. python bench_photometry.py --sizes 100 1000 10000
+    parser = argparse.ArgumentParser(description='Compare the old and vectorized photometry decoding.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000, 20000], help='numbers of photometry points per source')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per size (the fastest is reported)')
+    args = parser.parse_args()
+
+    print('{:>8} {:>12} {:>12} {:>8}'.format('points', 'legacy (ms)', 'vector (ms)', 'speedup'))
+
+    for n in args.sizes:
+        points = make_points(n)
+
+        new = photometry_table(decode_photometry(points, 'flux'), 'flux')
+        old = legacy_photometry(points)
+
+        # Both paths must select the same points
+        assert len(new) == len(old) and np.allclose(new['mjd'], np.array(old['mjd'])) and np.allclose(new['flux'], np.array(old['flux']))
+
+        legacy = time_call(lambda: legacy_photometry(points), args.repeat)
+        vector = time_call(lambda: photometry_table(decode_photometry(points, 'flux'), 'flux'), args.repeat)
+
+        print('{:>8} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(n, legacy*1000, vector*1000, legacy/vector))
@@ -0,0 +1,104 @@
+import requests
+import threading
+import time
+
+breaker_failures = 3   # Failed calls in a row after which a service is considered down
+breaker_cooldown = 300 # Seconds a service is left alone once it is down, before one trial call is let through
+breaker_retries = 3    # Attempts per call before it counts as failed
+breaker_wait = 2       # Seconds before the first retry, doubled after each one
+service_timeout = 60   # Timeout (s) of a single request to an external service
+
+# Errors from an external service that are worth retrying
+service_errors = (requests.exceptions.RequestException, TimeoutError, ConnectionError)
+
+class ServiceUnavailable(Exception):
+
+    ''' Info : Raised instead of calling a service whose circuit breaker is open
+    '''
+
+class CircuitBreaker:
+
+    ''' Info : Circuit breaker for an external service. Calls are retried a bounded number of times; once enough calls in a row have failed the
+               breaker opens and calls fail at once with ServiceUnavailable until the cool-down has passed, then a single trial call decides
+               whether it closes again.
+        Attributes: name, failures before opening, cool-down (s), retries per call, consecutive failures, time it opened (None if closed)
+    '''
+
+    def __init__(self, name, failures=breaker_failures, cooldown=breaker_cooldown, retries=breaker_retries):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.retries = retries
+        self.failed = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def call(self, func, errors=service_errors, retries=None):
+
+        ''' Info : Calls a service through the breaker
+            Input : self, function making the call, exception types that count as the service failing, attempts (self.retries if None)
+            Returns : result of the function
+            Raises : ServiceUnavailable if the breaker is open, or the last error if every attempt fails
+        '''
+
+        if retries == None:
+            retries = self.retries
+
+        with self.lock:
+            if self.opened != None:
+                if time.time() - self.opened < self.cooldown or self.trial:
+                    raise ServiceUnavailable(self.name + ' is unavailable, retrying in ' + str(int(self.remaining())) + ' s')
+                self.trial = True # Only this call goes through until it succeeds or fails
+                retries = 1
+
+        wait = breaker_wait
+
+        for attempt in range(retries):
+            try:
+                result = func()
+            except errors:
+                if attempt == retries - 1:
+                    self.record(False)
+                    raise
+                time.sleep(wait)
+                wait *= 2
+            except Exception:
+                with self.lock:
+                    self.trial = False # Not a service failure (e.g. nothing found), the service stays as it was
+                raise
+            else:
+                self.record(True)
+                return result
+
+    def record(self, success):
+
+        ''' Info : Updates the breaker after a call
+            Input : self, whether the call succeeded
+            Returns : None
+        '''
+
+        with self.lock:
+            self.trial = False
+
+            if success:
+                self.failed = 0
+                self.opened = None
+                return
+
+            self.failed += 1
+
+            if self.opened != None or self.failed >= self.failures:
+                self.opened = time.time()
+
+    def remaining(self):
+
+        ''' Info : Time left before the breaker lets a trial call through
+            Input : self
+            Returns : seconds (0 if it is closed)
+        '''
+
+        if self.opened == None:
+            return 0
+
+        return max(0, self.cooldown - (time.time() - self.opened))
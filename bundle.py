@@ -0,0 +1,155 @@
+import argparse
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+
+bundle_dir = 'models'                      # Local SALT2 and bandpass bundle, built once with: python bundle.py build
+bundle_salt2_version = '2.4'               # SALT2 version the pipeline expects
+bundle_bands = ['ztfg', 'ztfr', 'ztfi']    # Bandpasses included in the bundle
+bundle_salt2_dirs = {'2.4': 'salt2-4',     # Directory sncosmo downloads each SALT2 version to, under models/salt2 in its data directory
+                     '2.0': 'salt2-2-0'}
+bundle_registered = False                  # Set once the bundle has been registered in this process
+
+def build_bundle(path=bundle_dir):
+
+    ''' Info : Builds the bundle from sncosmo's own downloads (so this needs network access once): copies the SALT2 model files and writes
+               each bandpass as a two-column table, then records the versions and a SHA-256 of every file in manifest.json
+        Input : bundle directory
+        Returns : manifest dictionary
+    '''
+
+    import sncosmo
+
+    sncosmo.get_source('salt2', version=bundle_salt2_version) # Downloads the model files if sncosmo does not have them yet
+
+    salt2_src = os.path.join(sncosmo.get_data_dir(), 'models', 'salt2', bundle_salt2_dirs[bundle_salt2_version])
+    salt2_dst = os.path.join(path, 'salt2')
+
+    if os.path.exists(salt2_dst):
+        shutil.rmtree(salt2_dst)
+    shutil.copytree(salt2_src, salt2_dst)
+
+    os.makedirs(os.path.join(path, 'bandpasses'), exist_ok=True)
+
+    for band in bundle_bands:
+        bandpass = sncosmo.get_bandpass(band)
+        np.savetxt(os.path.join(path, 'bandpasses', band + '.dat'), np.column_stack([bandpass.wave, bandpass.trans]))
+
+    manifest = {'salt2_version': bundle_salt2_version, 'sncosmo_version': sncosmo.__version__, 'bands': bundle_bands,
+                'files': {f: file_hash(os.path.join(path, f)) for f in bundle_files(path)}}
+
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+def bundle_files(path):
+
+    ''' Info : Lists the model and bandpass files of a bundle
+        Input : bundle directory
+        Returns : sorted list of paths relative to the bundle directory
+    '''
+
+    files = []
+
+    for sub in ['salt2', 'bandpasses']:
+        for root, dirs, names in os.walk(os.path.join(path, sub)):
+            files += [os.path.relpath(os.path.join(root, name), path) for name in names]
+
+    return sorted(files)
+
+def check_bundle(path=bundle_dir, hashes=True):
+
+    ''' Info : Checks that a bundle has the SALT2 version and bands the pipeline expects and that its files are unchanged since it was built
+        Input : bundle directory, whether to check the file hashes
+        Returns : manifest dictionary, or None if there is no bundle
+        Raises : ValueError if the bundle does not match
+    '''
+
+    try:
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+    except OSError:
+        return None
+
+    if manifest['salt2_version'] != bundle_salt2_version:
+        raise ValueError('Model bundle has SALT2 ' + manifest['salt2_version'] + ', expected ' + bundle_salt2_version + '. Rebuild it with: python bundle.py build')
+
+    missing = [band for band in bundle_bands if band not in manifest['bands']]
+    if len(missing) > 0:
+        raise ValueError('Model bundle is missing bandpasses ' + ', '.join(missing) + '. Rebuild it with: python bundle.py build')
+
+    if hashes:
+        for f, digest in manifest['files'].items():
+            if not os.path.exists(os.path.join(path, f)) or file_hash(os.path.join(path, f)) != digest:
+                raise ValueError('Model bundle file ' + f + ' is missing or modified. Rebuild it with: python bundle.py build')
+
+    return manifest
+
+def file_hash(path):
+
+    ''' Info : SHA-256 of a file
+        Input : path
+        Returns : hex digest
+    '''
+
+    sha = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+def register_bundle(path=bundle_dir):
+
+    ''' Info : Registers the bundle's SALT2 source and bandpasses with sncosmo, in place of its downloaded ones, once per process.
+               Without a bundle, sncosmo downloads them as before.
+        Input : bundle directory
+        Returns : True if the bundle is registered, False if there is no bundle
+        Raises : ValueError if the bundle does not match (see check_bundle)
+    '''
+
+    global bundle_registered
+
+    if bundle_registered:
+        return True
+
+    manifest = check_bundle(path)
+
+    if manifest == None:
+        return False
+
+    import sncosmo
+
+    for band in manifest['bands']:
+        wave, trans = np.loadtxt(os.path.join(path, 'bandpasses', band + '.dat'), unpack=True)
+        sncosmo.register(sncosmo.Bandpass(wave, trans, name=band), band, force=True)
+
+    source = sncosmo.SALT2Source(modeldir=os.path.join(path, 'salt2'), name='salt2', version=manifest['salt2_version'])
+    sncosmo.register(source, 'salt2', force=True)
+
+    bundle_registered = True
+
+    return True
+
+if __name__ == '__main__':
+
+    # Build on a machine with network access, then copy the models directory to the batch nodes
+    parser = argparse.ArgumentParser(description='Build or check the local SALT2 and bandpass bundle.')
+    parser.add_argument('action', choices=['build', 'check'])
+    parser.add_argument('--path', default=bundle_dir, help='bundle directory')
+    args = parser.parse_args()
+
+    if args.action == 'build':
+        manifest = build_bundle(args.path)
+        print('Built bundle in ' + args.path + ' with SALT2 ' + manifest['salt2_version'] + ' and ' + str(len(manifest['files'])) + ' files.')
+    else:
+        manifest = check_bundle(args.path)
+
+        if manifest == None:
+            print('No bundle in ' + args.path + '.')
+        else:
+            print('Bundle in ' + args.path + ' is OK (SALT2 ' + manifest['salt2_version'] + ', bands ' + ', '.join(manifest['bands']) + ').')
@@ -0,0 +1,197 @@
+import numpy as np
+import os
+import pickle
+import threading
+
+from scipy.spatial import cKDTree
+
+from cone_cache import chord, separation, unit_vector
+
+catalog_tiles_dir = 'catalog_tiles' # Directory of the host catalog tiles, one file per tile
+tile_size = 0.2                     # Height of a tile (deg), tiles in a band of dec are about as wide
+tile_margin = 60/3600               # Extra radius (deg) fetched around each tile, so hosts of transients near a tile's edge are included
+
+# Host matching from the tiles
+tile_match_radius = 30/3600 # Radius (deg) searched for host galaxies around a transient
+
+class CatalogTiles:
+
+    ''' Info : Local store of PS1 catalog sources for host association, split into fixed tiles on the sky. Transients in the same survey field
+               share tiles, so a batch downloads each tile once instead of one catalog cone per transient. Each tile is indexed with a k-d
+               tree over unit vectors for cone queries. Catalogs do not change, so tiles are kept until the directory is deleted.
+        Attributes: directory, tile size and margin (deg), loaded tiles and their k-d trees
+    '''
+
+    def __init__(self, directory=catalog_tiles_dir, size=tile_size, margin=tile_margin):
+        self.directory = directory
+        self.size = size
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.tiles = {}  # tile -> table (None if the tile has no sources)
+        self.trees = {}  # tile -> cKDTree over its sources
+
+    def has(self, ra, dec):
+
+        ''' Info : Checks whether the tile of a position is stored
+            Input : self, RA and dec (deg)
+            Returns : True or False
+        '''
+
+        return self.load(self.tile(ra, dec))
+
+    def load(self, tile):
+
+        ''' Info : Loads a stored tile into memory and indexes it, if it is not already
+            Input : self, tile
+            Returns : True if the tile is available, False if it has not been fetched
+        '''
+
+        with self.lock:
+            if tile in self.tiles:
+                return True
+
+        try:
+            with open(self.path(tile), 'rb') as f:
+                table = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+
+        self.store(tile, table)
+
+        return True
+
+    def path(self, tile):
+
+        ''' Info : File of a tile
+            Input : self, tile
+            Returns : path
+        '''
+
+        return os.path.join(self.directory, 'tile_{}_{}_{}.pkl'.format(self.size, tile[0], tile[1]))
+
+    def prefetch(self, ras, decs, fetch, executor=None):
+
+        ''' Info : Makes sure the tiles of many positions are stored, downloading each missing tile once
+            Input : self, RAs and decs (deg), function taking a centre RA, dec and radius (deg) and returning the catalog table (or None),
+                    executor to download tiles in parallel (one at a time if None)
+            Returns : number of tiles downloaded
+        '''
+
+        missing = sorted(set(self.tile(ra, dec) for ra, dec in zip(ras, decs)))
+        missing = [tile for tile in missing if not self.load(tile)]
+
+        def download(tile):
+            ra, dec, radius = self.tile_cone(tile)
+            table = fetch(ra, dec, radius)
+
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+
+            path = self.path(tile)
+            tmp = path + '.' + str(os.getpid()) + '_' + str(threading.get_ident()) + '.tmp'
+
+            with open(tmp, 'wb') as f:
+                pickle.dump(table, f)
+
+            os.replace(tmp, path)
+            self.store(tile, table)
+
+        if executor == None:
+            for tile in missing:
+                download(tile)
+        else:
+            list(executor.map(download, missing))
+
+        return len(missing)
+
+    def query(self, ra, dec, radius, ra_col, dec_col):
+
+        ''' Info : Catalog sources within a radius of a position, from its stored tile
+            Input : self, RA and dec (deg), radius (deg, up to the tile margin), RA and dec columns of the catalog
+            Returns : table of the sources with a 'sep' column (arcsec), or None if there are none (or the tile is not stored)
+        '''
+
+        tile = self.tile(ra, dec)
+
+        if not self.load(tile):
+            return None
+
+        with self.lock:
+            table = self.tiles[tile]
+            tree = self.trees.get(tile)
+
+        if table is None or tree is None:
+            return None
+
+        rows = tree.query_ball_point(unit_vector(ra, dec), chord(radius))
+
+        if len(rows) == 0:
+            return None
+
+        table = table[np.sort(rows)]
+        table['sep'] = separation(ra, dec, np.array(table[ra_col], dtype=float), np.array(table[dec_col], dtype=float))*3600
+
+        return table
+
+    def store(self, tile, table):
+
+        ''' Info : Keeps a tile in memory and builds its k-d tree
+            Input : self, tile, catalog table (or None)
+            Returns : None
+        '''
+
+        tree = None
+
+        if table is not None and len(table) > 0:
+            ra_col, dec_col = ('raMean', 'decMean') if 'raMean' in table.colnames else ('ra', 'dec')
+            tree = cKDTree(unit_vector(np.array(table[ra_col], dtype=float), np.array(table[dec_col], dtype=float)))
+
+        with self.lock:
+            self.tiles[tile] = table
+            self.trees[tile] = tree
+
+    def tile(self, ra, dec):
+
+        ''' Info : Tile containing a position. Tiles are bands of dec split into equal steps of RA, about as wide as they are high.
+            Input : self, RA and dec (deg)
+            Returns : (dec band, RA step)
+        '''
+
+        band = int(np.floor((dec + 90)/self.size))
+
+        return band, int(np.floor((ra % 360)/self.ra_step(band)))
+
+    def ra_step(self, band):
+
+        ''' Info : Width in RA of the tiles in a dec band
+            Input : self, dec band
+            Returns : RA step (deg), a whole fraction of 360
+        '''
+
+        low = band*self.size - 90
+        widest = min(abs(low), abs(low + self.size)) if low*(low + self.size) > 0 else 0
+
+        return 360/max(1, int(np.ceil(360*np.cos(np.radians(widest))/self.size)))
+
+    def tile_cone(self, tile):
+
+        ''' Info : Cone that covers a tile and its margin
+            Input : self, tile
+            Returns : centre RA, dec and radius (deg)
+        '''
+
+        band, step = tile
+        width = self.ra_step(band)
+
+        low = band*self.size - 90
+        high = min(low + self.size, 90)
+
+        ra = (step + 0.5)*width
+        dec = (low + high)/2
+
+        corners = separation(ra, dec, np.array([step*width, step*width, (step + 1)*width, (step + 1)*width]), np.array([low, high, low, high]))
+
+        return ra, dec, float(np.max(corners)) + self.margin
+
+# Shared by host association
+catalog_tiles = CatalogTiles()
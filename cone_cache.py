@@ -0,0 +1,267 @@
+import numpy as np
+import os
+import pickle
+import threading
+import time
+
+from scipy.spatial import cKDTree
+
+cone_cache_dir = 'cone_cache' # Directory of the cone-search cache, one file per service
+cone_cache_ttl = 30           # Days a cached cone search (or NED spectra check) is trusted
+cone_fetch_radius = 10/3600   # Radius (deg) actually requested on a miss, so later queries nearby are answered from the same cone
+cone_flush_every = 100        # New entries kept in memory before the cache is written out without waiting for flush()
+
+# RA and dec columns (deg) of each service's result tables, and the separation columns (arcmin) to recompute for a query
+cone_columns = {'ned': ('RA', 'DEC', ['Separation', 'Distance (arcmin)']),
+                'sdss': ('ra', 'dec', [])}
+
+class ConeCache:
+
+    ''' Info : Local cache of cone-search results for host association. Cones are kept per service in a k-d tree over their centres on the unit
+               sphere, so a query that falls entirely inside a cached cone is answered from it by selecting the rows within the query radius.
+               Also remembers which NED objects have spectra. Entries older than the TTL are ignored and dropped when saving. New entries
+               are written out by flush() (once per batch of host lookups), or after cone_flush_every of them.
+        Attributes: directory, ttl (days), fetch radius (deg), per service cones and k-d tree, NED spectra checks, files with unsaved entries
+    '''
+
+    def __init__(self, directory=cone_cache_dir, ttl=cone_cache_ttl, fetch_radius=cone_fetch_radius):
+        self.directory = directory
+        self.ttl = ttl
+        self.fetch_radius = fetch_radius
+        self.lock = threading.Lock()
+        self.cones = {}    # service -> list of {'ra', 'dec', 'radius', 'time', 'table'}
+        self.trees = {}    # service -> cKDTree over the cone centres (None when it needs rebuilding)
+        self.spectra = None # NED object name -> (has spectra, time)
+        self.dirty = set()  # services (or 'ned_spectra') with entries not yet written
+        self.unsaved = 0    # entries added since the last write
+
+    def changed(self, name):
+
+        ''' Info : Marks a file as having unsaved entries, writing everything out once enough have built up (call with self.lock held)
+            Input : self, service or 'ned_spectra'
+            Returns : None
+        '''
+
+        self.dirty.add(name)
+        self.unsaved += 1
+
+        if self.unsaved >= cone_flush_every:
+            self.write_dirty()
+
+    def flush(self):
+
+        ''' Info : Writes any new entries to disk, e.g. at the end of a batch of host lookups
+            Input : self
+            Returns : None
+        '''
+
+        with self.lock:
+            self.write_dirty()
+
+    def fresh(self, entry_time):
+
+        ''' Info : Checks whether a cached entry is within the TTL
+            Input : self, time the entry was stored (unix seconds)
+            Returns : True or False
+        '''
+
+        return time.time() - entry_time < self.ttl*86400
+
+    def lookup(self, service, ra, dec, radius):
+
+        ''' Info : Finds a fresh cached cone that contains the query cone (call with self.lock held)
+            Input : self, service, RA and dec (deg) of the query, radius (deg)
+            Returns : cached cone, or None
+        '''
+
+        cones = self.service_cones(service)
+
+        if len(cones) == 0:
+            return None
+
+        if self.trees.get(service) == None:
+            self.trees[service] = cKDTree(unit_vector(np.array([c['ra'] for c in cones]), np.array([c['dec'] for c in cones])))
+
+        largest = max(c['radius'] for c in cones)
+        if largest < radius:
+            return None
+
+        for i in self.trees[service].query_ball_point(unit_vector(ra, dec), chord(largest - radius)):
+            cone = cones[i]
+            if self.fresh(cone['time']) and separation(ra, dec, cone['ra'], cone['dec']) + radius <= cone['radius'] + 1e-12:
+                return cone
+
+        return None
+
+    def query(self, service, ra, dec, radius, fetch):
+
+        ''' Info : Cone search through the cache. On a miss the service is queried with the larger fetch radius and the result is stored.
+            Input : self, service ('ned' or 'sdss'), RA and dec (deg), radius (deg), function taking a radius (deg) and returning the service's
+                    table (or None if nothing was found)
+            Returns : table of the rows within radius of (ra, dec), with separation columns recomputed from the query centre, or None if empty
+        '''
+
+        with self.lock:
+            cone = self.lookup(service, ra, dec, radius)
+
+        if cone == None:
+            fetch_radius = max(radius, self.fetch_radius)
+            cone = {'ra': ra, 'dec': dec, 'radius': fetch_radius, 'time': time.time(), 'table': fetch(fetch_radius)}
+
+            with self.lock:
+                self.service_cones(service).append(cone)
+                self.trees[service] = None
+                self.changed(service)
+
+        table = cone['table']
+
+        if table is None:
+            return None
+
+        ra_col, dec_col, sep_cols = cone_columns[service]
+        seps = separation(ra, dec, np.array(table[ra_col], dtype=float), np.array(table[dec_col], dtype=float))
+        inside = seps <= radius + 1e-12
+
+        if not np.any(inside):
+            return None
+
+        table = table[inside]
+
+        for col in sep_cols:
+            if col in table.colnames:
+                table[col] = seps[inside]*60
+
+        return table
+
+    def has_spectra(self, name, check):
+
+        ''' Info : Whether a NED object has spectra, through the cache
+            Input : self, NED object name, function returning True or False from NED
+            Returns : True or False
+        '''
+
+        with self.lock:
+            self.load_spectra()
+            cached = self.spectra.get(name)
+
+        if cached != None and self.fresh(cached[1]):
+            return cached[0]
+
+        result = check()
+
+        with self.lock:
+            self.spectra[name] = (result, time.time())
+            self.changed('ned_spectra')
+
+        return result
+
+    def load_spectra(self):
+
+        ''' Info : Reads the NED spectra checks the first time they are needed (call with self.lock held)
+            Input : self
+            Returns : None
+        '''
+
+        if self.spectra == None:
+            self.spectra = self.read('ned_spectra', {})
+
+    def read(self, name, default):
+
+        ''' Info : Loads a cache file
+            Input : self, file name (without extension), value if the file does not exist or cannot be read
+            Returns : cached object
+        '''
+
+        try:
+            with open(os.path.join(self.directory, name + '.pkl'), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+
+    def save(self, name):
+
+        ''' Info : Writes the fresh entries of a service (or the NED spectra checks) to disk (call with self.lock held)
+            Input : self, service or 'ned_spectra'
+            Returns : None
+        '''
+
+        if name == 'ned_spectra':
+            self.spectra = {key: value for key, value in self.spectra.items() if self.fresh(value[1])}
+            data = self.spectra
+        else:
+            self.cones[name] = [c for c in self.cones[name] if self.fresh(c['time'])]
+            self.trees[name] = None
+            data = self.cones[name]
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+        path = os.path.join(self.directory, name + '.pkl')
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+
+        with open(tmp, 'wb') as f:
+            pickle.dump(data, f)
+
+        os.replace(tmp, path)
+
+    def write_dirty(self):
+
+        ''' Info : Writes every file with unsaved entries (call with self.lock held)
+            Input : self
+            Returns : None
+        '''
+
+        for name in sorted(self.dirty):
+            self.save(name)
+
+        self.dirty = set()
+        self.unsaved = 0
+
+    def service_cones(self, service):
+
+        ''' Info : Cached cones of a service, read from disk the first time (call with self.lock held)
+            Input : self, service
+            Returns : list of cones
+        '''
+
+        if service not in self.cones:
+            self.cones[service] = [c for c in self.read(service, []) if self.fresh(c['time'])]
+            self.trees[service] = None
+
+        return self.cones[service]
+
+def chord(angle):
+
+    ''' Info : Straight-line distance between two points on the unit sphere separated by an angle
+        Input : angle (deg)
+        Returns : distance
+    '''
+
+    return 2*np.sin(np.radians(angle)/2)
+
+def separation(ra1, dec1, ra2, dec2):
+
+    ''' Info : Angular separation on the sky (haversine formula)
+        Input : RA and dec (deg) of the two positions, either can be arrays
+        Returns : separation (deg)
+    '''
+
+    ra1, dec1, ra2, dec2 = [np.radians(x) for x in [ra1, dec1, ra2, dec2]]
+
+    h = np.sin((dec2 - dec1)/2)**2 + np.cos(dec1)*np.cos(dec2)*np.sin((ra2 - ra1)/2)**2
+
+    return np.degrees(2*np.arcsin(np.sqrt(np.clip(h, 0, 1))))
+
+def unit_vector(ra, dec):
+
+    ''' Info : Position on the unit sphere
+        Input : RA and dec (deg), scalars or arrays
+        Returns : array of (x, y, z)
+    '''
+
+    ra, dec = np.radians(ra), np.radians(dec)
+
+    return np.stack([np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)], axis=-1)
+
+# Shared by host association
+cone_cache = ConeCache()
@@ -0,0 +1,75 @@
+import numpy as np
+import threading
+
+cosmo_H0 = 70         # Hubble constant (km/s/Mpc) of the flat LambdaCDM cosmology used for absolute magnitudes
+cosmo_Om0 = 0.3       # Matter density of that cosmology
+distmod_z_min = 1e-4  # Redshift range covered by the distance modulus table, values outside it are computed exactly
+distmod_z_max = 2.0
+distmod_points = 20000 # Points in the table, spaced evenly in log z (interpolation error is well under 1e-4 mag)
+
+class DistanceModulus:
+
+    ''' Info : Distance modulus of a fixed cosmology, looked up by interpolation in a table built once on first use
+        Attributes: H0, Om0, redshift range and number of table points, the cosmology and the table
+    '''
+
+    def __init__(self, H0=cosmo_H0, Om0=cosmo_Om0, z_min=distmod_z_min, z_max=distmod_z_max, points=distmod_points):
+        self.H0 = H0
+        self.Om0 = Om0
+        self.z_min = z_min
+        self.z_max = z_max
+        self.points = points
+        self.cosmo = None
+        self.log_z = None
+        self.mu = None
+        self.lock = threading.Lock()
+
+    def __call__(self, z):
+
+        ''' Info : Distance modulus for one or many redshifts
+            Input : self, redshift or array of redshifts
+            Returns : distance modulus (float or array of the same shape)
+        '''
+
+        self.build()
+
+        z = np.asarray(z, dtype=float)
+        mu = np.interp(np.log10(np.clip(z, self.z_min, self.z_max)), self.log_z, self.mu)
+
+        outside = (z < self.z_min) | (z > self.z_max)
+        if np.any(outside):
+            mu = np.where(outside, self.cosmo.distmod(np.where(outside, z, self.z_min)).value, mu)
+
+        return mu if mu.ndim > 0 else float(mu)
+
+    def build(self):
+
+        ''' Info : Creates the cosmology and tabulates its distance modulus, once
+            Input : self
+            Returns : None
+        '''
+
+        if self.mu is not None:
+            return
+
+        from astropy.cosmology import FlatLambdaCDM
+
+        with self.lock:
+            if self.mu is None:
+                self.cosmo = FlatLambdaCDM(H0=self.H0, Om0=self.Om0)
+                self.log_z = np.linspace(np.log10(self.z_min), np.log10(self.z_max), self.points)
+                self.mu = self.cosmo.distmod(10**self.log_z).value # Set last, other threads only read the table once it is present
+
+def peak_absmag(z, x0):
+
+    ''' Info : Peak absolute magnitude from SALT2 parameters, for one source or arrays of sources in one call
+        Input : SALT2 redshift(s) and x0(s)
+        Returns : peak absolute magnitude(s)
+    '''
+
+    peak_mag = -2.5*np.log10(np.asarray(x0, dtype=float)) + 10.635
+
+    return peak_mag - distmod(z)
+
+# Shared by the pipeline, the table is built on first use
+distmod = DistanceModulus()
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+cutout_cache_dir = 'cutout_cache' # Directory of the PS1 image cache
+cutout_cache_max_mb = 500         # Size the cache is trimmed to (least recently used files are removed first)
+cutout_retries = 5                # Attempts at a PS1 request before giving up
+cutout_retry_wait = 2             # Seconds between attempts, doubled after each one
+
+class CutoutCache:
+
+    ''' Info : Disk cache of PS1 file listings (ps1filenames.py) and FITS cutouts (fitscut.cgi) for host plots, keyed by position, size and
+               filter. Cutouts are opened memory-mapped, and the cache is kept under a size cap by removing the least recently used files.
+        Attributes: directory, size cap (MB), number of attempts per request
+    '''
+
+    def __init__(self, directory=cutout_cache_dir, max_mb=cutout_cache_max_mb, retries=cutout_retries):
+        self.directory = directory
+        self.max_mb = max_mb
+        self.retries = retries
+        self.lock = threading.Lock()
+
+    def cutout(self, ra, dec, size, filter, url):
+
+        ''' Info : FITS cutout through the cache, downloaded from its URL on a miss
+            Input : self, RA and dec (deg), size (pixels), filter, fitscut.cgi URL
+            Returns : astropy HDUList opened memory-mapped (close it when done)
+        '''
+
+        from astropy.io import fits
+
+        path = self.path('cutout', ra, dec, size, filter, '.fits')
+
+        if not os.path.exists(path):
+            import requests
+
+            def fetch():
+                r = requests.get(url, timeout=60)
+                r.raise_for_status()
+                return r.content
+
+            self.write(path, self.retry(fetch, (requests.exceptions.RequestException,)))
+        else:
+            os.utime(path) # Marks the file as recently used
+
+        return fits.open(path, memmap=True)
+
+    def filenames(self, ra, dec, size, filters, fetch):
+
+        ''' Info : PS1 file listing through the cache
+            Input : self, RA and dec (deg), size (pixels), filters, function returning the listing table from ps1filenames.py
+            Returns : astropy Table of the images
+        '''
+
+        path = self.path('filenames', ra, dec, size, filters, '.pkl')
+
+        try:
+            with open(path, 'rb') as f:
+                table = pickle.load(f)
+            os.utime(path)
+            return table
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+        # ps1filenames.py sometimes answers with an error page, which astropy reports as a missing file
+        table = self.retry(fetch, (FileNotFoundError,))
+        self.write(path, pickle.dumps(table))
+
+        return table
+
+    def path(self, kind, ra, dec, size, filter, ext):
+
+        ''' Info : File of a cache entry. Positions are rounded to 1e-6 deg (under 0.01 arcsec) so the same host always gives the same key.
+            Input : self, kind ('cutout' or 'filenames'), RA and dec (deg), size (pixels), filter(s), file extension
+            Returns : path
+        '''
+
+        key = kind + '_{:.6f}_{:+.6f}_{}_{}'.format(float(ra), float(dec), int(size), filter)
+
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ext)
+
+    def retry(self, fetch, errors):
+
+        ''' Info : Runs a request, retrying a bounded number of times with a growing wait
+            Input : self, function making the request, exception types worth retrying
+            Returns : result of the function
+            Raises : the last exception if every attempt fails
+        '''
+
+        wait = cutout_retry_wait
+
+        for attempt in range(self.retries):
+            try:
+                return fetch()
+            except errors:
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(wait)
+                wait *= 2
+
+    def trim(self):
+
+        ''' Info : Removes the least recently used files until the cache is under its size cap (call with self.lock held)
+            Input : self
+            Returns : None
+        '''
+
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            files.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(f[1] for f in files)
+        limit = self.max_mb*1024*1024
+
+        for mtime, size, name in sorted(files):
+            if total <= limit:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue # e.g. a cutout still open on Windows, it will be removed next time
+            total -= size
+
+    def write(self, path, data):
+
+        ''' Info : Stores a cache file, then trims the cache
+            Input : self, path, bytes
+            Returns : None
+        '''
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+        tmp = path + '.' + str(os.getpid()) + '_' + str(threading.get_ident()) + '.tmp'
+
+        with open(tmp, 'wb') as f:
+            f.write(data)
+
+        os.replace(tmp, path)
+
+        with self.lock:
+            self.trim()
+
+# Shared by host association
+cutout_cache = CutoutCache()
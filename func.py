@@ -12,6 +12,7 @@ import pytz
 import re
 import requests
 import sys, getopt, argparse
+import threading
 import time
 import warnings
 import webbrowser as wb
@@ -22,12 +23,19 @@ from astropy.cosmology import FlatLambdaCDM
 from astropy.io import ascii, fits
 from astropy.table import Table
 from astropy.time import Time
+from concurrent.futures import ThreadPoolExecutor
 from lxml import html
 from subprocess import call
 from time import sleep
 from tqdm import tqdm
 from urllib.error import HTTPError
 
+from ledger import *
+from photometry import *
+from tns_client import *
+from tns_names import *
+from tns_objects import *
+
 with open('info.info', 'r') as f:
     info = f.read().split('\n')
     ft = info[2].split(':')[1].strip()
@@ -38,10 +46,14 @@ global TOKEN, BASEURL
 GETTOKEN = ft      # Fritz API Key, retrieves from info file
 BASEURL = 'https://fritz.science/'                     # Fritz base url
 
+detection_params = {'includeDetectionStats': 'true'}   # Source request params that add the time of the latest detection
+
 API_KEY = tns_apikey     # TNS API Key from info file
 YOUR_BOT_ID = tns_botid
 YOUR_BOT_NAME="ZTF_Bot1"
 
+tns_session = TNSClient(YOUR_BOT_ID, YOUR_BOT_NAME) # Every TNS request goes through this, within TNS's rate limits
+
 # TNS URLs for real uploads
 TNS_BASE_URL = "https://www.wis-tns.org/api/"
 upload_url = "https://www.wis-tns.org/api/file-upload"
@@ -54,8 +66,17 @@ SAND_upload_url = "https://sandbox-tns.org/api/"
 SAND_report_url = "https://sandbox-tns.org/api/bulk-report"
 SAND_reply_url = "https://sandbox-tns.org/api/bulk-report-reply"
 
+tns_report_size = 20             # Classifications sent in one bulk report (their spectra are uploaded together)
+tns_entry_ok = ['100', '101']    # Per-entry feedback codes of a bulk report that mean the entry was accepted
+tns_poll_wait = 2                # Seconds before the first check of a report's feedback, doubled after each check that finds it still pending
+tns_poll_max_wait = 30           # Longest wait between checks (s)
+tns_object_workers = 4           # TNS object lookups made at once when checking a run's classifications
+tns_poll_timeout = 600           # Seconds after which a report that still has no feedback is given up on
+
 all_users = {}
 
+prefetcher = None # Active Prefetcher, set by start_prefetch
+
 class bcolors:
 
     ''' Info : Colors for console output.
@@ -97,11 +118,11 @@ class TNSClassificationReport:
         self.spec_proprietary_period_value = ''
         self.spec_proprietary_period_units = ''
 
-    def fill(self):
+    def entry(self):
 
-        ''' Info : Generate TNS submission dict
+        ''' Info : Generate the entry of this classification in a bulk report
             Input : self
-            Returns : Dictionary to submit to TNS
+            Returns : Dictionary of the classification and its spectrum
         '''
 
         spectrumdict = {
@@ -116,26 +137,71 @@ class TNSClassificationReport:
             'remarks': self.spectrumComments,
             'spec_proprietary_period' : self.spec_proprietary_period_value}
 
-        classificationdict =  {
-            'classification_report': {
-                '0': {
-                    'name': self.name,
-                    'classifier': self.classifierName,
-                    'objtypeid': self.classificationID,
-                    'redshift': self.redshift,
-                    'groupid': self.groupID,
-                    'remarks': self.classificationComments,
-                    'spectra': {
-                        'spectra-group': {
-                            '0': spectrumdict
-                        }
-                    }
+        classificationdict = {
+            'name': self.name,
+            'classifier': self.classifierName,
+            'objtypeid': self.classificationID,
+            'redshift': self.redshift,
+            'groupid': self.groupID,
+            'remarks': self.classificationComments,
+            'spectra': {
+                'spectra-group': {
+                    '0': spectrumdict
                 }
             }
         }
 
         return classificationdict
 
+    def fill(self):
+
+        ''' Info : Generate TNS submission dict
+            Input : self
+            Returns : Dictionary to submit to TNS
+        '''
+
+        return {'classification_report': {'0': self.entry()}}
+
+    def as_json(self):
+
+        ''' Info : Returns the dictionary as a formatted string
+            Input : self
+            Returns : classification dictionary as formatted string
+        '''
+
+        return json.dumps(self.fill())
+
+class TNSBulkReport:
+
+    ''' Info : TNS bulk report with several classifications, each with its spectrum, submitted in one request
+        Attributes: sources (ZTF names), reports (TNSClassificationReport of each source), files (spectrum file of each source)
+    '''
+
+    def __init__(self):
+        self.sources = []
+        self.reports = []
+        self.files = []
+
+    def add(self, source, report, filename):
+
+        ''' Info : Adds a classification to the report
+            Input : self, ZTF name, TNSClassificationReport, spectrum file
+            Returns : None
+        '''
+
+        self.sources.append(source)
+        self.reports.append(report)
+        self.files.append(filename)
+
+    def fill(self):
+
+        ''' Info : Generate TNS submission dict with one entry per classification
+            Input : self
+            Returns : Dictionary to submit to TNS
+        '''
+
+        return {'classification_report': {str(i): report.entry() for i, report in enumerate(self.reports)}}
+
     def as_json(self):
 
         ''' Info : Returns the dictionary as a formatted string
@@ -145,14 +211,391 @@ class TNSClassificationReport:
 
         return json.dumps(self.fill())
 
-def api(method, endpoint, data=None, params=None, timeout=10):
+class Prefetcher:
+
+    ''' Info : Loads Fritz data for the next few sources of a list in background threads while the user is answering prompts for the current one.
+               api() serves GET requests from here when the data has already been loaded.
+        Attributes: sources (ordered list of ZTF names), depth (number of sources ahead to load), photometry (whether to load photometry
+                    not already current in the photometry store),
+                    max_spectra (number of most recent spectrum payloads to load per source), cache of API responses
+    '''
+
+    def __init__(self, sources, depth=3, photometry=False, max_spectra=5):
+        self.sources = list(sources)
+        self.depth = depth
+        self.photometry = photometry
+        self.max_spectra = max_spectra
+        self.cond = threading.Condition()
+        self.cache = {}         # (url, params) -> (status, response)
+        self.loaded = {}        # source -> keys in cache, only present while the source's data is valid
+        self.pending = {}       # (url, params) -> source, for requests scheduled but not yet returned
+        self.scheduled = set()  # sources in the current window that have been handed to a thread
+        self.closed = False
+
+    def key(self, url, params=None):
+
+        ''' Info : Cache key for a GET request
+            Input : self, url, params
+            Returns : Hashable key
+        '''
+
+        return url, json.dumps(params, sort_keys=True)
+
+    def advance(self, index):
+
+        ''' Info : Moves the window to the source at index, dropping data for sources before it and starting threads for the next depth sources
+            Input : self, index of current source
+            Returns : None
+        '''
+
+        window = self.sources[index:index+self.depth+1]
+
+        with self.cond:
+            if self.closed:
+                return
+
+            for source in list(self.scheduled):
+                if source not in window:
+                    self.scheduled.discard(source)
+                    self.drop(source)
+
+            for source in window:
+                if source not in self.scheduled:
+                    self.scheduled.add(source)
+                    self.loaded[source] = []
+
+                    for key in self.source_keys(source):
+                        self.pending[key] = source
+
+                    threading.Thread(target=self.load, args=(source,), daemon=True).start()
+
+    def close(self):
+
+        ''' Info : Stops all loading and frees the cache. Loader threads are daemons, so any request still in flight cannot hold up exit.
+            Input : self
+            Returns : None
+        '''
+
+        with self.cond:
+            self.closed = True
+            self.cache.clear()
+            self.loaded.clear()
+            self.pending.clear()
+            self.scheduled.clear()
+            self.cond.notify_all()
+
+    def drop(self, source):
+
+        ''' Info : Removes cached and pending data for a source (call with self.cond held)
+            Input : self, source
+            Returns : None
+        '''
+
+        for key in self.loaded.pop(source, []):
+            self.cache.pop(key, None)
+
+        for key in [k for k, s in self.pending.items() if s == source]:
+            del self.pending[key]
+
+        self.cond.notify_all()
+
+    def get(self, url, params=None):
+
+        ''' Info : Looks up a GET request, waiting for it if it is currently being loaded. Anything but a successful reply is dropped,
+                   so the caller's own request goes to Fritz.
+            Input : self, url, params
+            Returns : (status, response) or None if it has not been prefetched
+        '''
+
+        key = self.key(url, params)
+
+        with self.cond:
+            while key in self.pending and not self.closed:
+                self.cond.wait()
+
+            result = self.cache.get(key)
+
+            if result == None or not success(result):
+                self.cache.pop(key, None)
+                return None
+
+            return result
+
+    def invalidate(self, url, data=None):
+
+        ''' Info : Drops cached data for a source after a non-GET request changes it (e.g. a posted comment)
+            Input : self, url and data of the request
+            Returns : None
+        '''
+
+        match = re.search('api/sources/([^/?]+)', url)
+
+        if match != None:
+            source = match.group(1)
+        elif isinstance(data, dict) and 'obj_id' in data:
+            source = data['obj_id']
+        else:
+            return
+
+        with self.cond:
+            self.drop(source)
+
+    def load(self, source):
+
+        ''' Info : Fetches source info with comments, the spectra listing, the most recent spectrum payloads and (optionally) photometry for a source.
+                   Photometry is only loaded if the latest detection is newer than the photometry store's copy.
+            Input : self, source
+            Returns : None
+        '''
+
+        try:
+            for url, params, timeout in self.source_requests(source):
+                result = self.fetch(source, url, params, timeout)
+
+                if result == None:
+                    return
+
+                self.store(source, url, params, result)
+
+                if url.endswith('/spectra'):
+                    spectra = sorted(result[1]['data']['spectra'], key=lambda spectrum: spectrum['observed_at'], reverse=True)
+
+                    for spectrum in spectra[:self.max_spectra]:
+                        spec_url = BASEURL+'api/spectrum/'+str(spectrum['id'])
+                        spec_result = self.fetch(source, spec_url, None, 10)
+
+                        if spec_result == None:
+                            return
+
+                        self.store(source, spec_url, None, spec_result)
+
+                if params == detection_params and not photometry_store.current(photometry_store.read(source, 'flux'), last_detection_mjd(result[1])):
+                    phot_url = BASEURL+'api/sources/'+source+'/photometry'
+                    phot_result = self.fetch(source, phot_url, {'format': 'flux'}, 10)
+
+                    if phot_result == None:
+                        return
+
+                    self.store(source, phot_url, {'format': 'flux'}, phot_result)
+        except Exception:
+            pass # Prefetching is best effort, anything missing is requested normally
+        finally:
+            with self.cond:
+                for key in [k for k, s in self.pending.items() if s == source]:
+                    del self.pending[key]
+                self.cond.notify_all()
+
+    def fetch(self, source, url, params, timeout):
+
+        ''' Info : Requests a URL for a source unless the source is no longer wanted
+            Input : self, source, url, params, timeout
+            Returns : (status, response), or None if the source has been dropped
+        '''
+
+        with self.cond:
+            if self.closed or source not in self.loaded:
+                return None
+
+        return api('GET', url, params=params, timeout=timeout, cached=False)
+
+    def source_keys(self, source):
+
+        ''' Info : Cache keys that will be loaded for a source (spectrum payloads are not known in advance)
+            Input : self, source
+            Returns : list of keys
+        '''
+
+        return [self.key(url, params) for url, params, timeout in self.source_requests(source)]
+
+    def source_requests(self, source):
+
+        ''' Info : GET requests made for a source, matching those of get_source_api, get_all_spectra_len and get_last_detection
+            Input : self, source
+            Returns : list of (url, params, timeout)
+        '''
+
+        requests_list = [(BASEURL+'api/sources/'+source+'?includeComments=true', None, 30), (BASEURL+'api/sources/'+source+'/spectra', None, 10)]
+
+        if self.photometry:
+            requests_list.append((BASEURL+'api/sources/'+source, detection_params, 10))
+
+        return requests_list
+
+    def store(self, source, url, params, result):
+
+        ''' Info : Saves a response if it is a successful reply and the source is still in the window
+            Input : self, source, url, params, (status, response)
+            Returns : None
+        '''
+
+        key = self.key(url, params)
+
+        with self.cond:
+            if result != None and success(result) and source in self.loaded and not self.closed:
+                self.cache[key] = result
+                self.loaded[source].append(key)
+
+            self.pending.pop(key, None)
+            self.cond.notify_all()
+
+class FeedbackPoller:
+
+    ''' Info : Checks the feedback of submitted TNS bulk reports in a background thread, so the user can carry on while TNS processes them.
+               Many reports are tracked at once, each checked with a growing wait until it is confirmed, rejected or times out. 'Uploaded to TNS'
+               is posted on each accepted source as soon as its report is confirmed.
+        Attributes: outstanding reports (report ID -> sources, submission time, next check time, wait), accepted and failed sources
+    '''
+
+    def __init__(self, wait=tns_poll_wait, max_wait=tns_poll_max_wait, timeout=tns_poll_timeout):
+        self.wait_first = wait
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.reports = {}   # report ID -> {'sources', 'submitted', 'due', 'wait'}
+        self.accepted = []
+        self.failed = []
+        self.closed = False
+        self.thread = None
+
+    def close(self):
+
+        ''' Info : Stops checking, any reports still outstanding are left unconfirmed
+            Input : self
+            Returns : None
+        '''
+
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def finish(self, report_id, results):
+
+        ''' Info : Handles the feedback of a report: posts 'Uploaded to TNS' on each accepted source
+            Input : self, report ID, list of whether each entry was accepted (all False if the report failed)
+            Returns : None
+        '''
+
+        with self.cond:
+            report = self.reports.pop(report_id)
+
+        for source, ok in zip(report['sources'], results):
+            if ok:
+                try:
+                    post_comment(source, 'Uploaded to TNS')
+                    print(bcolors.OKGREEN + source + ' confirmed by TNS.' + bcolors.ENDC)
+                except Exception as e:
+                    print(bcolors.FAIL + source + ' confirmed by TNS, but posting the comment failed: ' + str(e) + bcolors.ENDC)
+            else:
+                print(bcolors.FAIL + source + ' was not accepted by TNS (report ' + str(report_id) + ').' + bcolors.ENDC)
+
+            with self.cond:
+                (self.accepted if ok else self.failed).append(source)
+
+        with self.cond:
+            self.cond.notify_all()
+
+    def run(self):
+
+        ''' Info : Loop of the background thread: checks each report when it is due
+            Input : self
+            Returns : None
+        '''
+
+        while True:
+            with self.cond:
+                while not self.closed and (len(self.reports) == 0 or min(r['due'] for r in self.reports.values()) > time.time()):
+                    due = [r['due'] for r in self.reports.values()]
+                    self.cond.wait(timeout=max(0, min(due) - time.time()) if len(due) > 0 else None)
+
+                if self.closed:
+                    return
+
+                report_id = min(self.reports, key=lambda k: self.reports[k]['due'])
+                report = self.reports[report_id]
+
+            try:
+                try:
+                    code, response = tns_reply(report_id)
+                except Exception:
+                    code, response = None, None # Network trouble or a garbled reply counts as still pending
+
+                if code == 200:
+                    self.finish(report_id, tns_entries(response, len(report['sources']), unmatched=True))
+                elif code == 400:
+                    print(bcolors.FAIL + json.dumps(response, indent=2) + bcolors.ENDC)
+                    self.finish(report_id, tns_entries(response, len(report['sources'])))
+                elif code not in [404, None]:
+                    print(bcolors.FAIL + 'Unexpected TNS feedback for report ' + str(report_id) + ': ' + str(code) + bcolors.ENDC)
+                    self.finish(report_id, [False]*len(report['sources']))
+                elif time.time() - report['submitted'] > self.timeout:
+                    print(bcolors.FAIL + 'No TNS feedback for report ' + str(report_id) + ' after ' + str(self.timeout) + ' s, check it on TNS.' + bcolors.ENDC)
+                    self.finish(report_id, [False]*len(report['sources']))
+                else:
+                    with self.cond:
+                        report['due'] = time.time() + report['wait']
+                        report['wait'] = min(2*report['wait'], self.max_wait)
+            except Exception as e:
+                # Anything unexpected fails this report rather than stopping the thread with every other report still waiting on it
+                print(bcolors.FAIL + 'Checking TNS report ' + str(report_id) + ' failed: ' + str(e) + bcolors.ENDC)
+
+                with self.cond:
+                    outstanding = report_id in self.reports
+
+                if outstanding:
+                    self.finish(report_id, [False]*len(report['sources']))
+
+    def wait(self):
+
+        ''' Info : Blocks until every report has been confirmed, rejected or timed out, for at most the poll timeout (plus time for the last
+                   check) so a stuck check cannot hang the run
+            Input : self
+            Returns : list of accepted sources
+        '''
+
+        deadline = time.time() + self.timeout + self.max_wait + tns_timeout
+
+        with self.cond:
+            while len(self.reports) > 0 and not self.closed and time.time() < deadline:
+                self.cond.wait(timeout=deadline - time.time())
+
+            if len(self.reports) > 0 and not self.closed:
+                print(bcolors.FAIL + 'Gave up waiting for TNS reports ' + ', '.join(map(str, self.reports)) + ', check them on TNS.' + bcolors.ENDC)
+
+            return list(self.accepted)
+
+    def watch(self, report_id, sources):
+
+        ''' Info : Starts tracking a submitted report
+            Input : self, report ID, sources of its entries in order
+            Returns : None
+        '''
+
+        with self.cond:
+            self.reports[report_id] = {'sources': list(sources), 'submitted': time.time(), 'due': time.time() + self.wait_first, 'wait': self.wait_first}
+
+            if self.thread == None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+            self.cond.notify_all()
+
+def api(method, endpoint, data=None, params=None, timeout=10, cached=True):
     ''' Info : Basic API query, takes input the method (eg. GET, POST, etc.), the endpoint (i.e. API url)
                and additional data for filtering
         Returns : response in json format
         CAUTION! : If the query doesn't go through, try putting the 'data' input in 'data' or 'params'
                     argument in requests.request call
+        cached : If False, always sends the request even if the prefetcher has it
     '''
 
+    if prefetcher != None and cached == True:
+        if method == 'GET':
+            result = prefetcher.get(endpoint, params)
+            if result != None:
+                return result
+        else:
+            prefetcher.invalidate(endpoint, data)
+
     headers = {'Authorization': f'token {GETTOKEN}'}
 
     while True:
@@ -243,682 +686,719 @@ def class_submission(sources, tns_names, classifys, class_dates, users, redshift
 
     sc = -1
     print(len(sources), len(redshifts))
-    for red_index, source in enumerate(sources):
-        sc += 1
 
-        print(bcolors.OKCYAN + str(sc+1) + '/' + str(len(sources)) + bcolors.ENDC + ': ' + bcolors.OKBLUE + source + bcolors.ENDC)
+    # Sources the ledger already has as uploaded to or classified from TNS are skipped without looking at Fritz
+    handled = ledger.handled(sources, ['tns_uploaded', 'tns_classified'])
 
-        flag = 0
-        ztfname = source
-        
-        for i in range (len(get_source_api(source)['comments'])):
+    if len(handled) > 0:
+        print(bcolors.OKCYAN + 'Skipping ' + str(len(handled)) + ' sources already uploaded to or classified from TNS.' + bcolors.ENDC)
+        keep = [i for i in range(len(sources)) if sources[i] not in handled]
+        sources, tns_names, classifys, class_dates, users, redshifts = [np.asarray(a)[keep] for a in [sources, tns_names, classifys, class_dates, users, redshifts]]
 
-            comment = get_source_api(source)['comments'][i]['text']
+    prefetch = start_prefetch(sources) # Loads comments and spectra of the next sources while the user answers prompts
 
-            if comment == 'Uploaded to TNS':
-                print(ztfname + ' already uploaded to TNS.')
-                flag = 1
-                continue
+    prefetch_TNS_objects(tns_names) # Classification reports already on TNS, looked up for all sources at once
 
-            if comment == 'Do not upload to TNS':
-                print(ztfname + ' should NOT be uploaded to TNS.')
-
-            if comment == 'Classification from TNS':
-                print(source + ' classified from TNS.')
-                flag = 1
-                continue
+    approved = TNSBulkReport() # Classifications approved during the run, submitted tns_report_size at a time
+    poller = FeedbackPoller()  # Confirms submitted reports while the next sources are reviewed
 
-        if flag == 0:
+    try:
+        for red_index, source in enumerate(sources):
+            sc += 1
+            prefetch.advance(red_index)
 
-            if tns_names[sc] == 'Not reported to TNS':
-                print(ztfname + ' not reported to TNS yet.')
-                continue
+            print(bcolors.OKCYAN + str(sc+1) + '/' + str(len(sources)) + bcolors.ENDC + ': ' + bcolors.OKBLUE + source + bcolors.ENDC)
 
-            class_date = class_dates[sc]
-            classify = classifys[sc]
-            name = users[sc]
+            flag = 0
+            ztfname = source
+        
+            for i in range (len(get_source_api(source)['comments'])):
 
-            #if name == 'K. Hinds':
-            #    name == 'K. R. Hinds'
+                comment = get_source_api(source)['comments'][i]['text']
 
-            prior, type = check_TNS_class(ztfname)
+                ledger.record_comment(source, comment) # Also picks up comments posted by hand
 
-            if prior != None:
-                if type == fritz_to_TNS_class(classify):
-                    print(ztfname + ' already uploaded to TNS with same classification.')
+                if comment == 'Uploaded to TNS':
+                    print(ztfname + ' already uploaded to TNS.')
+                    flag = 1
                     continue
-                else:
-                    if classify == 'duplicate':
-                        print(ztfname + ' is a duplicate, continuing...')
-                        continue
 
-                    if input(ztfname + ' classified on Fritz as ' + classify + ', submit another classification? [y/n] ') != 'y':
-                        continue
-
-            spectrum_info = write_ascii_file(ztfname) #returns "spectrum_name"
-            spectrum_name = spectrum_info[0]
-
-            if spectrum_name != 'No Spectra Found' and spectrum_name != 'Resuming...':
+                if comment == 'Do not upload to TNS':
+                    print(ztfname + ' should NOT be uploaded to TNS.')
 
-                if flag == 0:
-
-                    print(ztfname + '\t' + tns_names[sc] + '\t' + classify + '\t' + class_date)
-
-                    path = os.getcwd()
+                if comment == 'Classification from TNS':
+                    print(source + ' classified from TNS.')
+                    flag = 1
+                    continue
 
-                    specfile = (path+'/data/'+spectrum_name)
+            if flag == 0:
 
-                    files = specfile
+                if tns_names[sc] == 'Not reported to TNS':
+                    print(ztfname + ' not reported to TNS yet.')
+                    continue
 
-                    specid = spectrum_info[1]
+                class_date = class_dates[sc]
+                classify = classifys[sc]
+                name = users[sc]
 
-                    a = get_spectrum_api(specid)
+                #if name == 'K. Hinds':
+                #    name == 'K. R. Hinds'
 
-                    inst = (a['data']['instrument_name'])
+                try:
+                    prior, type = check_TNS_class(ztfname, str(tns_names[sc])[3:])
+                except (RuntimeError, requests.exceptions.RequestException) as e:
+                    print(bcolors.FAIL + 'Could not check TNS for ' + ztfname + ' (' + str(e) + '), skipping.' + bcolors.ENDC)
+                    continue
 
-                    #pprint(a['data']['altdata'])
+                if prior != None:
+                    if type == fritz_to_TNS_class(classify):
+                        print(ztfname + ' already uploaded to TNS with same classification.')
+                        continue
+                    else:
+                        if classify == 'duplicate':
+                            print(ztfname + ' is a duplicate, continuing...')
+                            continue
 
-                    if inst == 'SEDM':
+                        if input(ztfname + ' classified on Fritz as ' + classify + ', submit another classification? [y/n] ') != 'y':
+                            continue
 
-                        auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
+                spectrum_info = write_ascii_file(ztfname) #returns "spectrum_name"
+                spectrum_name = spectrum_info[0]
 
-                        if name != 'S. ZTF':
-                            flag_1 = 0
-                            for au, auth in enumerate(auths):
-                                if name in auth:
-                                    auths = np.append(name, np.delete(auths, au))
-                                    flag_1 = 1
-                                    break
+                if spectrum_name != 'No Spectra Found' and spectrum_name != 'Resuming...':
 
-                            if flag_1 == 0:
-                                auths = np.append(name, auths)
+                    if flag == 0:
 
-                        classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
-                        source_group = 48 ### Require source group id from drop down list, 0 is for None
-                        spectypes = np.array(['object','host','sky','arcs','synthetic'])
+                        print(ztfname + '\t' + tns_names[sc] + '\t' + classify + '\t' + class_date)
 
-                        #proprietary_period = int(input("Proprietary period in years:", x)
-                        proprietary_period = '0'
-                        proprietary_units = "years"
-                        spec_comments =''
-                        classification_comments = ''
-                        spectype='object'
-                        spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+                        path = os.getcwd()
 
-                        header = (a['data']['altdata'])
-                        obsdate = header['UTC'].replace('T', ' ')
+                        specfile = (path+'/data/'+spectrum_name)
 
-                        classificationReport = TNSClassificationReport()
-                        classificationReport.name = get_IAUname(ztfname)[3:]
-                        classificationReport.fitsName = ''
-                        classificationReport.asciiName = spectrum_name
-                        classificationReport.classifierName = classifiers
-                        classificationReport.classificationID = get_TNS_classification_ID(classify)
-                        classificationReport.redshift = redshifts[red_index]
-                        classificationReport.classificationComments = classification_comments
-                        classificationReport.obsDate = obsdate
-                        classificationReport.instrumentID = get_TNS_instrument_ID(inst)
-                        classificationReport.expTime = (header['EXPTIME'])
-                        classificationReport.observers = 'SEDmRobot'
+                        files = specfile
 
-                        reducers = []
+                        specid = spectrum_info[1]
 
-                        for r in a['data']['reducers']:
-                            reducers.append(str(r['first_name'])+' '+str(r['last_name']))
+                        a = get_spectrum_api(specid)
 
-                        classificationReport.reducers = ', '.join(map(str, reducers))
+                        inst = (a['data']['instrument_name'])
 
-                        classificationReport.specTypeID = spectype_id
-                        classificationReport.spectrumComments = spec_comments
-                        classificationReport.groupID = source_group
-                        classificationReport.spec_proprietary_period_value = proprietary_period
-                        classificationReport.spec_proprietary_period_units = proprietary_units
+                        #pprint(a['data']['altdata'])
 
-                    elif inst == 'SPRAT':
+                        if inst == 'SEDM':
 
-                        auths = np.array(['D. Perley (LJMU)', 'W. Meynardie', 'M. Chu', 'K. R. Hinds', 'C. Fremling']) ### Change accordingly
+                            auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
 
-                        if name != 'S. ZTF':
-                            flag_1 = 0
-                            for au, auth in enumerate(auths):
-                                if name in auth:
-                                    auths = np.append(name, np.delete(auths, au))
-                                    flag_1 = 1
-                                    break
+                            if name != 'S. ZTF':
+                                flag_1 = 0
+                                for au, auth in enumerate(auths):
+                                    if name in auth:
+                                        auths = np.append(name, np.delete(auths, au))
+                                        flag_1 = 1
+                                        break
 
-                            if flag_1 == 0:
-                                auths = np.append(name, auths)
+                                if flag_1 == 0:
+                                    auths = np.append(name, auths)
 
-                        classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
-                        source_group = 48 ### Require source group id from drop down list, 0 is for None
-                        spectypes = np.array(['object','host','sky','arcs','synthetic'])
+                            classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
+                            source_group = 48 ### Require source group id from drop down list, 0 is for None
+                            spectypes = np.array(['object','host','sky','arcs','synthetic'])
 
-                        #proprietary_period = int(input("Proprietary period in years:", x)
-                        proprietary_period = '0'
-                        proprietary_units = "years"
-                        spec_comments =''
-                        classification_comments = ''
-                        spectype='object'
-                        spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+                            #proprietary_period = int(input("Proprietary period in years:", x)
+                            proprietary_period = '0'
+                            proprietary_units = "years"
+                            spec_comments =''
+                            classification_comments = ''
+                            spectype='object'
+                            spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
 
-                        header = (a['data']['altdata'])
+                            header = (a['data']['altdata'])
+                            obsdate = header['UTC'].replace('T', ' ')
 
-                        obsdate = a['data']['observed_at'].replace('T', ' ')
-
-                        classificationReport = TNSClassificationReport()
-                        classificationReport.name = get_IAUname(ztfname)[3:]
-                        classificationReport.fitsName = ''
-                        classificationReport.asciiName = spectrum_name
-                        classificationReport.classifierName = classifiers
-                        classificationReport.classificationID = get_TNS_classification_ID(classify)
-                        classificationReport.redshift = redshifts[red_index]
-                        classificationReport.classificationComments = classification_comments
-                        classificationReport.obsDate = obsdate
-                        classificationReport.instrumentID = get_TNS_instrument_ID(inst)
-                        if len(header) > 0:
+                            classificationReport = TNSClassificationReport()
+                            classificationReport.name = get_IAUname(ztfname)[3:]
+                            classificationReport.fitsName = ''
+                            classificationReport.asciiName = spectrum_name
+                            classificationReport.classifierName = classifiers
+                            classificationReport.classificationID = get_TNS_classification_ID(classify)
+                            classificationReport.redshift = redshifts[red_index]
+                            classificationReport.classificationComments = classification_comments
+                            classificationReport.obsDate = obsdate
+                            classificationReport.instrumentID = get_TNS_instrument_ID(inst)
                             classificationReport.expTime = (header['EXPTIME'])
-                        classificationReport.observers = 'LTRobot'
-                        classificationReport.reducers = 'D. Perley'
-                        classificationReport.specTypeID = spectype_id
-                        classificationReport.spectrumComments = spec_comments
-                        classificationReport.groupID = source_group
-                        classificationReport.spec_proprietary_period_value = proprietary_period
-                        classificationReport.spec_proprietary_period_units = proprietary_units
-
-                    elif inst == 'ALFOSC':
-
-                        auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
-
-                        if name != 'S. ZTF':
-                            flag_1 = 0
-                            for au, auth in enumerate(auths):
-                                if name in auth:
-                                    auths = np.append(name, np.delete(auths, au))
-                                    flag_1 = 1
-                                    break
-
-                            if flag_1 == 0:
-                                auths = np.append(name, auths)
-
-                        classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
-                        source_group = 48 ### Require source group id from drop down list, 0 is for None
-                        spectypes = np.array(['object','host','sky','arcs','synthetic'])
-
-                        #proprietary_period = int(input("Proprietary period in years:", x)
-                        proprietary_period = '0'
-                        proprietary_units = "years"
-                        spec_comments =''
-                        classification_comments = ''
-                        spectype='object'
-                        spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
-
-                        header = (a['data']['altdata'])
-                        obsdate = a['data']['observed_at'].replace('T', ' ')
-
-                        classificationReport = TNSClassificationReport()
-                        classificationReport.name = get_IAUname(ztfname)[3:]
-                        classificationReport.fitsName = ''
-                        classificationReport.asciiName = spectrum_name
-                        classificationReport.classifierName = classifiers
-                        classificationReport.classificationID = get_TNS_classification_ID(classify)
-                        classificationReport.redshift = redshifts[red_index]
-                        classificationReport.classificationComments = classification_comments
-                        classificationReport.obsDate = obsdate
-                        classificationReport.instrumentID = get_TNS_instrument_ID(inst)
-
-                        if 'EXPTIME' in header.keys():
-                            classificationReport.expTime = (header['EXPTIME'])
-
-                        observers = []
-
-                        for o in a['data']['observers']:
-                            observers.append(str(o['first_name'])+' '+str(o['last_name']))
-
-                        classificationReport.observers = ', '.join(map(str, observers))
-
-                        reducers = []
-
-                        for r in a['data']['reducers']:
-                            reducers.append(str(r['first_name'])+' '+str(r['last_name']))
-
-                        classificationReport.reducers = ', '.join(map(str, reducers))
-
-                        classificationReport.specTypeID = spectype_id
-                        classificationReport.spectrumComments = spec_comments
-                        classificationReport.groupID = source_group
-                        classificationReport.spec_proprietary_period_value = proprietary_period
-                        classificationReport.spec_proprietary_period_units = proprietary_units
-
-                    elif inst == 'DBSP' or inst == 'KAST':
-
-                        auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
-
-                        if name != 'S. ZTF':
-                            flag_1 = 0
-                            for au, auth in enumerate(auths):
-                                if name in auth:
-                                    auths = np.append(name, np.delete(auths, au))
-                                    flag_1 = 1
-                                    break
+                            classificationReport.observers = 'SEDmRobot'
+
+                            reducers = []
+
+                            for r in a['data']['reducers']:
+                                reducers.append(str(r['first_name'])+' '+str(r['last_name']))
+
+                            classificationReport.reducers = ', '.join(map(str, reducers))
+
+                            classificationReport.specTypeID = spectype_id
+                            classificationReport.spectrumComments = spec_comments
+                            classificationReport.groupID = source_group
+                            classificationReport.spec_proprietary_period_value = proprietary_period
+                            classificationReport.spec_proprietary_period_units = proprietary_units
+
+                        elif inst == 'SPRAT':
+
+                            auths = np.array(['D. Perley (LJMU)', 'W. Meynardie', 'M. Chu', 'K. R. Hinds', 'C. Fremling']) ### Change accordingly
+
+                            if name != 'S. ZTF':
+                                flag_1 = 0
+                                for au, auth in enumerate(auths):
+                                    if name in auth:
+                                        auths = np.append(name, np.delete(auths, au))
+                                        flag_1 = 1
+                                        break
+
+                                if flag_1 == 0:
+                                    auths = np.append(name, auths)
+
+                            classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
+                            source_group = 48 ### Require source group id from drop down list, 0 is for None
+                            spectypes = np.array(['object','host','sky','arcs','synthetic'])
+
+                            #proprietary_period = int(input("Proprietary period in years:", x)
+                            proprietary_period = '0'
+                            proprietary_units = "years"
+                            spec_comments =''
+                            classification_comments = ''
+                            spectype='object'
+                            spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+
+                            header = (a['data']['altdata'])
+
+                            obsdate = a['data']['observed_at'].replace('T', ' ')
+
+                            classificationReport = TNSClassificationReport()
+                            classificationReport.name = get_IAUname(ztfname)[3:]
+                            classificationReport.fitsName = ''
+                            classificationReport.asciiName = spectrum_name
+                            classificationReport.classifierName = classifiers
+                            classificationReport.classificationID = get_TNS_classification_ID(classify)
+                            classificationReport.redshift = redshifts[red_index]
+                            classificationReport.classificationComments = classification_comments
+                            classificationReport.obsDate = obsdate
+                            classificationReport.instrumentID = get_TNS_instrument_ID(inst)
+                            if len(header) > 0:
+                                classificationReport.expTime = (header['EXPTIME'])
+                            classificationReport.observers = 'LTRobot'
+                            classificationReport.reducers = 'D. Perley'
+                            classificationReport.specTypeID = spectype_id
+                            classificationReport.spectrumComments = spec_comments
+                            classificationReport.groupID = source_group
+                            classificationReport.spec_proprietary_period_value = proprietary_period
+                            classificationReport.spec_proprietary_period_units = proprietary_units
+
+                        elif inst == 'ALFOSC':
+
+                            auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
+
+                            if name != 'S. ZTF':
+                                flag_1 = 0
+                                for au, auth in enumerate(auths):
+                                    if name in auth:
+                                        auths = np.append(name, np.delete(auths, au))
+                                        flag_1 = 1
+                                        break
+
+                                if flag_1 == 0:
+                                    auths = np.append(name, auths)
+
+                            classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
+                            source_group = 48 ### Require source group id from drop down list, 0 is for None
+                            spectypes = np.array(['object','host','sky','arcs','synthetic'])
+
+                            #proprietary_period = int(input("Proprietary period in years:", x)
+                            proprietary_period = '0'
+                            proprietary_units = "years"
+                            spec_comments =''
+                            classification_comments = ''
+                            spectype='object'
+                            spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+
+                            header = (a['data']['altdata'])
+                            obsdate = a['data']['observed_at'].replace('T', ' ')
+
+                            classificationReport = TNSClassificationReport()
+                            classificationReport.name = get_IAUname(ztfname)[3:]
+                            classificationReport.fitsName = ''
+                            classificationReport.asciiName = spectrum_name
+                            classificationReport.classifierName = classifiers
+                            classificationReport.classificationID = get_TNS_classification_ID(classify)
+                            classificationReport.redshift = redshifts[red_index]
+                            classificationReport.classificationComments = classification_comments
+                            classificationReport.obsDate = obsdate
+                            classificationReport.instrumentID = get_TNS_instrument_ID(inst)
+
+                            if 'EXPTIME' in header.keys():
+                                classificationReport.expTime = (header['EXPTIME'])
+
+                            observers = []
+
+                            for o in a['data']['observers']:
+                                observers.append(str(o['first_name'])+' '+str(o['last_name']))
+
+                            classificationReport.observers = ', '.join(map(str, observers))
+
+                            reducers = []
+
+                            for r in a['data']['reducers']:
+                                reducers.append(str(r['first_name'])+' '+str(r['last_name']))
+
+                            classificationReport.reducers = ', '.join(map(str, reducers))
+
+                            classificationReport.specTypeID = spectype_id
+                            classificationReport.spectrumComments = spec_comments
+                            classificationReport.groupID = source_group
+                            classificationReport.spec_proprietary_period_value = proprietary_period
+                            classificationReport.spec_proprietary_period_units = proprietary_units
+
+                        elif inst == 'DBSP' or inst == 'KAST':
+
+                            auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
+
+                            if name != 'S. ZTF':
+                                flag_1 = 0
+                                for au, auth in enumerate(auths):
+                                    if name in auth:
+                                        auths = np.append(name, np.delete(auths, au))
+                                        flag_1 = 1
+                                        break
+
+                                if flag_1 == 0:
+                                    auths = np.append(name, auths)
+
+                            classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
+                            source_group = 48 ### Require source group id from drop down list, 0 is for None
+                            spectypes = np.array(['object','host','sky','arcs','synthetic'])
+
+                            #proprietary_period = int(input("Proprietary period in years:", x)
+                            proprietary_period = '0'
+                            proprietary_units = "years"
+                            spec_comments =''
+                            classification_comments = ''
+                            spectype='object'
+                            spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+
+                            obsdate = a['data']['observed_at'].replace('T', ' ')
 
-                            if flag_1 == 0:
-                                auths = np.append(name, auths)
+                            classificationReport = TNSClassificationReport()
+                            classificationReport.name = get_IAUname(ztfname)[3:]
+                            classificationReport.fitsName = ''
+                            classificationReport.asciiName = spectrum_name
+                            classificationReport.classifierName = classifiers
+                            classificationReport.classificationID = get_TNS_classification_ID(classify)
+                            classificationReport.redshift = redshifts[red_index]
+                            classificationReport.classificationComments = classification_comments
+                            classificationReport.obsDate = obsdate
+                            classificationReport.instrumentID = get_TNS_instrument_ID(inst)
+                            #classificationReport.expTime = '900'
+
+                            observers = []
 
-                        classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
-                        source_group = 48 ### Require source group id from drop down list, 0 is for None
-                        spectypes = np.array(['object','host','sky','arcs','synthetic'])
+                            for o in a['data']['observers']:
+                                observers.append(str(o['first_name'])+' '+str(o['last_name']))
 
-                        #proprietary_period = int(input("Proprietary period in years:", x)
-                        proprietary_period = '0'
-                        proprietary_units = "years"
-                        spec_comments =''
-                        classification_comments = ''
-                        spectype='object'
-                        spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+                            classificationReport.observers = ', '.join(map(str, observers))
 
-                        obsdate = a['data']['observed_at'].replace('T', ' ')
+                            reducers = []
 
-                        classificationReport = TNSClassificationReport()
-                        classificationReport.name = get_IAUname(ztfname)[3:]
-                        classificationReport.fitsName = ''
-                        classificationReport.asciiName = spectrum_name
-                        classificationReport.classifierName = classifiers
-                        classificationReport.classificationID = get_TNS_classification_ID(classify)
-                        classificationReport.redshift = redshifts[red_index]
-                        classificationReport.classificationComments = classification_comments
-                        classificationReport.obsDate = obsdate
-                        classificationReport.instrumentID = get_TNS_instrument_ID(inst)
-                        #classificationReport.expTime = '900'
+                            for r in a['data']['reducers']:
+                                reducers.append(str(r['first_name'])+' '+str(r['last_name']))
 
-                        observers = []
+                            classificationReport.reducers = ', '.join(map(str, reducers))
 
-                        for o in a['data']['observers']:
-                            observers.append(str(o['first_name'])+' '+str(o['last_name']))
+                            classificationReport.specTypeID = spectype_id
+                            classificationReport.spectrumComments = spec_comments
+                            classificationReport.groupID = source_group
+                            classificationReport.spec_proprietary_period_value = proprietary_period
+                            classificationReport.spec_proprietary_period_units = proprietary_units
 
-                        classificationReport.observers = ', '.join(map(str, observers))
+                        elif inst == 'LRIS':
 
-                        reducers = []
+                            auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
+
+                            if name != 'S. ZTF':
+                                flag_1 = 0
+                                for au, auth in enumerate(auths):
+                                    if name in auth:
+                                        auths = np.append(name, np.delete(auths, au))
+                                        flag_1 = 1
+                                        break
 
-                        for r in a['data']['reducers']:
-                            reducers.append(str(r['first_name'])+' '+str(r['last_name']))
+                                if flag_1 == 0:
+                                    auths = np.append(name, auths)
 
-                        classificationReport.reducers = ', '.join(map(str, reducers))
+                            classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
+                            source_group = 48 ### Require source group id from drop down list, 0 is for None
+                            spectypes = np.array(['object','host','sky','arcs','synthetic'])
 
-                        classificationReport.specTypeID = spectype_id
-                        classificationReport.spectrumComments = spec_comments
-                        classificationReport.groupID = source_group
-                        classificationReport.spec_proprietary_period_value = proprietary_period
-                        classificationReport.spec_proprietary_period_units = proprietary_units
+                            header = (a['data']['altdata'])
 
-                    elif inst == 'LRIS':
+                            #proprietary_period = int(input("Proprietary period in years:", x)
+                            proprietary_period = '0'
+                            proprietary_units = "years"
+                            spec_comments =''
+                            classification_comments = ''
+                            spectype='object'
+                            spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
 
-                        auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
+                            OBSDATE = a['data']['observed_at'].replace('T', ' ')
 
-                        if name != 'S. ZTF':
-                            flag_1 = 0
-                            for au, auth in enumerate(auths):
-                                if name in auth:
-                                    auths = np.append(name, np.delete(auths, au))
-                                    flag_1 = 1
-                                    break
+                            classificationReport = TNSClassificationReport()
+                            classificationReport.name = get_IAUname(ztfname)[3:]
+                            classificationReport.fitsName = ''
+                            classificationReport.asciiName = spectrum_name
+                            classificationReport.classifierName = classifiers
+                            classificationReport.classificationID = get_TNS_classification_ID(classify)
+                            classificationReport.redshift = redshifts[red_index]
+                            classificationReport.classificationComments = classification_comments
+                            classificationReport.obsDate = OBSDATE
+                            classificationReport.instrumentID = get_TNS_instrument_ID(inst)
+                            classificationReport.expTime = '300'
 
-                            if flag_1 == 0:
-                                auths = np.append(name, auths)
+                            observers = []
 
-                        classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
-                        source_group = 48 ### Require source group id from drop down list, 0 is for None
-                        spectypes = np.array(['object','host','sky','arcs','synthetic'])
+                            for o in a['data']['observers']:
+                                observers.append(str(o['first_name'])+' '+str(o['last_name']))
 
-                        header = (a['data']['altdata'])
+                            classificationReport.observers = ', '.join(map(str, observers))
 
-                        #proprietary_period = int(input("Proprietary period in years:", x)
-                        proprietary_period = '0'
-                        proprietary_units = "years"
-                        spec_comments =''
-                        classification_comments = ''
-                        spectype='object'
-                        spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+                            reducers = []
 
-                        OBSDATE = a['data']['observed_at'].replace('T', ' ')
+                            for r in a['data']['reducers']:
+                                reducers.append(str(r['first_name'])+' '+str(r['last_name']))
 
-                        classificationReport = TNSClassificationReport()
-                        classificationReport.name = get_IAUname(ztfname)[3:]
-                        classificationReport.fitsName = ''
-                        classificationReport.asciiName = spectrum_name
-                        classificationReport.classifierName = classifiers
-                        classificationReport.classificationID = get_TNS_classification_ID(classify)
-                        classificationReport.redshift = redshifts[red_index]
-                        classificationReport.classificationComments = classification_comments
-                        classificationReport.obsDate = OBSDATE
-                        classificationReport.instrumentID = get_TNS_instrument_ID(inst)
-                        classificationReport.expTime = '300'
+                            classificationReport.reducers = ', '.join(map(str, reducers))
 
-                        observers = []
+                            classificationReport.specTypeID = spectype_id
+                            classificationReport.spectrumComments = spec_comments
+                            classificationReport.groupID = source_group
+                            classificationReport.spec_proprietary_period_value = proprietary_period
+                            classificationReport.spec_proprietary_period_units = proprietary_units
 
-                        for o in a['data']['observers']:
-                            observers.append(str(o['first_name'])+' '+str(o['last_name']))
+                        elif inst == 'NIRES':
 
-                        classificationReport.observers = ', '.join(map(str, observers))
+                            auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
+
+                            if name != 'S. ZTF':
+                                flag_1 = 0
+                                for au, auth in enumerate(auths):
+                                    if name in auth:
+                                        auths = np.append(name, np.delete(auths, au))
+                                        flag_1 = 1
+                                        break
 
-                        reducers = []
+                                if flag_1 == 0:
+                                    auths = np.append(name, auths)
 
-                        for r in a['data']['reducers']:
-                            reducers.append(str(r['first_name'])+' '+str(r['last_name']))
+                            classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
+                            source_group = 48 ### Require source group id from drop down list, 0 is for None
+                            spectypes = np.array(['object','host','sky','arcs','synthetic'])
 
-                        classificationReport.reducers = ', '.join(map(str, reducers))
+                            header = (a['data']['altdata'])
 
-                        classificationReport.specTypeID = spectype_id
-                        classificationReport.spectrumComments = spec_comments
-                        classificationReport.groupID = source_group
-                        classificationReport.spec_proprietary_period_value = proprietary_period
-                        classificationReport.spec_proprietary_period_units = proprietary_units
+                            #proprietary_period = int(input("Proprietary period in years:", x)
+                            proprietary_period = '0'
+                            proprietary_units = "years"
+                            spec_comments =''
+                            classification_comments = ''
+                            spectype='object'
+                            spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
 
-                    elif inst == 'NIRES':
+                            OBSDATE = a['data']['observed_at'].replace('T', ' ')
 
-                        auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
-
-                        if name != 'S. ZTF':
-                            flag_1 = 0
-                            for au, auth in enumerate(auths):
-                                if name in auth:
-                                    auths = np.append(name, np.delete(auths, au))
-                                    flag_1 = 1
-                                    break
+                            classificationReport = TNSClassificationReport()
+                            classificationReport.name = get_IAUname(ztfname)[3:]
+                            classificationReport.fitsName = ''
+                            classificationReport.asciiName = spectrum_name
+                            classificationReport.classifierName = classifiers
+                            classificationReport.classificationID = get_TNS_classification_ID(classify)
+                            classificationReport.redshift = redshifts[red_index]
+                            classificationReport.classificationComments = classification_comments
+                            classificationReport.obsDate = OBSDATE
+                            classificationReport.instrumentID = get_TNS_instrument_ID(inst)
+                            #classificationReport.expTime = '300'
 
-                            if flag_1 == 0:
-                                auths = np.append(name, auths)
+                            observers = []
 
-                        classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
-                        source_group = 48 ### Require source group id from drop down list, 0 is for None
-                        spectypes = np.array(['object','host','sky','arcs','synthetic'])
+                            for o in a['data']['observers']:
+                                observers.append(str(o['first_name'])+' '+str(o['last_name']))
 
-                        header = (a['data']['altdata'])
+                            classificationReport.observers = ', '.join(map(str, observers))
 
-                        #proprietary_period = int(input("Proprietary period in years:", x)
-                        proprietary_period = '0'
-                        proprietary_units = "years"
-                        spec_comments =''
-                        classification_comments = ''
-                        spectype='object'
-                        spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+                            reducers = []
 
-                        OBSDATE = a['data']['observed_at'].replace('T', ' ')
+                            for r in a['data']['reducers']:
+                                reducers.append(str(r['first_name'])+' '+str(r['last_name']))
 
-                        classificationReport = TNSClassificationReport()
-                        classificationReport.name = get_IAUname(ztfname)[3:]
-                        classificationReport.fitsName = ''
-                        classificationReport.asciiName = spectrum_name
-                        classificationReport.classifierName = classifiers
-                        classificationReport.classificationID = get_TNS_classification_ID(classify)
-                        classificationReport.redshift = redshifts[red_index]
-                        classificationReport.classificationComments = classification_comments
-                        classificationReport.obsDate = OBSDATE
-                        classificationReport.instrumentID = get_TNS_instrument_ID(inst)
-                        #classificationReport.expTime = '300'
+                            classificationReport.reducers = ', '.join(map(str, reducers))
 
-                        observers = []
+                            classificationReport.specTypeID = spectype_id
+                            classificationReport.spectrumComments = spec_comments
+                            classificationReport.groupID = source_group
+                            classificationReport.spec_proprietary_period_value = proprietary_period
+                            classificationReport.spec_proprietary_period_units = proprietary_units
 
-                        for o in a['data']['observers']:
-                            observers.append(str(o['first_name'])+' '+str(o['last_name']))
+                        elif inst == 'GMOS_GS':
 
-                        classificationReport.observers = ', '.join(map(str, observers))
+                            auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
 
-                        reducers = []
+                            if name != 'S. ZTF':
+                                flag_1 = 0
+                                for au, auth in enumerate(auths):
+                                    if name in auth:
+                                        auths = np.append(name, np.delete(auths, au))
+                                        flag_1 = 1
+                                        break
 
-                        for r in a['data']['reducers']:
-                            reducers.append(str(r['first_name'])+' '+str(r['last_name']))
+                                if flag_1 == 0:
+                                    auths = np.append(name, auths)
 
-                        classificationReport.reducers = ', '.join(map(str, reducers))
+                            classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
+                            source_group = 48 ### Require source group id from drop down list, 0 is for None
+                            spectypes = np.array(['object','host','sky','arcs','synthetic'])
 
-                        classificationReport.specTypeID = spectype_id
-                        classificationReport.spectrumComments = spec_comments
-                        classificationReport.groupID = source_group
-                        classificationReport.spec_proprietary_period_value = proprietary_period
-                        classificationReport.spec_proprietary_period_units = proprietary_units
+                            header = (a['data']['altdata'])
 
-                    elif inst == 'GMOS_GS':
+                            #proprietary_period = int(input("Proprietary period in years:", x)
+                            proprietary_period = '0'
+                            proprietary_units = "years"
+                            spec_comments =''
+                            classification_comments = ''
+                            spectype='object'
+                            spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
 
-                        auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
+                            OBSDATE = a['data']['observed_at'].replace('T', ' ')
 
-                        if name != 'S. ZTF':
-                            flag_1 = 0
-                            for au, auth in enumerate(auths):
-                                if name in auth:
-                                    auths = np.append(name, np.delete(auths, au))
-                                    flag_1 = 1
-                                    break
+                            classificationReport = TNSClassificationReport()
+                            classificationReport.name = get_IAUname(ztfname)[3:]
+                            classificationReport.fitsName = ''
+                            classificationReport.asciiName = spectrum_name
+                            classificationReport.classifierName = classifiers
+                            classificationReport.classificationID = get_TNS_classification_ID(classify)
+                            classificationReport.redshift = redshifts[red_index]
+                            classificationReport.classificationComments = classification_comments
+                            classificationReport.obsDate = OBSDATE
+                            classificationReport.instrumentID = get_TNS_instrument_ID(inst)
+                            #classificationReport.expTime = '300'
 
-                            if flag_1 == 0:
-                                auths = np.append(name, auths)
+                            observers = []
 
-                        classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
-                        source_group = 48 ### Require source group id from drop down list, 0 is for None
-                        spectypes = np.array(['object','host','sky','arcs','synthetic'])
+                            for o in a['data']['observers']:
+                                observers.append(str(o['first_name'])+' '+str(o['last_name']))
 
-                        header = (a['data']['altdata'])
+                            classificationReport.observers = ', '.join(map(str, observers))
 
-                        #proprietary_period = int(input("Proprietary period in years:", x)
-                        proprietary_period = '0'
-                        proprietary_units = "years"
-                        spec_comments =''
-                        classification_comments = ''
-                        spectype='object'
-                        spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+                            reducers = []
 
-                        OBSDATE = a['data']['observed_at'].replace('T', ' ')
+                            for r in a['data']['reducers']:
+                                reducers.append(str(r['first_name'])+' '+str(r['last_name']))
 
-                        classificationReport = TNSClassificationReport()
-                        classificationReport.name = get_IAUname(ztfname)[3:]
-                        classificationReport.fitsName = ''
-                        classificationReport.asciiName = spectrum_name
-                        classificationReport.classifierName = classifiers
-                        classificationReport.classificationID = get_TNS_classification_ID(classify)
-                        classificationReport.redshift = redshifts[red_index]
-                        classificationReport.classificationComments = classification_comments
-                        classificationReport.obsDate = OBSDATE
-                        classificationReport.instrumentID = get_TNS_instrument_ID(inst)
-                        #classificationReport.expTime = '300'
+                            classificationReport.reducers = ', '.join(map(str, reducers))
 
-                        observers = []
+                            classificationReport.specTypeID = spectype_id
+                            classificationReport.spectrumComments = spec_comments
+                            classificationReport.groupID = source_group
+                            classificationReport.spec_proprietary_period_value = proprietary_period
+                            classificationReport.spec_proprietary_period_units = proprietary_units
 
-                        for o in a['data']['observers']:
-                            observers.append(str(o['first_name'])+' '+str(o['last_name']))
+                        elif inst == 'FLOYDS':
 
-                        classificationReport.observers = ', '.join(map(str, observers))
-
-                        reducers = []
-
-                        for r in a['data']['reducers']:
-                            reducers.append(str(r['first_name'])+' '+str(r['last_name']))
-
-                        classificationReport.reducers = ', '.join(map(str, reducers))
-
-                        classificationReport.specTypeID = spectype_id
-                        classificationReport.spectrumComments = spec_comments
-                        classificationReport.groupID = source_group
-                        classificationReport.spec_proprietary_period_value = proprietary_period
-                        classificationReport.spec_proprietary_period_units = proprietary_units
-
-                    elif inst == 'FLOYDS':
-
-                        auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
+                            auths = np.array(['W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
                         
-                        if name != 'S. ZTF':
-                            flag_1 = 0
-                            for au, auth in enumerate(auths):
-                                if name in auth:
-                                    auths = np.append(name, np.delete(auths, au))
-                                    flag_1 = 1
-                                    break
-
-                            if flag_1 == 0:
-                                auths = np.append(name, auths)
-
-                        classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
-                        source_group = 48 ### Require source group id from drop down list, 0 is for None
-                        spectypes = np.array(['object','host','sky','arcs','synthetic'])
-
-                        header = (a['data']['altdata'])
-
-                        #proprietary_period = int(input("Proprietary period in years:", x)
-                        proprietary_period = '0'
-                        proprietary_units = "years"
-                        spec_comments =''
-                        classification_comments = ''
-                        spectype='object'
-                        spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
-
-                        OBSDATE = a['data']['observed_at'].replace('T', ' ')
-
-                        classificationReport = TNSClassificationReport()
-                        classificationReport.name = get_IAUname(ztfname)[3:]
-                        classificationReport.fitsName = ''
-                        classificationReport.asciiName = spectrum_name
-                        classificationReport.classifierName = classifiers
-                        classificationReport.classificationID = get_TNS_classification_ID(classify)
-                        classificationReport.redshift = redshifts[red_index]
-                        classificationReport.classificationComments = classification_comments
-                        classificationReport.obsDate = OBSDATE
-                        classificationReport.expTime = (header['EXPTIME']['value'])
-                        classificationReport.instrumentID = get_TNS_instrument_ID(inst)
-                        #classificationReport.expTime = '300'
-
-                        observers = []
-
-                        for o in a['data']['observers']:
-                            observers.append(str(o['first_name'])+' '+str(o['last_name']))
-
-                        classificationReport.observers = ', '.join(map(str, observers))
-
-                        reducers = []
-
-                        for r in a['data']['reducers']:
-                            reducers.append(str(r['first_name'])+' '+str(r['last_name']))
-
-                        classificationReport.reducers = ', '.join(map(str, reducers))
-
-                        classificationReport.specTypeID = spectype_id
-                        classificationReport.spectrumComments = spec_comments
-                        classificationReport.groupID = source_group
-                        classificationReport.spec_proprietary_period_value = proprietary_period
-                        classificationReport.spec_proprietary_period_units = proprietary_units
-
-                    elif inst == 'DIS':
-
-                        auths = np.array(['M. Graham (UW)', 'W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
-
-                        if name != 'S. ZTF':
-                            flag_1 = 0
-                            for au, auth in enumerate(auths):
-                                if name in auth:
-                                    auths = np.append(name, np.delete(auths, au))
-                                    flag_1 = 1
-                                    break
-
-                            if flag_1 == 0:
-                                auths = np.append(name, auths)
-
-                        classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
-                        source_group = 48 ### Require source group id from drop down list, 0 is for None
-                        spectypes = np.array(['object','host','sky','arcs','synthetic'])
-                        #proprietary_period = int(input("Proprietary period in years:", x)
-                        proprietary_period = '0'
-                        proprietary_units = "years"
-                        spec_comments =''
-                        classification_comments = ''
-                        spectype='object'
-                        spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
-
-                        #obsdate = APO(specid)[0]
-                        #exptime = APO(specid)[1]
-                        #observers = APO(specid)[2]
-                        #reducers = APO(specid)[3]
-
-                        obsdate = a['data']['observed_at'].replace('T', ' ')
-
-                        classificationReport = TNSClassificationReport()
-                        classificationReport.name = get_IAUname(ztfname)[3:]
-                        classificationReport.fitsName = ''
-                        classificationReport.asciiName = spectrum_name
-                        classificationReport.classifierName = classifiers
-                        classificationReport.classificationID = get_TNS_classification_ID(classify)
-                        classificationReport.redshift = redshifts[red_index]
-                        classificationReport.classificationComments = classification_comments
-                        classificationReport.obsDate = obsdate
-                        classificationReport.instrumentID = get_TNS_instrument_ID(inst)
-                        #classificationReport.expTime = exptime
-                        #classificationReport.observers = observers
-                        #classificationReport.reducers = reducers
-
-                        observers = []
-
-                        for o in a['data']['observers']:
-                            observers.append(str(o['first_name'])+' '+str(o['last_name']))
-
-                        classificationReport.observers = ', '.join(map(str, observers))
-
-                        reducers = []
-
-                        for r in a['data']['reducers']:
-                            reducers.append(str(r['first_name'])+' '+str(r['last_name']))
-
-                        classificationReport.reducers = ', '.join(map(str, reducers))
-
-                        classificationReport.specTypeID = spectype_id
-                        classificationReport.spectrumComments = spec_comments
-                        classificationReport.groupID = source_group
-                        classificationReport.spec_proprietary_period_value = proprietary_period
-                        classificationReport.spec_proprietary_period_units = proprietary_units
+                            if name != 'S. ZTF':
+                                flag_1 = 0
+                                for au, auth in enumerate(auths):
+                                    if name in auth:
+                                        auths = np.append(name, np.delete(auths, au))
+                                        flag_1 = 1
+                                        break
+
+                                if flag_1 == 0:
+                                    auths = np.append(name, auths)
+
+                            classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
+                            source_group = 48 ### Require source group id from drop down list, 0 is for None
+                            spectypes = np.array(['object','host','sky','arcs','synthetic'])
+
+                            header = (a['data']['altdata'])
+
+                            #proprietary_period = int(input("Proprietary period in years:", x)
+                            proprietary_period = '0'
+                            proprietary_units = "years"
+                            spec_comments =''
+                            classification_comments = ''
+                            spectype='object'
+                            spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+
+                            OBSDATE = a['data']['observed_at'].replace('T', ' ')
+
+                            classificationReport = TNSClassificationReport()
+                            classificationReport.name = get_IAUname(ztfname)[3:]
+                            classificationReport.fitsName = ''
+                            classificationReport.asciiName = spectrum_name
+                            classificationReport.classifierName = classifiers
+                            classificationReport.classificationID = get_TNS_classification_ID(classify)
+                            classificationReport.redshift = redshifts[red_index]
+                            classificationReport.classificationComments = classification_comments
+                            classificationReport.obsDate = OBSDATE
+                            classificationReport.expTime = (header['EXPTIME']['value'])
+                            classificationReport.instrumentID = get_TNS_instrument_ID(inst)
+                            #classificationReport.expTime = '300'
+
+                            observers = []
+
+                            for o in a['data']['observers']:
+                                observers.append(str(o['first_name'])+' '+str(o['last_name']))
+
+                            classificationReport.observers = ', '.join(map(str, observers))
+
+                            reducers = []
+
+                            for r in a['data']['reducers']:
+                                reducers.append(str(r['first_name'])+' '+str(r['last_name']))
+
+                            classificationReport.reducers = ', '.join(map(str, reducers))
+
+                            classificationReport.specTypeID = spectype_id
+                            classificationReport.spectrumComments = spec_comments
+                            classificationReport.groupID = source_group
+                            classificationReport.spec_proprietary_period_value = proprietary_period
+                            classificationReport.spec_proprietary_period_units = proprietary_units
+
+                        elif inst == 'DIS':
+
+                            auths = np.array(['M. Graham (UW)', 'W. Meynardie', 'M. Chu', 'C. Fremling (Caltech)']) ### Change accordingly
+
+                            if name != 'S. ZTF':
+                                flag_1 = 0
+                                for au, auth in enumerate(auths):
+                                    if name in auth:
+                                        auths = np.append(name, np.delete(auths, au))
+                                        flag_1 = 1
+                                        break
+
+                                if flag_1 == 0:
+                                    auths = np.append(name, auths)
+
+                            classifiers = ', '.join(map(str, auths)) + ' on behalf of the Zwicky Transient Facility (ZTF)'
+                            source_group = 48 ### Require source group id from drop down list, 0 is for None
+                            spectypes = np.array(['object','host','sky','arcs','synthetic'])
+                            #proprietary_period = int(input("Proprietary period in years:", x)
+                            proprietary_period = '0'
+                            proprietary_units = "years"
+                            spec_comments =''
+                            classification_comments = ''
+                            spectype='object'
+                            spectype_id = ['object', 'host', 'sky', 'arcs', 'synthetic'].index(spectype) + 1
+
+                            #obsdate = APO(specid)[0]
+                            #exptime = APO(specid)[1]
+                            #observers = APO(specid)[2]
+                            #reducers = APO(specid)[3]
+
+                            obsdate = a['data']['observed_at'].replace('T', ' ')
+
+                            classificationReport = TNSClassificationReport()
+                            classificationReport.name = get_IAUname(ztfname)[3:]
+                            classificationReport.fitsName = ''
+                            classificationReport.asciiName = spectrum_name
+                            classificationReport.classifierName = classifiers
+                            classificationReport.classificationID = get_TNS_classification_ID(classify)
+                            classificationReport.redshift = redshifts[red_index]
+                            classificationReport.classificationComments = classification_comments
+                            classificationReport.obsDate = obsdate
+                            classificationReport.instrumentID = get_TNS_instrument_ID(inst)
+                            #classificationReport.expTime = exptime
+                            #classificationReport.observers = observers
+                            #classificationReport.reducers = reducers
+
+                            observers = []
+
+                            for o in a['data']['observers']:
+                                observers.append(str(o['first_name'])+' '+str(o['last_name']))
+
+                            classificationReport.observers = ', '.join(map(str, observers))
+
+                            reducers = []
+
+                            for r in a['data']['reducers']:
+                                reducers.append(str(r['first_name'])+' '+str(r['last_name']))
+
+                            classificationReport.reducers = ', '.join(map(str, reducers))
+
+                            classificationReport.specTypeID = spectype_id
+                            classificationReport.spectrumComments = spec_comments
+                            classificationReport.groupID = source_group
+                            classificationReport.spec_proprietary_period_value = proprietary_period
+                            classificationReport.spec_proprietary_period_units = proprietary_units
+
+                        else:
+
+                            print(inst + ' not in list of instruments, please add to code.')
+                            continue
+
+                        pprint(classificationReport.fill(), tab='  ')
+                        proceed = input("\nProceed with classification and upload? ([y]/n) : ")
+                        if proceed == 'y' and not proceed.strip() == '':
+                            approved.add(ztfname, classificationReport, files)
 
-                    else:
-
-                        print(inst + ' not in list of instruments, please add to code.')
-                        continue
+                            if len(approved.sources) >= tns_report_size:
+                                batch, approved = approved, TNSBulkReport() # Cleared first, so nothing is sent twice if the run stops
+                                submit_classifications(batch, poller)
+    finally:
+        stop_prefetch()
 
-                    pprint(classificationReport.fill(), tab='  ')
-                    proceed = input("\nProceed with classification and upload? ([y]/n) : ")
-                    if proceed == 'y' and not proceed.strip() == '':
-
-                        #ASCII FILE UPLOAD
-                        print("\n")
-                        response = upload_to_TNS(files)
-                        print(response)
+        # Classifications already approved are sent, and every report confirmed, even if the review stops early
+        try:
+            submit_classifications(approved, poller)
+
+            print(bcolors.OKCYAN + 'Waiting for TNS to confirm the reports...' + bcolors.ENDC)
+            poller.wait()
+        finally:
+            poller.close()
+
+def check_TNS_class(ztfname, tns_name=None):
+
+    ''' Info : Checks the TNS object (through the TNS object cache) for an existing classification. The TNS get/object reply (requested
+               with spectra='1') gives the current classification as object_type {'id', 'name'}, and each classification spectrum with the
+               group that reported it as source_group {'id', 'name'}. The group is taken from the most recent spectrum (by obsdate), as in
+               the Source Group column of the object page. reporting_group is the discovery group, so it is not used.
+        Input : ZTFname, TNS name without prefix (looked up if None)
+        Returns : Group that reported the classification ('Unknown group' if TNS lists no classification spectrum) and the type,
+                  or None, None if the object is not classified
+        Raises : RuntimeError if TNS could not be asked
+    '''
 
-                        if not response:
-                            print("File upload didn't work")
-                            print(response)
-                            #return False
+    if tns_name == None:
+        tns_name = get_IAUname(ztfname)[3:]
 
-                        print(response['id_code'], response['id_message'],
-                              "\nSuccessfully uploaded ascii spectrum")
-                        #classificationReport.asciiName = response['data'][-1]
+    reply = get_TNS_object(tns_name)
 
-                        report_id = tns_classify(classificationReport)
-                        if tns_feedback(report_id) == True:
-                            post_comment(ztfname, 'Uploaded to TNS')
+    if reply == None:
+        return None, None
 
-def check_TNS_class(ztfname):
+    type = (reply.get('object_type') or {}).get('name')
 
-    ''' Info : Checks TNS page for other classification reports
-        Input : ZTFname
-        Returns : Group that reported classification
-    '''
+    if type in [None, '']:
+        return None, None
 
-    tns_name = get_IAUname(ztfname)[3:]
-    data = {'api_key' : API_KEY}
-    headers={'User-Agent':'tns_marker{"tns_id":'+str(YOUR_BOT_ID)+', "type":"bot", "name":"'+YOUR_BOT_NAME+'"}'}
-    response = requests.get('https://www.wis-tns.org/object/'+tns_name, headers=headers, data=data)
-    class_data = response.text.split('Classification Reports', 2)[1]
+    spectra = reply.get('spectra') or []
 
-    if 'no-data' in class_data.split('class="clear"')[0]:
-        return None, None
+    if len(spectra) == 0:
+        print(ztfname + ' classified as ' + type + ' on TNS.')
+        return 'Unknown group', type
 
-    class_info = class_data.split('class="odd"')[1]
+    spectrum = max(spectra, key=lambda s: s['obsdate'])
+    group = (spectrum.get('source_group') or {}).get('name') or 'Unknown group'
 
-    print(ztfname + ' classified as ' + class_info.split('"cell-type">')[1].split('<')[0] + ' by ' + class_info.split('"cell-user_name">')[1].split('<')[0] + ' at ' +
-          class_info.split('"cell-time_received">')[1].split('<')[0] + '.')
+    print(ztfname + ' classified as ' + type + ' by ' + group + ' (spectrum from ' + spectrum['obsdate'] + ').')
 
-    return class_info.split('"cell-source_group_name">')[1].split('<')[0], class_info.split('"cell-type">')[1].split('<')[0]
+    return group, type
 
 def edit_comment(ztfname, comment_id, author_id, text, attach=None, attach_name=None):
 
@@ -945,6 +1425,35 @@ def edit_comment(ztfname, comment_id, author_id, text, attach=None, attach_name=
 
     return response
 
+def fetch_TNS_object(tns_name):
+
+    ''' Info : Requests an object with its classification spectra from the TNS object API (get_TNS_object goes through the cache)
+        Input : TNS name without prefix
+        Returns : object reply dictionary, or None if TNS has no such object
+        Raises : RuntimeError if TNS did not answer the lookup
+    '''
+
+    data = {'api_key': API_KEY, 'data': json.dumps({'objname': tns_name, 'spectra': '1'})}
+    response = tns_session.request('POST', TNS_BASE_URL+'get/object', data=data)
+
+    try:
+        response = response.json()
+    except ValueError:
+        raise RuntimeError('TNS object lookup of ' + tns_name + ' failed: ' + str(response.status_code) + ' ' + response.text[:200])
+
+    if response.get('id_code') == 404:
+        return None
+
+    if response.get('id_code') != 200:
+        raise RuntimeError('TNS object lookup of ' + tns_name + ' failed: ' + str(response.get('id_code')) + ' ' + str(response.get('id_message')))
+
+    reply = (response.get('data') or {}).get('reply') or {}
+
+    if len(reply) == 0 or isinstance(reply.get('name'), dict):
+        return None # Empty reply, or a reply saying the object does not exist
+
+    return reply
+
 def fritz_to_TNS_class(classification):
 
     ''' Info : Converts Fritz classification name to TNS classification name (e.g. 'Ia' --> 'SN Ia')
@@ -1148,9 +1657,10 @@ def get_classification(source, man=False):
 
 def get_IAUname(ztfname):
 
-    ''' Info : Query the TNS name for any source
+    ''' Info : Query the TNS name for any source (Fritz cross-match, then the local TNS name index, then a TNS search)
         Input : ZTFname
         Returns : ATname
+        Raises : RuntimeError if TNS does not answer the search
     '''
 
     url = BASEURL + 'api/alerts_aux/' + ztfname
@@ -1160,6 +1670,12 @@ def get_IAUname(ztfname):
     if status != 404 and len(response['data'].get('cross_matches', {}).get('TNS',[])) != 0:
         return response['data']['cross_matches']['TNS'][0]['name']
 
+    # Objects discovered in the current window are resolved from the local index, TNS is only searched for the rest
+    name = tns_index.lookup(ztfname)
+
+    if name != None:
+        return name
+
     req_data = {
         "ra": "",
         "dec": "",
@@ -1173,28 +1689,54 @@ def get_IAUname(ztfname):
     }
 
     data = {'api_key' : API_KEY, 'data' : json.dumps(req_data)}
-    headers={'User-Agent':'tns_marker{"tns_id":'+str(YOUR_BOT_ID)+', "type":"bot", "name":"'+YOUR_BOT_NAME+'"}'}
-    #pprint(headers)
 
-    while True:
-        try:
-            response_tns = requests.post('https://www.wis-tns.org/api/get/search', headers=headers, data=data)
-        except requests.exceptions.ConnectionError:
-            continue
+    for attempt in range(tns_max_retries):
+        # Waits for the rate limit to reset if needed, rather than retrying every second
+        response_tns = tns_session.request('POST', 'https://www.wis-tns.org/api/get/search', data=data)
 
         try:
-            if json.loads(response_tns.text)['id_code'] == 429:
-                sleep(1)
-            else:
-                break
-        except json.decoder.JSONDecodeError:
-            print(response_tns.text)
+            reply = json.loads(response_tns.text)['data']['reply']
+            break
+        except (json.decoder.JSONDecodeError, KeyError, TypeError):
+            # An error page is not an answer, so the source is not marked as unreported
+            print(bcolors.WARNING + 'TNS search for ' + ztfname + ' failed (' + str(response_tns.status_code) + '), retrying...' + bcolors.ENDC)
+            time.sleep(2**attempt)
+    else:
+        raise RuntimeError('TNS search for ' + ztfname + ' failed: ' + response_tns.text[:200])
 
-    if len(json.loads(response_tns.text)['data']['reply']) != 0:
-        return json.loads(response_tns.text)['data']['reply'][0]['prefix'] + ' ' + json.loads(response_tns.text)['data']['reply'][0]['objname']
+    if len(reply) != 0:
+        return reply[0]['prefix'] + ' ' + reply[0]['objname']
 
     return 'Not reported to TNS'
 
+def get_last_detection(ztfname):
+
+    ''' Info : Retrieves the time of the latest detection of a source, used to tell whether stored photometry is current
+        Input : ZTFname
+        Returns : MJD of the last detection, or None if Fritz does not report one
+    '''
+
+    status, response = api('GET', BASEURL+'api/sources/'+ztfname, params=detection_params, timeout=10)
+
+    return last_detection_mjd(response)
+
+def get_latest_spectrum_id(ztfname):
+
+    ''' Info : Selects the most recently observed spectrum of a source without prompting the user
+        Input : ZTFname
+        Returns : spectrum ID on Fritz, or "No Spectra Found"
+    '''
+
+    url = BASEURL+'api/sources/'+ztfname+'/spectra'
+    status, response = api('GET',url)
+
+    spectra = response['data']['spectra']
+
+    if len(spectra) == 0:
+        return "No Spectra Found"
+
+    return max(spectra, key=lambda spectrum: spectrum['observed_at'])['id']
+
 def get_number(group_id, date):
     ''' Info : Query number of sources saved in a group after a certain date
         Input : group id, date [yyyy-mm-dd]
@@ -1383,11 +1925,15 @@ def get_source_api(ztfname):
     '''
     url = BASEURL+'api/sources/'+ztfname+'?includeComments=true'
 
+    cached = True
+
     while True:
         try:
-            status, response = api('GET',url, timeout=30)
+            status, response = api('GET',url, timeout=30, cached=cached)
             return response['data']
         except KeyError:
+            cached = False # Ask Fritz again rather than the prefetcher
+            time.sleep(5)
             continue
         except requests.exceptions.Timeout:
             print('Timeout...')
@@ -1413,6 +1959,15 @@ def get_spectrum_api(spectrum_id):
     status, response = api('GET',url)
     return response
 
+def get_TNS_object(tns_name):
+
+    ''' Info : Looks up an object with the TNS object API, including its classification spectra (cached for tns_object_ttl hours)
+        Input : TNS name without prefix (e.g. 2021abc)
+        Returns : object reply dictionary, or None if TNS has no such object
+    '''
+
+    return tns_objects.get(tns_name, lambda: fetch_TNS_object(tns_name))
+
 def get_TNS_classification_ID(classification):
 
     ''' Info : Retrieves TNS classification ID based on Fritz classification
@@ -1453,6 +2008,18 @@ def get_total_number_of_sources(group_id):
     status, response = api('GET',url)
     return len(response['data']['sources'])
 
+def last_detection_mjd(response):
+
+    ''' Info : Reads the latest detection time from a source response requested with detection_params
+        Input : API response
+        Returns : MJD, or None if not present
+    '''
+
+    try:
+        return Time(response['data']['last_detected_at'].replace('Z', ''), format='isot', scale='utc').mjd
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return None
+
 def post_comment(ztfname, text, attach=None, attach_name=None):
 
     ''' Info : Posts a comment on transient's Fritz page
@@ -1474,6 +2041,9 @@ def post_comment(ztfname, text, attach=None, attach_name=None):
 
     status, response = api('POST', url, data=data)
 
+    if isinstance(response, dict) and response.get('status') == 'success':
+        ledger.record_comment(ztfname, text)
+
     return response
 
 def pprint(*args, **kwargs):
@@ -1486,6 +2056,21 @@ def pprint(*args, **kwargs):
     """
     print(get_pprint(*args, **kwargs))
 
+def prefetch_TNS_objects(tns_names):
+
+    ''' Info : Looks up the TNS objects of a run's candidates in parallel (within the TNS rate limit), so check_TNS_class answers from the cache
+        Input : list of TNS names as in the source file (e.g. SN 2021abc, or 'Not reported to TNS')
+        Returns : None
+    '''
+
+    names = [str(name)[3:] for name in tns_names if name != 'Not reported to TNS']
+
+    with ThreadPoolExecutor(max_workers=tns_object_workers) as executor:
+        try:
+            tns_objects.prefetch(names, fetch_TNS_object, executor)
+        except Exception as e:
+            print(bcolors.WARNING + 'TNS object lookups failed (' + str(e) + '), checking sources one at a time.' + bcolors.ENDC)
+
 def read_ascii(f, startd):
 
     ''' Info : Reads ASCII table for classified or saved transients passed specified date
@@ -1556,6 +2141,8 @@ def sourceclassification(outfile, dat=str(datetime.datetime.utcnow().date() - da
     num_tot = get_number(groupnum, dat)
     #print(num_tot)
 
+    start_tns_index(dat)
+
     num_pages = int(num_tot/50) + 1
     #print(num_pages)
 
@@ -1577,7 +2164,7 @@ def sourceclassification(outfile, dat=str(datetime.datetime.utcnow().date() - da
             group = [group for group in response['data']['sources'][i]['groups'] if group['id'] == GROUPNUM][0]
             saved_date = group['saved_at']
             classification, prob, date, user = get_classification(response['data']['sources'][i])
-            IAU = get_IAUname(source_name)
+            IAU = get_IAUname(source_name) # Fritz cross-match first, then the local TNS name index, then a TNS search
             red = str(get_redshift(response['data']['sources'][i]))
 
             srcs.append(source_name)
@@ -1596,6 +2183,139 @@ def sourceclassification(outfile, dat=str(datetime.datetime.utcnow().date() - da
 
     f.close()
 
+def start_prefetch(sources, depth=3, photometry=False):
+
+    ''' Info : Starts loading Fritz data for upcoming sources in the background, replacing any previous prefetcher.
+               Call advance(i) on the result when moving to the i-th source, and stop_prefetch() when done.
+        Input : list of sources in the order they will be processed, number of sources to load ahead, whether to load photometry
+        Returns : Prefetcher
+    '''
+
+    global prefetcher
+
+    stop_prefetch()
+
+    prefetcher = Prefetcher(sources, depth=depth, photometry=photometry)
+
+    return prefetcher
+
+def start_tns_index(since):
+
+    ''' Info : Builds the local TNS name index for sources saved after a date, from the TNS public objects list (downloaded at most daily)
+        Input : date the sources were saved after (YYYY-MM-DD)
+        Returns : None
+    '''
+
+    window = str(datetime.datetime.strptime(str(since)[:10], '%Y-%m-%d').date() - datetime.timedelta(days=tns_index_margin))
+
+    def fetch():
+        response = tns_session.request('POST', tns_public_csv_url, data={'api_key': API_KEY}, timeout=300)
+        response.raise_for_status()
+        return response.content
+
+    try:
+        n = tns_index.build(window, fetch)
+        print(bcolors.OKCYAN + 'Indexed ' + str(n) + ' TNS internal names discovered since ' + window + '.' + bcolors.ENDC)
+    except Exception as e:
+        print(bcolors.WARNING + 'Could not build the TNS name index (' + str(e) + '), searching TNS for each source.' + bcolors.ENDC)
+
+def stop_prefetch():
+
+    ''' Info : Stops the active prefetcher, if any
+        Input : None
+        Returns : None
+    '''
+
+    global prefetcher
+
+    if prefetcher != None:
+        prefetcher.close()
+        prefetcher = None
+
+def submit_chunk(chunk, poller=None):
+
+    ''' Info : Submits one bulk report of at most tns_report_size classifications (see submit_classifications)
+        Input : TNSBulkReport, FeedbackPoller to hand the report to (if None, waits for its feedback here)
+        Returns : list of the sources that were accepted
+    '''
+
+    accepted = []
+
+    #ASCII FILE UPLOAD
+    try:
+        response = upload_to_TNS(chunk.files)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        # Uploads are not resent (see TNSClient.request), but no report refers to the files yet, so the sources can simply be sent again
+        print(bcolors.FAIL + 'Spectrum upload for ' + ', '.join(chunk.sources) + ' got no reply (' + str(e) + '), not reported to TNS.' + bcolors.ENDC)
+        return accepted
+
+    if not response or response['id_code'] != 200:
+        print(bcolors.FAIL + "File upload didn't work" + bcolors.ENDC)
+        print(response)
+        return accepted
+
+    print(response['id_code'], response['id_message'], "\nSuccessfully uploaded ascii spectra")
+
+    # TNS returns the names it stored the files under, in the order they were sent
+    if len(response.get('data', [])) == len(chunk.files):
+        for report, name in zip(chunk.reports, response['data']):
+            report.asciiName = name
+
+    try:
+        report_id = tns_classify(chunk)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        # TNS may have filed the report before the connection dropped, so it is neither resent nor counted as failed
+        print(bcolors.FAIL + 'Report of ' + ', '.join(chunk.sources) + ' got no reply (' + str(e) + '). Whether TNS received it is unknown, '
+              'check TNS before submitting these sources again.' + bcolors.ENDC)
+        return accepted
+
+    if report_id == False:
+        return accepted
+
+    for report in chunk.reports:
+        tns_objects.drop(report.name) # Their classification reports are changing
+
+    for source in chunk.sources:
+        ledger.record(source, 'tns_submitted', str(report_id))
+
+    if poller != None:
+        poller.watch(report_id, chunk.sources)
+        return accepted
+
+    for source, ok in zip(chunk.sources, tns_feedback(report_id, len(chunk.sources))):
+        if ok:
+            post_comment(source, 'Uploaded to TNS')
+            accepted.append(source)
+        else:
+            print(bcolors.FAIL + source + ' was not accepted by TNS.' + bcolors.ENDC)
+
+    return accepted
+
+def submit_classifications(bulk, poller=None):
+
+    ''' Info : Submits the classifications of a bulk report to TNS, tns_report_size at a time: uploads their spectra together, sends one bulk
+               report, then posts 'Uploaded to TNS' on each source whose entry TNS accepted
+        Input : TNSBulkReport, FeedbackPoller to hand the reports to (if None, waits for each report's feedback here)
+        Returns : list of the sources that were accepted (empty when a poller is given, it confirms them later)
+    '''
+
+    accepted = []
+
+    for lo in range(0, len(bulk.sources), tns_report_size):
+        chunk = TNSBulkReport()
+        for i in range(lo, min(lo + tns_report_size, len(bulk.sources))):
+            chunk.add(bulk.sources[i], bulk.reports[i], bulk.files[i])
+
+        print(bcolors.OKCYAN + 'Submitting ' + ', '.join(chunk.sources) + ' to TNS.' + bcolors.ENDC)
+
+        # A chunk that fails is reported and the rest are still sent
+        try:
+            accepted += submit_chunk(chunk, poller)
+        except Exception as e:
+            print(bcolors.FAIL + 'Submitting ' + ', '.join(chunk.sources) + ' failed: ' + str(e) + bcolors.ENDC)
+
+    return accepted
+
 def submit_fritz_class(ztfname, clas):
 
     ''' Info : Uploads classification to Fritz
@@ -1630,6 +2350,17 @@ def submit_fritz_redshift(ztfname, redshift,redshift_err):
 
     return response
 
+def success(result):
+
+    ''' Info : Checks whether a Fritz API reply succeeded
+        Input : (status, response) as returned by api()
+        Returns : True or False
+    '''
+
+    status, response = result
+
+    return 200 <= status < 300 and isinstance(response, dict) and response.get('status') == 'success'
+
 def tns_classify(classificationReport, base_url= report_url, api_key=API_KEY):
 
     ''' Info : Uploads classification report to TNS
@@ -1639,10 +2370,8 @@ def tns_classify(classificationReport, base_url= report_url, api_key=API_KEY):
 
     url = base_url
 
-    headers={'User-Agent':'tns_marker{"tns_id":'+str(YOUR_BOT_ID)+', "type":"bot", "name":"'+YOUR_BOT_NAME+'"}'}
-
     data = {'api_key' : api_key, 'data' : classificationReport.as_json()}
-    response = requests.post(url, headers=headers, data=data).json()
+    response = tns_session.request('POST', url, data=data, retry=False).json() # Not resent on a timeout, TNS may have filed it
     if not response:
         return False
 
@@ -1658,66 +2387,99 @@ def tns_classify(classificationReport, base_url= report_url, api_key=API_KEY):
         print("re-submit classification, but don't re-upload files")
         return False
 
-def tns_feedback(report_id):
+def tns_entries(response, n, unmatched=False):
+
+    ''' Info : Reads the per-entry feedback of a bulk classification report. An entry is accepted only if every code TNS gave for it is in
+               tns_entry_ok.
+        Input : bulk-report-reply response, number of entries in the report, whether to count the entries as accepted if the feedback
+                cannot be matched to them (True only for a report TNS accepted as a whole)
+        Returns : list with, for each entry, whether TNS accepted it
+    '''
+
+    try:
+        entries = response['data']['feedback']['classification_report']
+    except (KeyError, TypeError):
+        return [unmatched]*n
+
+    if type(entries) == dict:
+        entries = [entries[k] for k in sorted(entries, key=int)]
+
+    if len(entries) != n:
+        return [unmatched]*n
+
+    return [len(entry) > 0 and all(code in tns_entry_ok for code in entry) for entry in entries]
 
-    ''' Info : Verifies that report has been uploaded
+def tns_feedback(report_id, n=1):
+
+    ''' Info : Verifies that report has been uploaded, checking with a growing wait until TNS has processed it or tns_poll_timeout has passed
+        Input : ID of report, number of entries in the report
+        Returns : list with, for each entry, whether it was accepted
+    '''
+
+    start = time.time()
+    wait = tns_poll_wait
+
+    while True:
+        feedback_code, response = tns_reply(report_id)
+
+        print(feedback_code, response['id_message'], "feedback finished")
+        if feedback_code == 200:
+            print(bcolors.OKGREEN + 'Feedback successful. Continuing...' + bcolors.ENDC)
+            return tns_entries(response, n, unmatched=True)
+        elif feedback_code == 404:
+            if time.time() - start > tns_poll_timeout:
+                print(bcolors.FAIL + 'No feedback after ' + str(tns_poll_timeout) + ' s, check the report on TNS.' + bcolors.ENDC)
+                return [False]*n
+
+            print(bcolors.WARNING + "Waiting and retrying..." + bcolors.ENDC)
+            try:
+                sleep(wait)
+            except KeyboardInterrupt:
+                return [False]*n
+            wait = min(2*wait, tns_poll_max_wait)
+        elif feedback_code == 400:
+            print(bcolors.FAIL + json.dumps(response, indent=2) + bcolors.ENDC)
+            return tns_entries(response, n)
+        else:
+            # error receiving the feedback from TNS about the upload
+            print("Something went wrong with the feedback, but the report may",
+                  "still have been fine?")
+            return [False]*n
+
+def tns_reply(report_id):
+
+    ''' Info : Requests the feedback of a bulk report once
         Input : ID of report
-        Returns : API response
+        Returns : feedback code (200 processed, 404 not processed yet, 400 rejected), API response
     '''
 
     data = {'api_key': API_KEY, 'report_id': report_id}
 
-    headers={'User-Agent':'tns_marker{"tns_id":'+str(YOUR_BOT_ID)+', "type":"bot", "name":"'+YOUR_BOT_NAME+'"}'}
+    response = tns_session.request('POST', reply_url, data=data).json()
 
-    response = requests.post(reply_url, headers=headers, data=data).json()
-
-    feedback_code = response['id_code']
-    print(feedback_code, response['id_message'], "feedback finished")
-    if feedback_code == 200:
-        print(bcolors.OKGREEN + 'Feedback successful. Continuing...' + bcolors.ENDC)
-        return True
-    elif feedback_code == 404:
-        print(bcolors.WARNING + "Waiting and retrying..." + bcolors.ENDC)
-        sleep(2)
-        try:
-            return tns_feedback(report_id)
-        except KeyboardInterrupt:
-            return False
-    elif feedback_code == 400:
-        print(bcolors.FAIL + json.dumps(response, indent=2) + bcolors.ENDC)
-        return False
-    else:
-        # error receiving the feedback from TNS about the upload
-        print("Something went wrong with the feedback, but the report may",
-              "still have been fine?")
-        return False
+    return response['id_code'], response
 
 def upload_to_TNS(filename, base_url = upload_url, api_key = API_KEY, filetype='ascii'):
 
-    ''' Info : Uploads spectrum to TNS
-        Input : spectrum file name, transient URL on TNS, API KEY, spectrum file type
+    ''' Info : Uploads spectra to TNS
+        Input : spectrum file name (or list of names, uploaded together), transient URL on TNS, API KEY, spectrum file type
         Returns : API response
     '''
 
     url = base_url
     data = {'api_key' : api_key}
 
-    headers={'User-Agent':'tns_marker{"tns_id":'+str(YOUR_BOT_ID)+', "type":"bot", "name":"'+YOUR_BOT_NAME+'"}'}
+    filenames = filename if type(filename) == list else [filename]
 
     if filetype == 'ascii':
-        files = [('files[]', (filename, open(filename), 'text/plain'))]
+        files = [('files['+str(i)+']', (f, open(f), 'text/plain')) for i, f in enumerate(filenames)]
 
     elif filetype == 'fits':
-        files = [('files[0]', (filename, open(filename, 'rb'),
-                               'application/fits'))]
+        files = [('files['+str(i)+']', (f, open(f, 'rb'),
+                               'application/fits')) for i, f in enumerate(filenames)]
 
     if filename:
-        while True:
-            try:
-                response = requests.post(url, headers=headers, data=data, files=files, timeout=30)
-                break
-            except requests.exceptions.Timeout:
-                continue
+        response = tns_session.request('POST', url, data=data, files=files, retry=False)
         try:
             return response.json()
         except:
@@ -1726,17 +2488,18 @@ def upload_to_TNS(filename, base_url = upload_url, api_key = API_KEY, filetype='
     else:
         return {}
 
-def write_ascii_file(ztfname, path=os.getcwd(), auto=False):
+def write_ascii_file(ztfname, path=os.getcwd(), auto=False, specid=None):
 
     ''' Info : Generates ASCII file with data from selected Fritz spectrum
-        Input : ZTFname, path, auto
+        Input : ZTFname, path, auto, specid (if given, this spectrum is used instead of prompting the user)
         Returns : spectrum_name (name of file), specid
     '''
 
-    if auto == True:
-        specid = get_required_spectrum_id(ztfname, auto=True)
-    else:
-        specid = get_required_spectrum_id(ztfname)
+    if specid == None:
+        if auto == True:
+            specid = get_required_spectrum_id(ztfname, auto=True)
+        else:
+            specid = get_required_spectrum_id(ztfname)
 
     if (specid == 'No Spectra Found'):
         spectrum_name = 'No Spectra Found'
@@ -5,6 +5,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import requests
 import sys, os
+import threading
 import warnings
 import ztfiaenv.ztfiaenv as ztfiaenv
 
@@ -17,30 +18,101 @@ from astropy.visualization import PercentileInterval, AsinhStretch
 from astropy.wcs import WCS
 from astroquery.ned import Ned
 from astroquery.sdss import SDSS
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from io import StringIO
 from pprint import pprint
 from ztfiaenv.ztfiaenv.functions import get_DLR
 from ztfiaenv.ztfiaenv import get_host_from_cat
 from ztfquery import bts
 
+from breaker import *
+from catalog_tiles import *
+from cone_cache import *
+from cutout_cache import *
 from func import *
+from render import *
 
 warnings.simplefilter('ignore', category=AstropyWarning)
 warnings.filterwarnings('ignore')
 
+host_workers = 8 # Sources whose hosts are looked up at the same time in option 4
+
+# Most requests in flight at once to each service during host association
+host_service_limits = {'ztfiaenv': 4, # ztfiaenv catalog queries
+                       'ned': 2,      # NED cone searches and spectra pages
+                       'sdss': 2,     # SDSS cone searches
+                       'ps1': 4,      # PS1 cutout listings and FITS downloads
+                       'mast': 2}     # PS1 catalog tile downloads
+
+# Circuit breaker of each service, so a service that is down fails fast instead of stalling the batch
+host_breakers = {service: CircuitBreaker(service) for service in host_service_limits}
+host_retry_rounds = 1 # Times sources deferred because a service was down are retried at the end of option 4, once the service has cooled down
+
+# PS1 listings and cutouts are cached as usual, but retried by host_breakers['ps1'] (outside the PS1 request limit) rather than by the cache
+host_cutouts = CutoutCache(retries=1)
+
+Ned.TIMEOUT = service_timeout
+SDSS.TIMEOUT = service_timeout
+
+host_catalog = 'tiles' # 'tiles' (ztfiaenv host matching on PS1 catalog tiles shared by nearby sources) or 'ztfiaenv' (one ztfiaenv catalog query per source)
+
+host_services = {service: threading.BoundedSemaphore(limit) for service, limit in host_service_limits.items()}
+
+# Bulk cross-matching of host candidates in option 4
+crossmatch_backend = 'tap'   # 'tap' (NED TAP upload join and SDSS CrossID, a few requests per batch) or 'local' (one cached cone search per candidate)
+crossmatch_chunk = 500       # Candidates per bulk request
+ned_tap_url = 'https://ned.ipac.caltech.edu/tap' # NED TAP service
+
+class ThreadStdout:
+
+    ''' Info : Stands in for sys.stdout so output can be redirected for one thread (e.g. a host lookup in the pool) without affecting the others
+        Attributes: stream (the real stdout), targets (thread id -> stream its output goes to)
+    '''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.targets = {}
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def flush(self):
+        self.targets.get(threading.get_ident(), self.stream).flush()
+
+    def write(self, text):
+        return self.targets.get(threading.get_ident(), self.stream).write(text)
+
+@contextmanager
+def redirect_thread_stdout(target):
+
+    """ Info : Sends this thread's output to target while in the block, other threads keep printing normally
+    """
+
+    if not isinstance(sys.stdout, ThreadStdout):
+        sys.stdout = ThreadStdout(sys.stdout)
+
+    ident = threading.get_ident()
+    previous = sys.stdout.targets.get(ident)
+    sys.stdout.targets[ident] = target
+
+    try:
+        yield target
+    finally:
+        if previous == None:
+            del sys.stdout.targets[ident]
+        else:
+            sys.stdout.targets[ident] = previous
+
 @contextmanager
 def suppress_stdout():
 
-    """ Info : Suppresses output from host association
+    """ Info : Suppresses output from host association (only for the current thread)
     """
 
     with open(os.devnull, "w") as devnull:
-        old_stdout = sys.stdout
-        sys.stdout = devnull
-        try:
+        with redirect_thread_stdout(devnull):
             yield
-        finally:
-            sys.stdout = old_stdout
 
 def comment_sublink(source):
 
@@ -78,114 +150,260 @@ def cross_ref_NED(ra, dec):
         Returns : Host name, host RA, host dec, host type, host redshift
     '''
 
-    co = coordinates.SkyCoord(ra=ra, dec=dec, unit=(u.deg, u.deg), frame='icrs')
+    # Answered from the local cone cache when an earlier search covered this position
+    result_table = cone_cache.query('ned', ra, dec, 3/3600, lambda radius: query_NED(ra, dec, radius))
+
+    if result_table is None:
+        return None, None, None, None, None
+
+    return select_NED_host(result_table)
+
+def cross_ref_SDSS(ra, dec):
+
+    ''' Info : Indentifies potential hosts in SDSS within 3 arcsec of given coordinates
+        Input : RA (deg), dec (deg)
+        Returns : Host name, host RA, host dec, host type, host redshift (always None, SDSS does not store redshifts for objects)
+    '''
+
+    # Answered from the local cone cache when an earlier search covered this position
+    result_table = cone_cache.query('sdss', ra, dec, 3/3600, lambda radius: query_SDSS(ra, dec, radius))
+
+    return select_SDSS_host(ra, dec, result_table)
 
-    while True:
+def crossmatch_hosts(service, ras, decs, radius=3/3600, backend=None):
+
+    ''' Info : Cross-matches many host candidates against NED or SDSS at once and splits the results back per candidate.
+               Falls back to one cone search per candidate (through the cone cache) if the bulk service fails.
+        Input : service ('ned' or 'sdss'), RAs and decs of the candidates (deg), match radius (deg), backend ('tap' or 'local', crossmatch_backend if None)
+        Returns : list with, for each candidate, a table of matches in the same format as the service's cone search (or None if no match)
+    '''
+
+    if backend == None:
+        backend = crossmatch_backend
+
+    ras = np.array(ras, dtype=float)
+    decs = np.array(decs, dtype=float)
+
+    if backend == 'tap' and len(ras) > 0:
         try:
-            result_table = Ned.query_region(co, radius=3*u.arcsec)
-            break
-        except requests.exceptions.ConnectTimeout:
-            continue
+            tables = []
+            for lo in range(0, len(ras), crossmatch_chunk):
+                if service == 'ned':
+                    tables += crossmatch_NED_tap(ras[lo:lo+crossmatch_chunk], decs[lo:lo+crossmatch_chunk], radius)
+                else:
+                    tables += crossmatch_SDSS_bulk(ras[lo:lo+crossmatch_chunk], decs[lo:lo+crossmatch_chunk], radius)
+            return tables
+        except Exception as e:
+            print(bcolors.WARNING + 'Bulk ' + service.upper() + ' cross-match failed (' + str(e) + '), using cone searches instead.' + bcolors.ENDC)
 
-    # Gets rid of any objects if they're stars, or have 'SN' or 'AT' in they're name (i.e. they're SNe)
-    non_stars = np.array([True if ('*' not in result_table['Type'][t] and result_table['Type'][t] != 'SN' and
-        'SN' not in result_table['Object Name'][t] and 'AT' not in result_table['Object Name'][t]) else False for t in range(len(result_table['Type']))])
+    return crossmatch_local(service, ras, decs, radius)
 
-    result_table = result_table[non_stars]
+def crossmatch_local(service, ras, decs, radius):
 
-    if len(result_table) == 0:
-        return None, None, None, None, None
+    ''' Info : Stand-in for the bulk cross-match that runs one cone search per candidate through the cone cache (no bulk service needed)
+        Input : service ('ned' or 'sdss'), RAs and decs (deg), match radius (deg)
+        Returns : list of tables (or None) per candidate
+    '''
+
+    query = query_NED if service == 'ned' else query_SDSS
+
+    return [cone_cache.query(service, ra, dec, radius, lambda r, ra=ra, dec=dec: query(ra, dec, r)) for ra, dec in zip(ras, decs)]
+
+def crossmatch_NED_tap(ras, decs, radius):
+
+    ''' Info : Joins an uploaded table of candidate positions against NED's object directory in one TAP query
+        Input : RAs and decs (deg), match radius (deg)
+        Returns : list of tables (or None) per candidate, with the columns used from NED cone searches
+    '''
+
+    from astroquery.utils.tap.core import TapPlus
+
+    upload = Table([np.arange(len(ras)), ras, decs], names=('idx', 'ra', 'dec'))
+    path = 'data/ned_upload_' + str(os.getpid()) + '_' + str(threading.get_ident()) + '.xml'
+    upload.write(path, format='votable', overwrite=True)
+
+    query = ("SELECT c.idx, o.prefname, o.pretype, o.ra, o.dec, o.z, o.zflag, "
+             "DISTANCE(POINT('ICRS', o.ra, o.dec), POINT('ICRS', c.ra, c.dec))*60 AS sep "
+             "FROM NEDTAP.objdir AS o JOIN TAP_UPLOAD.coords AS c "
+             "ON 1 = CONTAINS(POINT('ICRS', o.ra, o.dec), CIRCLE('ICRS', c.ra, c.dec, " + repr(float(radius)) + "))")
+
+    def launch():
+        with host_services['ned']:
+            return TapPlus(url=ned_tap_url, verbose=False).launch_job(query, upload_resource=path, upload_table_name='coords').get_results()
 
     try:
-        result_table.sort('Separation')
-    except ValueError:
-        result_table.sort('Distance (arcmin)')
+        result = host_breakers['ned'].call(launch, retries=1) # Falls back to cone searches rather than retrying
+    finally:
+        os.remove(path)
 
-    if str(result_table['Redshift'][0]) != '--':
-        # If the redshift source is SPEC or SED, it is from spectra and is of high enough quality
-        if str(result_table['Redshift Flag'][0]) == 'SPEC' or str(result_table['Redshift Flag'][0]) == 'SED':
-            redshift = float(result_table['Redshift'][0])
-        # If the redshift source is PHOT, it is photometric and we ignore it
-        elif str(result_table['Redshift Flag'][0]) == 'PHOT':
-            redshift = None
-        # If the source is unclear, we see if spectral data exists in NED
-        else:
-            try:
-                r = requests.get('http://ned.ipac.caltech.edu/cgi-bin/NEDspectra?objname=' + result_table['Object Name'][0].replace('+', '%2B').replace(' ', '+')
-                    + '&extend=never&detail=0&preview=1&numpp=20&refcode=ANY&bandpass=ANY&line=ANY&hconst=73.0&omegam=0.27&omegav=0.73&corr_z=1')
+    result.rename_columns(['prefname', 'pretype', 'ra', 'dec', 'z', 'zflag', 'sep'],
+                          ['Object Name', 'Type', 'RA', 'DEC', 'Redshift', 'Redshift Flag', 'Separation'])
 
-                if 'Spectral data in NED archive for object' in r.text:
-                    redshift = float(result_table['Redshift'][0])
-                else:
-                    redshift = None
+    return split_matches(result, np.array(result['idx'], dtype=int), len(ras))
 
-            except:
-                redshift = None
-    else:
-        redshift = None
+def crossmatch_SDSS_bulk(ras, decs, radius):
 
-    return result_table['Object Name'][0], result_table['RA'][0], result_table['DEC'][0], result_table['Type'][0], redshift
+    ''' Info : Matches many candidate positions against SDSS photometric objects in one CrossID request
+        Input : RAs and decs (deg), match radius (deg)
+        Returns : list of tables (or None) per candidate, with ra and dec columns as in SDSS cone searches
+    '''
 
-def cross_ref_SDSS(ra, dec):
+    co = coordinates.SkyCoord(ra=ras, dec=decs, unit=(u.deg, u.deg), frame='icrs')
 
-    ''' Info : Indentifies potential hosts in SDSS within 3 arcsec of given coordinates
-        Input : RA (deg), dec (deg)
-        Returns : Host name, host RA, host dec, host type, host redshift (always None, SDSS does not store redshifts for objects)
+    def query():
+        with host_services['sdss']:
+            return SDSS.query_crossid(co, radius=radius*u.deg)
+
+    result = host_breakers['sdss'].call(query, retries=1) # Falls back to cone searches rather than retrying
+
+    if type(result) != Table:
+        return [None]*len(ras)
+
+    # CrossID labels each match with the index of its input position as obj_<index>
+    idx = np.array([int(str(name).split('_')[-1]) for name in result['obj_id']], dtype=int)
+
+    return split_matches(result, idx, len(ras))
+
+def defer_host(found, error):
+
+    ''' Info : Marks a host lookup as deferred because a service was unavailable
+        Input : result of find_host or locate_host, the error
+        Returns : None
+    '''
+
+    found['deferred'] = True
+    found['output'] += bcolors.WARNING + found['source'] + ' host lookup deferred: ' + str(error) + bcolors.ENDC + '\n'
+
+def fetch_tile_catalog(ra, dec, radius):
+
+    ''' Info : Downloads the PS1 DR2 stack catalog in a cone, for one catalog tile
+        Input : RA (deg), dec (deg), radius (deg)
+        Returns : Table of the primary detections, or None if there are none
     '''
 
+    from astroquery.mast import Catalogs
+
     co = coordinates.SkyCoord(ra=ra, dec=dec, unit=(u.deg, u.deg), frame='icrs')
 
-    while True:
+    def query():
+        with host_services['mast']:
+            return Catalogs.query_region(co, radius=radius*u.deg, catalog='Panstarrs', data_release='dr2', table='stack')
+
+    table = host_breakers['mast'].call(query)
+
+    if len(table) == 0:
+        return None
+
+    if 'raMean' not in table.colnames:
+        table.rename_columns(['raStack', 'decStack'], ['raMean', 'decMean'])
+
+    # All stack columns are kept, they are the catalog ztfiaenv's host matching reads
+    return Table(table[np.array(table['primaryDetection']) == 1])
+
+def find_host(source):
+
+    ''' Info : Looks up the potential host of a source without posting anything, so it can run in a thread for many sources at once.
+               Output is collected rather than printed, so it can be shown in order.
+        Input : Source name
+        Returns : Dictionary with the host (name, ra, dec, type, z, plot path, or None if no host was found), whether the source already has a host
+                  comment, whether it was deferred because a service was unavailable, and the lookup's printed output
+    '''
+
+    found = {'source': source, 'host': None, 'posted': False, 'deferred': False, 'output': ''}
+
+    with redirect_thread_stdout(StringIO()) as output:
         try:
-            result_table = SDSS.query_region(co, radius=3*u.arcsec)
-            break
-        except requests.exceptions.ReadTimeout:
-            continue
+            for comment_info in get_source_api(source)['comments']:
+                if 'potential host:' in comment_info['text']:
+                    found['posted'] = True
+                    return found
 
-    if type(result_table) != Table:
-        return None, None, None, None, None
+            plotname = 'data/' + source + '_host.png' # Per source, so lookups running together do not overwrite each other's plots
 
-    closest = np.argmin(np.sqrt((ra-np.array(result_table['ra']))**2+(dec-np.array(result_table['dec']))**2))
+            hostname, hostra, hostdec, hosttype, redshift = get_host_info(source, plotname=plotname)
 
-    c = coordinates.SkyCoord(result_table['ra'][closest]*u.degree, result_table['dec'][closest]*u.degree)
+            if hostname != None:
+                found['host'] = {'name': hostname, 'ra': hostra, 'dec': hostdec, 'type': hosttype, 'z': redshift, 'plot': plotname}
+        except (ServiceUnavailable,) + service_errors as e:
+            defer_host(found, e)
+        finally:
+            found['output'] = output.getvalue()
 
-    name = 'SDSS ' + c.to_string('hmsdms', precision=2).replace('h', '').replace('m', '').replace('s', '').replace('d', '').replace(' ', '')
+    return found
 
-    return name, result_table['ra'][closest], result_table['dec'][closest], 'SDSS', None
+def locate_host(source, source_info=None):
 
-def get_host_info(ztfname):
+    ''' Info : First stage of post_hosts: checks whether a source already has a host comment and finds its host candidate, collecting
+               the output so it can be shown in order
+        Input : Source name, its Fritz source information (fetched here if None)
+        Returns : Dictionary with the source, whether it already has a host comment, whether it was deferred, the candidate (transient RA, dec,
+                  candidate RA, dec, or None), the host (filled in later) and the printed output
+    '''
 
-    ''' Info : Determines host using ztfiaenv and queries NED for info.
-        Input : Name of source
-        Returns : Host name, host RA, host dec, host type (e.g. gal, IRS, UVS, etc.), host redshift (if available)
+    found = {'source': source, 'host': None, 'posted': False, 'deferred': False, 'candidate': None, 'output': ''}
+
+    with redirect_thread_stdout(StringIO()) as output:
+        try:
+            if source_info == None:
+                source_info = get_source_api(source)
+
+            for comment_info in source_info['comments']:
+                if 'potential host:' in comment_info['text']:
+                    found['posted'] = True
+                    return found
+
+            found['candidate'] = get_host_candidate(source, source_info)
+        except (ServiceUnavailable,) + service_errors as e:
+            defer_host(found, e)
+        finally:
+            found['output'] = output.getvalue()
+
+    return found
+
+def get_host_candidate(ztfname, source_info=None):
+
+    ''' Info : Finds the most likely host of a source with ztfiaenv host matching, on the stored PS1 catalog tile if there is one, otherwise on a ztfiaenv catalog query
+        Input : Name of source, its Fritz source information (fetched here if None)
+        Returns : transient RA, dec, RA and dec of the most likely host in the catalogs (deg), or None if there is none
     '''
 
-    source_info = get_source_api(ztfname)
+    if source_info == None:
+        source_info = get_source_api(ztfname)
 
     snra = source_info['ra']
     sndec = source_info['dec']
 
+    if host_catalog == 'tiles' and catalog_tiles.has(snra, sndec):
+        # Same DLR host matching as ztfiaenv, on the PS1 rows of the stored tile instead of a catalog query
+        cat = catalog_tiles.query(snra, sndec, tile_match_radius, 'raMean', 'decMean')
+
+        host = None
+        if cat is not None:
+            try:
+                host = get_host_from_cat(get_DLR(cat.to_pandas(), snra, sndec))
+            except (NameError, IndexError, ValueError):
+                pass
+
+        if host is None:
+            print(bcolors.FAIL + 'No host in area.' + bcolors.ENDC)
+            return None
+
+        return snra, sndec, float(host['raMean']), float(host['decMean'])
+
     # Runs ztfiaenv host association
     data = ztfiaenv.GetHost(ztfname, verbose=False)
 
-    it = 0
-    while it < 3:
-        try:
+    def query():
+        with host_services['ztfiaenv']:
             data.get_info(skip_marshal_info=True)
             #with suppress_stdout():
             data.get_host_cat()
 
-            break
-        except requests.exceptions.ConnectionError:
-            print(it)
-            it += 1
-            pass
-        except (NameError, IndexError, ValueError):
-            print(bcolors.FAIL + 'No host in area.' + bcolors.ENDC)
-            it = 3
-
-    if it == 3:
-        return None, None, None, None, None
+    try:
+        host_breakers['ztfiaenv'].call(query)
+    except (NameError, IndexError, ValueError):
+        print(bcolors.FAIL + 'No host in area.' + bcolors.ENDC)
+        return None
 
     try:
         conra = float(data.host_cat.best_cat.raMean)
@@ -195,7 +413,23 @@ def get_host_info(ztfname):
             conra = float(data.host_cat.best_cat.ra)
             condec = float(data.host_cat.best_cat.dec)
         except AttributeError:
-            return None, None, None, None, None
+            return None
+
+    return snra, sndec, conra, condec
+
+def get_host_info(ztfname, plotname='test_host.png'):
+
+    ''' Info : Determines host using ztfiaenv and queries NED for info.
+        Input : Name of source, file to save the host plot to
+        Returns : Host name, host RA, host dec, host type (e.g. gal, IRS, UVS, etc.), host redshift (if available)
+    '''
+
+    candidate = get_host_candidate(ztfname)
+
+    if candidate == None:
+        return None, None, None, None, None
+
+    snra, sndec, conra, condec = candidate
 
     # Queries NED for potential host within 3 arcsec of coordinates determined by ztfiaenv
     hostname, hostra, hostdec, hosttype, redshift = cross_ref_NED(conra, condec)
@@ -208,50 +442,13 @@ def get_host_info(ztfname):
         print(bcolors.FAIL + 'No host in area.' + bcolors.ENDC)
         return None, None, None, None, None
 
-    # Run plotting
-    size = int(np.round(3*3600*4*np.max([np.abs(snra-hostra), np.abs(sndec-hostdec)])))
-
-    if size < 60:
-        size = 60
-
-    while True:
-        try:
-            with suppress_stdout():
-                fitsurl = geturl(hostra, hostdec, size=size, filters="i", format="fits")
-            break
-        except FileNotFoundError:
-            continue
-
-    if len(fitsurl) == 0:
-        plt.figure()
-
-        plt.savefig('test_host.png')
-
-        return hostname, hostra, hostdec, hosttype, redshift
-
-    fh = fits.open(fitsurl[0])
-    fim = fh[0].data
-    wcs = WCS(fh[0].header)
-    fim[np.isnan(fim)] = 0.0
-    transform = AsinhStretch() + PercentileInterval(99.5)
-    bfim = transform(fim)
-
-    ax = plt.subplot(projection=wcs)
-
-    plt.imshow(bfim,cmap="gray",origin="lower")
-
-    plt.scatter(snra, sndec, transform=ax.get_transform('world'), c='red', marker='+', label='SNe')
-    plt.scatter(hostra, hostdec, transform=ax.get_transform('world'), c='blue', label='Host')
-
-    plt.legend(loc='best')
-
-    plt.savefig('test_host.png')
+    plot_host(snra, sndec, hostra, hostdec, plotname)
 
     return hostname, hostra, hostdec, hosttype, redshift
 
 def getimages(ra,dec,size=240,filters="grizy"):
 
-    """ Info : Query ps1filenames.py service to get a list of images
+    """ Info : Query ps1filenames.py service to get a list of images (through the local cutout cache)
         Input : ra (deg), dec (deg), size (in pixels, 0.25 arcsec/pixel), filters
         Returns : Table with the results
     """
@@ -259,7 +456,7 @@ def getimages(ra,dec,size=240,filters="grizy"):
     service = "https://ps1images.stsci.edu/cgi-bin/ps1filenames.py"
     url = ("{service}?ra={ra}&dec={dec}&size={size}&format=fits"
            "&filters={filters}").format(**locals())
-    table = Table.read(url, format='ascii')
+    table = host_cutouts.filenames(ra, dec, size, filters, lambda: Table.read(url, format='ascii'))
     return table
 
 def geturl(ra, dec, size=240, output_size=None, filters="grizy", format="jpg", color=False):
@@ -294,44 +491,74 @@ def geturl(ra, dec, size=240, output_size=None, filters="grizy", format="jpg", c
             url.append(urlbase+filename)
     return url
 
-def post_host(source):
+def plot_host(snra, sndec, hostra, hostdec, plotname):
 
-    ''' Info : Identifies potential host of source, then posts information with plot on source page (or updates it if one is already there and
-            different host ID'd)
-        Input : Source name
+    ''' Info : Saves a PS1 i-band cutout around a host with the transient and host marked (blank if PS1 has no image there)
+        Input : transient RA and dec, host RA and dec (deg), file to save the plot to
         Returns : None
     '''
 
-    comment_infos = get_source_api(source)['comments']
+    size = int(np.round(3*3600*4*np.max([np.abs(snra-hostra), np.abs(sndec-hostdec)])))
+
+    if size < 60:
+        size = 60
 
-    flag = 0
+    # Listing and cutout come from the local cutout cache when this host was plotted before. Failed PS1 requests are retried by the breaker,
+    # which waits between attempts without holding a PS1 request slot.
+    def listing():
+        with suppress_stdout(), host_services['ps1']:
+            return geturl(hostra, hostdec, size=size, filters="i", format="fits")
 
-    for i in range (len(comment_infos)):
+    fitsurl = host_breakers['ps1'].call(listing, errors=(FileNotFoundError,) + service_errors)
 
-        comment_info = comment_infos[i]
-        comment = comment_info['text']
+    if len(fitsurl) == 0:
+        renderer.render(draw_empty, plotname, 'fritz').result()
+        return
 
-        if 'potential host:' in comment:
-            print(source + ' already has an associated host.')
-            return
+    def cutout():
+        with host_services['ps1']:
+            return host_cutouts.cutout(hostra, hostdec, size, 'i', fitsurl[0])
 
-    flag = 0
-    while flag == 0:
-        try:
-            hostname, hostra, hostdec, hosttype, redshift = get_host_info(source)
-            flag = 1
-        except requests.exceptions.ReadTimeout:
-            continue
+    fh = host_breakers['ps1'].call(cutout)
 
-    if hostname == None:
+    with fh:
+        fim = np.nan_to_num(fh[0].data, nan=0.0) # Copy out of the memory-mapped file, which is read-only
+        header = fh[0].header.tostring()
+
+    renderer.render(draw_host, plotname, 'fritz', fim, header, snra, sndec, hostra, hostdec).result()
+
+def post_host(source, found=None):
+
+    ''' Info : Identifies potential host of source, then posts information with plot on source page (or updates it if one is already there and
+            different host ID'd)
+        Input : Source name, result of find_host (looked up here if not given, e.g. by post_hosts)
+        Returns : None
+    '''
+
+    if found == None:
+        found = find_host(source)
+
+    print(found['output'], end='')
+
+    if found['posted']:
+        print(source + ' already has an associated host.')
         return
 
+    if found['deferred']:
+        return
+
+    if found['host'] == None:
+        return
+
+    hostname, hostra, hostdec, hosttype, redshift = [found['host'][key] for key in ['name', 'ra', 'dec', 'type', 'z']]
+    plotname = found['host']['plot']
+
     if redshift != None:
         resp = post_comment(source, 'potential host: '+hostname+', ra = '+str(hostra)+', dec = '+str(hostdec)+', z = '+str(redshift)+
-            ', type = '+hosttype+'. host page: http://gayatri.caltech.edu:88/query/host/'+source, 'test_host.png', source+'_host.png')
+            ', type = '+hosttype+'. host page: http://gayatri.caltech.edu:88/query/host/'+source, plotname, source+'_host.png')
     else:
         resp = post_comment(source, 'potential host: '+hostname+', ra = '+str(hostra)+', dec = '+str(hostdec)+
-            ', type = '+hosttype+'. host page: http://gayatri.caltech.edu:88/query/host/'+source, 'test_host.png', source+'_host.png')
+            ', type = '+hosttype+'. host page: http://gayatri.caltech.edu:88/query/host/'+source, plotname, source+'_host.png')
 
     if resp['status'] == 'success':
         print(bcolors.OKGREEN + source + ' host association upload successful.' + bcolors.ENDC)
@@ -340,3 +567,256 @@ def post_host(source):
         print(bcolors.FAIL + source + ' host association upload failed.' + bcolors.ENDC)
         print(bcolors.FAIL + json.dumps(resp, indent=2) + bcolors.ENDC)
         return
+
+def post_hosts(sources, workers=None, rounds=None):
+
+    ''' Info : Runs post_host and comment_sublink for many sources (see post_hosts_batch). Sources deferred because a service was down are
+               retried once its circuit breaker has cooled down, and any still deferred at the end are listed.
+        Input : list of source names, number of sources looked up at once (host_workers if None), retry rounds (host_retry_rounds if None)
+        Returns : list of sources still deferred
+    '''
+
+    if rounds == None:
+        rounds = host_retry_rounds
+
+    try:
+        deferred = post_hosts_batch(sources, workers)
+        cone_cache.flush()
+
+        for r in range(rounds):
+            if len(deferred) == 0:
+                break
+
+            wait = max(breaker.remaining() for breaker in host_breakers.values())
+            print(bcolors.WARNING + 'Retrying ' + str(len(deferred)) + ' deferred sources in ' + str(int(wait)) + ' s.' + bcolors.ENDC)
+            time.sleep(wait)
+
+            deferred = post_hosts_batch(deferred, workers)
+            cone_cache.flush()
+    finally:
+        cone_cache.flush() # Keeps what was looked up even if the batch is interrupted
+
+    if len(deferred) > 0:
+        print(bcolors.FAIL + 'Host lookup deferred for ' + ', '.join(deferred) + '. Run option 4 again later.' + bcolors.ENDC)
+
+    return deferred
+
+def post_hosts_batch(sources, workers=None):
+
+    ''' Info : Runs post_host and comment_sublink for many sources. The PS1 catalog tiles covering the sources are downloaded once, host
+               lookups and plots run in a pool of threads (with at most host_service_limits requests to each service at once), and all host
+               candidates are cross-matched against NED, then SDSS, in bulk. Results are posted and printed in the order of the list. Sources
+               whose lookups fail because a service is unavailable are deferred rather than stalling the batch.
+        Input : list of source names, number of sources looked up at once (host_workers if None)
+        Returns : list of deferred sources
+    '''
+
+    if workers == None:
+        workers = host_workers
+
+    if 'data' not in os.listdir(os.getcwd()):
+        os.mkdir('data')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(get_source_api, source) for source in sources]
+
+        infos = []
+        for future in futures:
+            try:
+                infos.append(future.result())
+            except Exception:
+                infos.append(None) # Fetched again (and the error reported) by locate_host
+
+        # Catalog tiles shared by the sources are downloaded once, sources in tiles that could not be downloaded fall back to ztfiaenv
+        if host_catalog == 'tiles':
+            positions = [(info['ra'], info['dec']) for info in infos if info != None]
+
+            try:
+                n = catalog_tiles.prefetch([p[0] for p in positions], [p[1] for p in positions], fetch_tile_catalog, executor)
+                print(bcolors.OKCYAN + 'Downloaded ' + str(n) + ' catalog tiles for ' + str(len(positions)) + ' sources.' + bcolors.ENDC)
+            except Exception as e:
+                print(bcolors.WARNING + 'Catalog tile download failed (' + str(e) + '), using ztfiaenv for sources without a tile.' + bcolors.ENDC)
+
+        futures = [executor.submit(locate_host, sources[i], infos[i]) for i in range(len(sources))]
+
+        founds = []
+        for i in np.arange(0,len(sources)):
+            try:
+                founds.append(futures[i].result())
+            except Exception as e:
+                founds.append({'source': sources[i], 'host': None, 'posted': False, 'deferred': False, 'candidate': None,
+                               'output': bcolors.FAIL + sources[i] + ' host lookup failed: ' + str(e) + bcolors.ENDC + '\n'})
+
+        # Candidates are matched against NED first, and those without a NED host against SDSS
+        pending = [found for found in founds if found['candidate'] != None]
+
+        try:
+            tables = crossmatch_hosts('ned', [found['candidate'][2] for found in pending], [found['candidate'][3] for found in pending])
+            hosts = list(executor.map(lambda table: select_NED_host(table) if table is not None else (None, None, None, None, None), tables))
+
+            for found, host in zip(pending, hosts):
+                if host[0] != None:
+                    found['host'] = host
+
+            pending = [found for found in pending if found['host'] == None]
+
+            tables = crossmatch_hosts('sdss', [found['candidate'][2] for found in pending], [found['candidate'][3] for found in pending])
+
+            for found, table in zip(pending, tables):
+                host = select_SDSS_host(found['candidate'][2], found['candidate'][3], table)
+
+                if host[0] != None:
+                    found['host'] = host
+                else:
+                    found['output'] += bcolors.FAIL + 'No host in area.' + bcolors.ENDC + '\n'
+        except (ServiceUnavailable,) + service_errors as e:
+            for found in pending:
+                found['host'] = None
+                defer_host(found, e)
+
+        # Plots of the hosts that were found
+        plots = {}
+        for found in founds:
+            if found['host'] != None:
+                plotname = 'data/' + found['source'] + '_host.png' # Per source, so plots made together do not overwrite each other
+                plots[found['source']] = executor.submit(plot_host, found['candidate'][0], found['candidate'][1], found['host'][1], found['host'][2], plotname)
+                found['host'] = dict(zip(['name', 'ra', 'dec', 'type', 'z'], found['host']))
+                found['host']['plot'] = plotname
+
+        for i in np.arange(0,len(sources)):
+            print(bcolors.OKCYAN + str(i+1) + '/' + str(len(sources)) + bcolors.ENDC + ': ' + bcolors.OKBLUE + sources[i] + bcolors.ENDC)
+
+            found = founds[i]
+
+            if found['source'] in plots:
+                try:
+                    plots[found['source']].result()
+                except (ServiceUnavailable, FileNotFoundError) + service_errors as e:
+                    found['host'] = None
+                    defer_host(found, e)
+                except Exception as e:
+                    found['output'] += bcolors.FAIL + sources[i] + ' host plot failed: ' + str(e) + bcolors.ENDC + '\n'
+                    found['host'] = None
+
+            post_host(sources[i], found=found)
+
+            if not found['deferred']:
+                comment_sublink(sources[i])
+
+    return [found['source'] for found in founds if found['deferred']]
+
+def query_NED(ra, dec, radius):
+
+    ''' Info : NED cone search, retried through the NED circuit breaker
+        Input : RA (deg), dec (deg), radius (deg)
+        Returns : NED table of objects in the cone
+    '''
+
+    co = coordinates.SkyCoord(ra=ra, dec=dec, unit=(u.deg, u.deg), frame='icrs')
+
+    def query():
+        with host_services['ned']:
+            return Ned.query_region(co, radius=radius*u.deg)
+
+    return host_breakers['ned'].call(query)
+
+def query_SDSS(ra, dec, radius):
+
+    ''' Info : SDSS cone search, retried through the SDSS circuit breaker
+        Input : RA (deg), dec (deg), radius (deg)
+        Returns : SDSS table of objects in the cone, or None if there are none
+    '''
+
+    co = coordinates.SkyCoord(ra=ra, dec=dec, unit=(u.deg, u.deg), frame='icrs')
+
+    def query():
+        with host_services['sdss']:
+            return SDSS.query_region(co, radius=radius*u.deg)
+
+    table = host_breakers['sdss'].call(query)
+
+    return table if type(table) == Table else None
+
+def select_NED_host(result_table):
+
+    ''' Info : Picks the host from NED objects near a host candidate: the closest that is not a star or supernova. Its redshift is kept if it is
+               spectroscopic, or if NED has spectra for the object.
+        Input : NED table of objects within 3 arcsec (from a cone search or crossmatch_hosts)
+        Returns : Host name, host RA, host dec, host type, host redshift
+    '''
+
+    # Gets rid of any objects if they're stars, or have 'SN' or 'AT' in they're name (i.e. they're SNe)
+    non_stars = np.array([True if ('*' not in result_table['Type'][t] and result_table['Type'][t] != 'SN' and
+        'SN' not in result_table['Object Name'][t] and 'AT' not in result_table['Object Name'][t]) else False for t in range(len(result_table['Type']))])
+
+    result_table = result_table[non_stars]
+
+    if len(result_table) == 0:
+        return None, None, None, None, None
+
+    try:
+        result_table.sort('Separation')
+    except ValueError:
+        result_table.sort('Distance (arcmin)')
+
+    if str(result_table['Redshift'][0]) != '--':
+        # If the redshift source is SPEC or SED, it is from spectra and is of high enough quality
+        if str(result_table['Redshift Flag'][0]) == 'SPEC' or str(result_table['Redshift Flag'][0]) == 'SED':
+            redshift = float(result_table['Redshift'][0])
+        # If the redshift source is PHOT, it is photometric and we ignore it
+        elif str(result_table['Redshift Flag'][0]) == 'PHOT':
+            redshift = None
+        # If the source is unclear, we see if spectral data exists in NED
+        else:
+            def check():
+                with host_services['ned']:
+                    r = host_breakers['ned'].call(lambda: requests.get('http://ned.ipac.caltech.edu/cgi-bin/NEDspectra?objname=' + result_table['Object Name'][0].replace('+', '%2B').replace(' ', '+')
+                        + '&extend=never&detail=0&preview=1&numpp=20&refcode=ANY&bandpass=ANY&line=ANY&hconst=73.0&omegam=0.27&omegav=0.73&corr_z=1',
+                        timeout=service_timeout), retries=1)
+
+                return 'Spectral data in NED archive for object' in r.text
+
+            try:
+                if cone_cache.has_spectra(str(result_table['Object Name'][0]), check):
+                    redshift = float(result_table['Redshift'][0])
+                else:
+                    redshift = None
+
+            except:
+                redshift = None
+    else:
+        redshift = None
+
+    return result_table['Object Name'][0], result_table['RA'][0], result_table['DEC'][0], result_table['Type'][0], redshift
+
+def select_SDSS_host(ra, dec, result_table):
+
+    ''' Info : Picks the SDSS object closest to a host candidate
+        Input : RA (deg), dec (deg) of the candidate, SDSS table of objects within 3 arcsec (from a cone search or crossmatch_hosts, or None)
+        Returns : Host name, host RA, host dec, host type, host redshift (always None, SDSS does not store redshifts for objects)
+    '''
+
+    if type(result_table) != Table:
+        return None, None, None, None, None
+
+    closest = np.argmin(np.sqrt((ra-np.array(result_table['ra']))**2+(dec-np.array(result_table['dec']))**2))
+
+    c = coordinates.SkyCoord(result_table['ra'][closest]*u.degree, result_table['dec'][closest]*u.degree)
+
+    name = 'SDSS ' + c.to_string('hmsdms', precision=2).replace('h', '').replace('m', '').replace('s', '').replace('d', '').replace(' ', '')
+
+    return name, result_table['ra'][closest], result_table['dec'][closest], 'SDSS', None
+
+def split_matches(result, idx, n):
+
+    ''' Info : Splits a bulk cross-match result into one table per input position
+        Input : result table, index of the input position of each row, number of positions
+        Returns : list of tables (or None if a position has no match)
+    '''
+
+    tables = [None]*n
+
+    for i in np.unique(idx):
+        tables[i] = result[idx == i]
+
+    return tables
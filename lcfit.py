@@ -0,0 +1,534 @@
+import json
+import numpy as np
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from bundle import *
+
+salt2_source = None # SALT2 source, loaded once per process by get_salt2_model
+salt2_grid = None   # SALT2 surfaces tabulated for batched fitting, built once per process by get_salt2_grid
+
+fit_dir = 'lcfits'  # Directory where the last successful fit of each source is kept for warm starts
+refit_tol = 0.1     # Largest change in reduced chi^2 from new photometry for which the previous fit is kept without refitting (None to always refit)
+
+# Batched fitting (fit_salt2_batch)
+batch_size = 100        # Sources per array job, memory grows with sources x bands x phases x wavelengths (~10 MB per source)
+batch_max_iter = 50     # Levenberg-Marquardt steps before a source is handed to sncosmo instead
+batch_tol = 1e-6        # Relative chi^2 improvement below which a fit has converged
+
+class LCFitEngine:
+
+    ''' Info : Fits SALT2 light curves for many sources across a pool of worker processes, each of which keeps its own SALT2 source
+        Attributes: workers (number of processes)
+    '''
+
+    def __init__(self, workers=None):
+        self.workers = workers if workers != None else min(4, os.cpu_count() or 1)
+        self.executor = None
+
+    def close(self):
+
+        ''' Info : Shuts down the worker processes
+            Input : self
+            Returns : None
+        '''
+
+        if self.executor != None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def fit(self, data, redshift, name=None):
+
+        ''' Info : Fits one light curve in this process
+            Input : self, photometry table, redshift, name of the source
+            Returns : fit dictionary (see fit_salt2)
+        '''
+
+        return fit_salt2(data, redshift, name=name)
+
+    def fit_many(self, datas, redshifts, names=None, batched=False):
+
+        ''' Info : Fits many light curves in parallel. If batched, sources with a redshift are fit together in one array job in this process
+                   (fit_salt2_batch) while the rest run on the worker processes, and any batched fit that fails is redone with sncosmo.
+            Input : self, list of photometry tables, list of redshifts, list of source names, whether to use the batched fitter
+            Returns : list of fit dictionaries in the same order as the input
+        '''
+
+        if names == None:
+            names = [None]*len(datas)
+
+        reused = {}
+
+        if batched:
+            # Stored fits that still describe the photometry are kept here, as fit_salt2 would, rather than refit in the batch
+            for i in range(len(datas)):
+                if redshifts[i] != 'No redshift found':
+                    fit = reuse_fit(datas[i], redshifts[i], names[i])
+                    if fit != None:
+                        reused[i] = fit
+
+            batch = [i for i in range(len(datas)) if redshifts[i] != 'No redshift found' and i not in reused]
+        else:
+            batch = []
+
+        futures = {i: self.submit(datas[i], redshifts[i], name=names[i]) for i in range(len(datas)) if i not in batch and i not in reused}
+
+        fits = fit_salt2_batch([datas[i] for i in batch], [redshifts[i] for i in batch], [names[i] for i in batch])
+
+        for i, fit in zip(batch, fits):
+            if fit['error'] != None or not fit['success']:
+                futures[i] = self.submit(datas[i], redshifts[i], name=names[i])
+
+        results = dict(zip(batch, fits))
+        results.update(reused)
+        results.update({i: future.result() for i, future in futures.items()})
+
+        return [results[i] for i in range(len(datas))]
+
+    def submit(self, data, redshift, name=None):
+
+        ''' Info : Queues a light curve fit on the worker processes
+            Input : self, photometry table, redshift, name of the source
+            Returns : Future of the fit dictionary
+        '''
+
+        if self.executor == None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        return self.executor.submit(fit_salt2, data, redshift, name)
+
+def fit_salt2(data, redshift, name=None, warm=True):
+
+    ''' Info : Fits photometry to a SALT2 light curve. If a redshift is given it is held fixed, otherwise it is fit within (0, 0.3).
+               When the source has a stored fit for the same redshift, the fit starts from its parameters, and if the new photometry changes
+               the reduced chi^2 of that fit by less than refit_tol the stored parameters are kept without fitting.
+        Input : photometry table (as from get_photometry), redshift (or 'No redshift found'), name of the source (needed for warm starts),
+                whether to use the stored fit
+        Returns : Dictionary with parameter names, parameters, errors, covariance, chi^2, ndof, fit success and message, fit time in seconds,
+                  whether it was warm started and whether the stored fit was reused, and error ('runtime error' or 'value error' if sncosmo
+                  failed, otherwise None)
+    '''
+
+    import sncosmo
+
+    start = time.time()
+
+    fit = {'name': name, 'param_names': None, 'parameters': None, 'errors': None, 'covariance': None, 'chisq': None, 'ndof': None,
+           'success': False, 'message': '', 'fit_time': None, 'warm_start': False, 'reused': False, 'error': None}
+
+    previous = load_fit(name) if name != None and warm else None
+
+    if previous != None and previous['redshift'] != str(redshift): # Redshift changed since, so the stored fit does not apply
+        previous = None
+
+    # Early exit if the new points are already described by the stored fit
+    if previous != None:
+        reused = reuse_fit(data, redshift, name)
+        if reused != None:
+            return reused
+
+    model = get_salt2_model()
+
+    try:
+        if redshift != 'No redshift found':
+            model.set(z=float(redshift))
+
+        if previous != None:
+            model.set(**dict(zip(previous['param_names'], previous['parameters'])))
+            fit['warm_start'] = True
+
+        if redshift != 'No redshift found':
+            result, fitted_model = sncosmo.fit_lc(
+                data, model,
+                ['t0', 'x0', 'x1', 'c'],
+                guess_amplitude=previous == None, guess_t0=previous == None, guess_z=False, minsnr=5)
+        else:
+            result, fitted_model = sncosmo.fit_lc(
+                data, model,
+                ['z', 't0', 'x0', 'x1', 'c'],
+                bounds={'z':(0,0.3)}, guess_amplitude=previous == None, guess_t0=previous == None, guess_z=previous == None, minsnr=5)
+    except RuntimeError as e:
+        fit['error'] = 'runtime error'
+        fit['message'] = str(e)
+    except ValueError as e:
+        fit['error'] = 'value error'
+        fit['message'] = str(e)
+    else:
+        fit['param_names'] = list(fitted_model.param_names)
+        fit['parameters'] = [float(p) for p in fitted_model.parameters]
+        fit['errors'] = {k: float(v) for k, v in result.errors.items()}
+        fit['covariance'] = np.asarray(result.covariance).tolist() if result.covariance is not None else None
+        fit['chisq'] = float(result.chisq)
+        fit['ndof'] = int(result.ndof)
+        fit['success'] = bool(result.success)
+        fit['message'] = result.message
+
+    fit['fit_time'] = time.time() - start
+
+    if fit['error'] == None and name != None:
+        save_fit(fit, redshift, len(data))
+
+    return fit
+
+def fit_salt2_batch(datas, redshifts, names=None):
+
+    ''' Info : Fits many SALT2 light curves with fixed redshifts at once. Band fluxes of every point of every source are evaluated in a few
+               array operations on SALT2 surfaces tabulated by get_salt2_grid (linear instead of sncosmo's bicubic interpolation between grid
+               points), and one Levenberg-Marquardt step is taken for all sources together until each has converged. Sources are processed
+               batch_size at a time. Stored fits are used as starting points, as in fit_salt2.
+        Input : list of photometry tables (as from get_photometry), list of redshifts (not 'No redshift found'), list of source names
+        Returns : list of fit dictionaries (see fit_salt2) in the same order as the input
+    '''
+
+    if names == None:
+        names = [None]*len(datas)
+
+    fits = []
+
+    for lo in range(0, len(datas), batch_size):
+        fits += fit_salt2_chunk(datas[lo:lo+batch_size], redshifts[lo:lo+batch_size], names[lo:lo+batch_size])
+
+    return fits
+
+def fit_salt2_chunk(datas, redshifts, names):
+
+    ''' Info : Runs fit_salt2_batch on one batch of sources
+        Input : list of photometry tables, list of redshifts, list of source names
+        Returns : list of fit dictionaries
+    '''
+
+    import sncosmo
+
+    from sncosmo.constants import HC_ERG_AA
+
+    start = time.time()
+
+    grid = get_salt2_grid()
+    n = len(datas)
+    z = np.array([float(r) for r in redshifts])
+    a = 1/(1 + z)
+
+    # One case per source and band, with the band's integration grid in the rest frame of the source
+    case_source, case_w, case_g0, case_g1, case_cl = [], [], [], [], []
+    point_source, point_case, point_time, point_flux, point_err, point_scale = [], [], [], [], [], []
+
+    for s in range(n):
+        data = datas[s]
+        bands = np.asarray(data['filter']).astype(str)
+        zpsys = np.asarray(data['zpsys']).astype(str)
+
+        for band in np.unique(bands):
+            bandpass = sncosmo.get_bandpass(band)
+            steps = int(np.ceil((bandpass.maxwave() - bandpass.minwave())/5.0)) # Same integration grid as sncosmo
+            dwave = (bandpass.maxwave() - bandpass.minwave())/steps
+            wave = bandpass.minwave() + (np.arange(steps) + 0.5)*dwave
+            restwave = wave*a[s]
+
+            if restwave[0] < grid['wave'][0] or restwave[-1] > grid['wave'][-1]:
+                continue # Band is outside the model at this redshift, sncosmo also leaves it out
+
+            iw = np.clip(np.searchsorted(grid['wave'], restwave) - 1, 0, len(grid['wave']) - 2)
+            fw = (restwave - grid['wave'][iw])/(grid['wave'][iw+1] - grid['wave'][iw])
+
+            mask = (bands == band) & (np.asarray(data['fluxerr']) > 0)
+            zpscale = np.ones(int(np.sum(mask)))
+            for system in np.unique(zpsys[mask]):
+                zpscale[zpsys[mask] == system] = 1/sncosmo.get_magsystem(system).zpbandflux(band)
+
+            point_source.append(np.full(len(zpscale), s))
+            point_case.append(np.full(len(zpscale), len(case_source)))
+            point_time.append(np.asarray(data['mjd'])[mask])
+            point_flux.append(np.asarray(data['flux'])[mask])
+            point_err.append(np.asarray(data['fluxerr'])[mask])
+            point_scale.append(10**(0.4*np.asarray(data['zp'])[mask])*zpscale*a[s]/HC_ERG_AA)
+
+            case_source.append(s)
+            case_w.append(wave*bandpass(wave)*dwave)
+            case_g0.append(grid['m0'][:, iw]*(1 - fw) + grid['m0'][:, iw+1]*fw)
+            case_g1.append(grid['m1'][:, iw]*(1 - fw) + grid['m1'][:, iw+1]*fw)
+            case_cl.append(grid['colorlaw'](restwave))
+
+    fits = [{'name': names[s], 'param_names': None, 'parameters': None, 'errors': None, 'covariance': None, 'chisq': None, 'ndof': None,
+             'success': False, 'message': '', 'fit_time': None, 'warm_start': False, 'reused': False, 'error': None} for s in range(n)]
+
+    join = lambda arrays, dtype: np.concatenate(arrays).astype(dtype) if len(arrays) > 0 else np.zeros(0, dtype=dtype)
+    src, kpt = join(point_source, int), join(point_case, int)
+    t, f, e, scale = join(point_time, float), join(point_flux, float), join(point_err, float), join(point_scale, float)
+
+    counts = np.bincount(src, minlength=n)
+    fittable = counts > 4
+
+    for s in np.where(~fittable)[0]:
+        fits[s]['error'] = 'value error'
+        fits[s]['message'] = 'fewer than 5 data points within the model range'
+
+    if not np.any(fittable):
+        return fits
+
+    # Pad the cases to a common number of wavelengths (padding has zero weight)
+    length = max(len(w) for w in case_w)
+    pad = lambda arrays: np.array([np.pad(x, [(0, 0)]*(x.ndim - 1) + [(0, length - x.shape[-1])]) for x in arrays])
+    W, G0, G1, CL = pad(case_w), pad(case_g0), pad(case_g1), pad(case_cl)
+    case_source = np.array(case_source, dtype=int)
+
+    phase_grid = grid['phase']
+    dphase = phase_grid[1] - phase_grid[0]
+    ln10 = np.log(10)
+
+    def evaluate(P):
+
+        # Band integrals on the phase grid for each case at the current colour, then linear interpolation in phase for each point
+        E = W*10**(-0.4*P[case_source, 3][:, None]*CL)
+        B0 = np.matmul(G0, E[:, :, None])[:, :, 0]
+        B1 = np.matmul(G1, E[:, :, None])[:, :, 0]
+        B0c = np.matmul(G0, (E*CL)[:, :, None])[:, :, 0]*(-0.4*ln10)
+        B1c = np.matmul(G1, (E*CL)[:, :, None])[:, :, 0]*(-0.4*ln10)
+
+        phase = (t - P[src, 0])*a[src]
+        inrange = (phase >= phase_grid[0]) & (phase <= phase_grid[-1])
+        ip = np.clip(((phase - phase_grid[0])//dphase).astype(int), 0, len(phase_grid) - 2)
+        fp = (phase - phase_grid[ip])/dphase
+
+        value = lambda B: B[kpt, ip]*(1 - fp) + B[kpt, ip+1]*fp
+        slope = lambda B: (B[kpt, ip+1] - B[kpt, ip])/dphase
+
+        x0, x1 = P[src, 1], P[src, 2]
+        S = value(B0) + x1*value(B1)
+
+        model = x0*scale*S
+        J = np.column_stack([x0*scale*(slope(B0) + x1*slope(B1))*(-a[src]), scale*S, x0*scale*value(B1), x0*scale*(value(B0c) + x1*value(B1c))])
+
+        model[~inrange] = 0 # The model has no flux outside its phase range
+        J[~inrange] = 0
+
+        return model, J, inrange
+
+    def normal(model, J):
+
+        r = (f - model)/e
+        Jw = J/e[:, None]
+        A = np.zeros((n, 4, 4))
+        g = np.zeros((n, 4))
+
+        for i in range(4):
+            g[:, i] = np.bincount(src, Jw[:, i]*r, minlength=n)
+            for j in range(i, 4):
+                A[:, i, j] = A[:, j, i] = np.bincount(src, Jw[:, i]*Jw[:, j], minlength=n)
+
+        return A, g, np.bincount(src, r**2, minlength=n)
+
+    # Starting point: stored fit for the same redshift, otherwise t0 at the brightest significant point and x0 by linear least squares
+    P = np.zeros((n, 4))
+
+    for s in np.where(fittable)[0]:
+        previous = load_fit(names[s]) if names[s] != None else None
+
+        if previous != None and previous['redshift'] == str(redshifts[s]):
+            params = dict(zip(previous['param_names'], previous['parameters']))
+            P[s] = [params['t0'], params['x0'], params['x1'], params['c']]
+            fits[s]['warm_start'] = True
+        else:
+            mask = src == s
+            significant = mask & (f/e > 5)
+            use = significant if np.any(significant) else mask
+            P[s] = [t[use][np.argmax(f[use])] + 0.0, 1.0, 0.0, 0.0]
+
+    cold = fittable & ~np.array([fit['warm_start'] for fit in fits])
+    if np.any(cold):
+        model, J, inrange = evaluate(P)
+        num = np.bincount(src, f*model/e**2, minlength=n)
+        den = np.bincount(src, model**2/e**2, minlength=n)
+        P[cold, 1] = np.where(den[cold] > 0, num[cold]/np.where(den[cold] > 0, den[cold], 1), 1e-4)
+
+    # Levenberg-Marquardt, one damped Gauss-Newton step for all active sources per iteration
+    model, J, inrange = evaluate(P)
+    A, g, chisq = normal(model, J)
+
+    lam = np.full(n, 1e-3)
+    active = fittable.copy()
+    converged = np.zeros(n, dtype=bool)
+
+    for it in range(batch_max_iter):
+        if not np.any(active):
+            break
+
+        damped = A + lam[:, None, None]*A*np.eye(4)
+        damped[~active] = np.eye(4)
+
+        try:
+            delta = np.linalg.solve(damped, g[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            delta = np.matmul(np.linalg.pinv(damped), g[:, :, None])[:, :, 0]
+
+        delta[~active] = 0
+
+        trial = P + delta
+        trial_model, trial_J, trial_inrange = evaluate(trial)
+        trial_A, trial_g, trial_chisq = normal(trial_model, trial_J)
+
+        better = active & (trial_chisq < chisq)
+        done = better & (chisq - trial_chisq < batch_tol*chisq)
+
+        P[better] = trial[better]
+        A[better], g[better] = trial_A[better], trial_g[better]
+        chisq[better] = trial_chisq[better]
+
+        points = better[src]
+        model[points], J[points], inrange[points] = trial_model[points], trial_J[points], trial_inrange[points]
+
+        lam[better] /= 10
+        lam[active & ~better] *= 10
+
+        done |= active & (lam > 1e10) # No step improves the fit, so it is at the minimum
+
+        converged |= done
+        active &= ~done
+
+    ndof = counts - 4 # As sncosmo counts it: every point in a band within the model, including those outside the phase range
+    inside = np.bincount(src, inrange.astype(int), minlength=n) # Points within the phase range, which are the only ones that constrain the fit
+    elapsed = (time.time() - start)/max(1, int(np.sum(fittable)))
+
+    for s in np.where(fittable)[0]:
+        params = [float(z[s])] + [float(p) for p in P[s]]
+
+        try:
+            covariance = np.linalg.inv(A[s])
+        except np.linalg.LinAlgError:
+            covariance = np.full((4, 4), np.nan)
+
+        # A source whose points all left the phase range (or are degenerate) stops improving without being fit
+        converged[s] = converged[s] and inside[s] > 4 and np.all(np.isfinite(covariance))
+
+        fits[s].update({'param_names': ['z', 't0', 'x0', 'x1', 'c'], 'parameters': params,
+                        'errors': {name: float(np.sqrt(np.abs(covariance[i, i]))) for i, name in enumerate(['t0', 'x0', 'x1', 'c'])},
+                        'covariance': covariance.tolist(), 'chisq': float(chisq[s]), 'ndof': int(ndof[s]), 'success': bool(converged[s]),
+                        'message': 'batched fit converged' if converged[s] else 'batched fit did not converge', 'fit_time': elapsed})
+
+        if converged[s] and names[s] != None:
+            save_fit(fits[s], redshifts[s], len(datas[s]))
+
+    return fits
+
+def get_salt2_grid():
+
+    ''' Info : Tabulates the SALT2 M0 and M1 surfaces of the shared source on a 1 day x 10 Angstrom grid (the SALT2 model's own grid), once
+               per process, for fit_salt2_batch
+        Input : None
+        Returns : dictionary with phase and wave grids, m0 and m1 surfaces (phase x wave) and the colour law function
+    '''
+
+    global salt2_grid
+
+    if salt2_grid == None:
+        source = get_salt2_model().source
+
+        phase = np.arange(np.ceil(source.minphase()), np.floor(source.maxphase()) + 1, 1.0)
+        wave = np.arange(np.ceil(source.minwave()), np.floor(source.maxwave()) + 1, 10.0)
+
+        source.set(x0=1, x1=0, c=0)
+        m0 = source.flux(phase, wave)
+        source.set(x0=1, x1=1, c=0)
+        m1 = source.flux(phase, wave) - m0
+
+        salt2_grid = {'phase': phase, 'wave': wave, 'm0': m0, 'm1': m1, 'colorlaw': source.colorlaw}
+
+    return salt2_grid
+
+def get_salt2_model():
+
+    ''' Info : Builds a SALT2 model from the source loaded once in this process (from the local bundle if there is one), so repeated fits
+               do not reload the model surfaces
+        Input : None
+        Returns : sncosmo.Model with default parameters
+    '''
+
+    global salt2_source
+
+    import sncosmo
+
+    if salt2_source == None:
+        register_bundle() # Local SALT2 files and bandpasses, if a bundle has been built
+        salt2_source = sncosmo.get_source('salt2', version=bundle_salt2_version)
+
+    return sncosmo.Model(source=salt2_source) # Model takes its own shallow copy of the source
+
+def load_fit(name):
+
+    ''' Info : Reads the last successful fit of a source
+        Input : name of the source
+        Returns : dictionary saved by save_fit, or None if the source has not been fit
+    '''
+
+    try:
+        with open(os.path.join(fit_dir, name + '.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def reuse_fit(data, redshift, name):
+
+    ''' Info : Keeps the stored fit of a source without refitting, if it is for the same redshift and the new photometry changes its reduced
+               chi^2 by less than refit_tol. The result is not saved, so later photometry is still compared against the last real fit.
+        Input : photometry table, redshift, name of the source
+        Returns : fit dictionary (see fit_salt2) with the stored parameters, or None if the source needs fitting
+    '''
+
+    import sncosmo
+
+    start = time.time()
+
+    previous = load_fit(name) if name != None and refit_tol != None else None
+
+    if previous == None or previous['redshift'] != str(redshift):
+        return None
+
+    ndof = previous['ndof'] + len(data) - previous['n']
+
+    if ndof <= 0 or previous['ndof'] <= 0:
+        return None
+
+    model = get_salt2_model()
+
+    try:
+        if redshift != 'No redshift found':
+            model.set(z=float(redshift))
+
+        model.set(**dict(zip(previous['param_names'], previous['parameters'])))
+        chisq = float(sncosmo.chisq(data, model))
+    except (RuntimeError, ValueError):
+        return None
+
+    if np.abs(chisq/ndof - previous['chisq']/previous['ndof']) >= refit_tol:
+        return None
+
+    return {'name': name, 'param_names': previous['param_names'], 'parameters': previous['parameters'], 'errors': previous['errors'],
+            'covariance': previous['covariance'], 'chisq': chisq, 'ndof': ndof, 'success': True, 'message': 'stored fit kept',
+            'fit_time': time.time() - start, 'warm_start': True, 'reused': True, 'error': None}
+
+def save_fit(fit, redshift, n):
+
+    ''' Info : Stores a successful fit so later refits of the source can start from it
+        Input : fit dictionary (from fit_salt2), redshift it was fit with, number of photometry points
+        Returns : None
+    '''
+
+    if not os.path.exists(fit_dir):
+        os.makedirs(fit_dir, exist_ok=True)
+
+    stored = {'redshift': str(redshift), 'n': n, 'fitted_at': time.time()}
+
+    for key in ['param_names', 'parameters', 'errors', 'covariance', 'chisq', 'ndof']:
+        stored[key] = fit[key]
+
+    path = os.path.join(fit_dir, fit['name'] + '.json')
+    tmp = path + '.' + str(os.getpid()) + '.tmp'
+
+    with open(tmp, 'w') as f:
+        json.dump(stored, f)
+
+    os.replace(tmp, path)
+
+# Shared by the pipeline, worker processes are started on first use
+lc_engine = LCFitEngine()
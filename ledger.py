@@ -0,0 +1,169 @@
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+import time
+
+ledger_file = 'ledger.db' # Local record of sources the pipeline has handled, rebuilt from Fritz with: python ledger.py reconcile
+
+# Fritz comments that mark a source as handled, the event recorded for each, and whether the comment must be exactly the text (the TNS
+# markers, as class_submission and pull_class check them) or only contain it (Zooniverse comments go on to give the classification)
+ledger_markers = {'Uploaded to TNS': ('tns_uploaded', True),
+                  'Classification from TNS': ('tns_classified', True),
+                  'zooniverse classification': ('zooniverse', False)}
+
+class SubmissionLedger:
+
+    ''' Info : SQLite ledger of what has been done for each source (TNS uploads, TNS classifications, Zooniverse classifications, submitted
+               reports), so stages can skip handled sources in one query instead of scanning each source's comments on Fritz. Every change is
+               a single transaction, so the ledger stays consistent if the pipeline is interrupted.
+        Attributes: path, connection (shared by threads, guarded by a lock)
+    '''
+
+    def __init__(self, path=ledger_file):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def connect(self):
+
+        ''' Info : Opens the database the first time it is needed and creates the table (call with self.lock held)
+            Input : self
+            Returns : sqlite3 connection
+        '''
+
+        if self.conn == None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            with self.conn:
+                self.conn.execute('CREATE TABLE IF NOT EXISTS events (source TEXT NOT NULL, kind TEXT NOT NULL, time REAL NOT NULL, detail TEXT, '
+                                  'PRIMARY KEY (source, kind))')
+
+        return self.conn
+
+    def handled(self, sources, kinds):
+
+        ''' Info : Finds which sources have any of the given events, in one query
+            Input : self, list of sources, list of event kinds (from ledger_markers, or 'tns_submitted')
+            Returns : dictionary of source -> set of its events among kinds, for the sources that have any
+        '''
+
+        sources = [str(source) for source in sources]
+        kinds = list(kinds)
+
+        if len(sources) == 0 or len(kinds) == 0:
+            return {}
+
+        found = {}
+
+        with self.lock:
+            conn = self.connect()
+
+            # SQLite limits the number of parameters of a query, so long lists are split
+            for lo in range(0, len(sources), 500):
+                chunk = sources[lo:lo+500]
+                rows = conn.execute('SELECT source, kind FROM events WHERE source IN (' + ','.join('?'*len(chunk)) + ') AND kind IN (' +
+                                    ','.join('?'*len(kinds)) + ')', chunk + kinds).fetchall()
+
+                for source, kind in rows:
+                    found.setdefault(source, set()).add(kind)
+
+        return found
+
+    def record(self, source, kind, detail=None):
+
+        ''' Info : Records an event for a source (replacing an earlier event of the same kind)
+            Input : self, source, event kind, detail (e.g. comment text or report ID)
+            Returns : None
+        '''
+
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?)', (str(source), kind, time.time(), detail))
+
+    def record_comment(self, source, text):
+
+        ''' Info : Records the event of a Fritz comment, if it is one of the ledger_markers
+            Input : self, source, comment text
+            Returns : event kind, or None if the comment is not a marker
+        '''
+
+        kind = marker_kind(text)
+
+        if kind != None:
+            self.record(source, kind, text)
+
+        return kind
+
+    def reconcile(self, comments):
+
+        ''' Info : Rebuilds the comment events of sources from their Fritz comments, in one transaction. Submitted report IDs are kept.
+            Input : self, dictionary of source -> list of comment texts
+            Returns : number of events recorded
+        '''
+
+        rows = []
+
+        for source, texts in comments.items():
+            for text in texts:
+                kind = marker_kind(text)
+                if kind != None:
+                    rows.append((str(source), kind, time.time(), text))
+
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                kinds = [kind for kind, exact in ledger_markers.values()]
+                conn.executemany('DELETE FROM events WHERE source = ? AND kind IN (' + ','.join('?'*len(kinds)) + ')',
+                                 [[str(source)] + kinds for source in comments])
+                conn.executemany('INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?)', rows)
+
+        return len(rows)
+
+def marker_kind(text):
+
+    ''' Info : Event of a Fritz comment, if it is one of the ledger_markers
+        Input : comment text
+        Returns : event kind, or None
+    '''
+
+    for marker, (kind, exact) in ledger_markers.items():
+        if text == marker if exact else marker in text:
+            return kind
+
+    return None
+
+def read_sources(path):
+
+    ''' Info : Reads the source names of a source list downloaded in step 0
+        Input : path of the ASCII file
+        Returns : list of ZTF names
+    '''
+
+    with open(path, 'r') as f:
+        return [row['Source Name'] for row in csv.DictReader(f, delimiter='\t') if row.get('Source Name')]
+
+# Shared by the pipeline
+ledger = SubmissionLedger()
+
+if __name__ == '__main__':
+
+    # Rebuilds the ledger from the comments on Fritz, e.g. after deleting ledger.db or when comments were posted by hand
+    parser = argparse.ArgumentParser(description='Rebuild the submission ledger from Fritz comments.')
+    parser.add_argument('action', choices=['reconcile'])
+    parser.add_argument('--sources', default='RCF_sources.ascii', help='source list downloaded in step 0')
+    parser.add_argument('--workers', type=int, default=4, help='sources whose comments are fetched at once')
+    args = parser.parse_args()
+
+    from concurrent.futures import ThreadPoolExecutor
+    from func import get_source_api
+
+    sources = read_sources(args.sources)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        infos = list(executor.map(get_source_api, sources))
+
+    comments = {source: [c['text'] for c in info['comments']] for source, info in zip(sources, infos)}
+
+    print('Recorded ' + str(ledger.reconcile(comments)) + ' events for ' + str(len(sources)) + ' sources in ' + ledger.path + '.')
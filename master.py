@@ -35,6 +35,7 @@ from func import *
 from snid import *
 from hosts import *
 from zooniverse import *
+from prepare import *
 
 # Create data directory if one does not exist
 test = os.listdir(os.getcwd())
@@ -71,7 +72,7 @@ sources, tns_names, savedates, classifys, class_dates, reds, users, unclassifys,
 
 option = ''
 while option != 0: # Select options
-    print('1: Check for missing redshifts\n2: Classify unclassified sources\n3: Check and upload light curve data\n4: Associate hosts with saved sources\n5: Submit Fritz classifications to TNS')
+    print('1: Check for missing redshifts\n2: Classify unclassified sources\n3: Check and upload light curve data\n4: Associate hosts with saved sources\n5: Submit Fritz classifications to TNS\n6: Precompute classification results for unclassified sources')
     option = int(input('Enter in what you want to do, 0 to exit, or "all" to do all: '))
 
     if option == 1 or option == 'all':
@@ -96,7 +97,9 @@ while option != 0: # Select options
         else:
             print(str(len(unclassifys)) + ' unclassified transients on Fritz have been saved.')
 
-            submit_class(unclassifys, unclassified_reds, f)
+            auto = input('Auto-accept SNID results where the top templates agree? [y/n] ') == 'y'
+
+            submit_class(unclassifys, unclassified_reds, f, auto=auto)
 
             sources, tns_names, savedates, classifys, class_dates, reds, users, unclassifys, unclassified_reds = read_ascii(f, startd) # Reload RCF source file with newly classified transients
 
@@ -107,9 +110,9 @@ while option != 0: # Select options
         phot_sources = np.concatenate(([sources[s] for s in np.arange(0,len(sources)) if 'Ia' in classifys[s]], unclassifys))
         phot_reds = np.concatenate(([reds[s] for s in np.arange(0,len(reds)) if 'Ia' in classifys[s]], unclassified_reds))
 
-        for p in np.arange(0,len(phot_sources)):
-            print(bcolors.OKCYAN + str(p+1) + '/' + str(len(phot_sources)) + bcolors.ENDC + ': ' + bcolors.OKBLUE + phot_sources[p] + bcolors.ENDC)
-            post_lc(phot_sources[p], phot_reds[p])
+        phot_ias = np.concatenate(([True for s in np.arange(0,len(sources)) if 'Ia' in classifys[s]], [False]*len(unclassifys)))
+
+        post_lcs(phot_sources, phot_reds, ias=phot_ias) # Fits run in parallel, results are posted in order
 
     if option == 4 or option == 'all':
 
@@ -117,10 +120,7 @@ while option != 0: # Select options
 
         saved_sources = np.append(sources, unclassifys)
 
-        for i in np.arange(0,len(saved_sources)):
-            print(bcolors.OKCYAN + str(i+1) + '/' + str(len(saved_sources)) + bcolors.ENDC + ': ' + bcolors.OKBLUE + saved_sources[i] + bcolors.ENDC)
-            post_host(saved_sources[i])
-            comment_sublink(saved_sources[i])
+        post_hosts(saved_sources) # Lookups run in parallel, results are posted in order
 
     if option == 5 or option == 'all':
         print(bcolors.OKGREEN + 'Beginning TNS submissions...' + bcolors.ENDC)
@@ -129,4 +129,11 @@ while option != 0: # Select options
 
         class_submission(sources, tns_names, classifys, class_dates, users, reds) # Runs TNS submission script
 
+    if option == 6:
+        print(bcolors.OKGREEN + 'Precomputing classification results...' + bcolors.ENDC)
+
+        workers = input('Enter in the number of sources to process in parallel or enter nothing for 1: ')
+
+        prepare_class(unclassifys, unclassified_reds, workers=int(workers) if workers != '' else 1) # Results are picked up by option 2
+
 print('Submission complete. Goodbye!')
@@ -0,0 +1,287 @@
+import numpy as np
+import os
+import threading
+import time
+
+from operator import itemgetter
+
+photometry_dir = 'photometry' # Directory of the local photometry store, one .npz per source and format
+photometry_max_age = 7        # Days after which stored photometry is downloaded again even if no new detections are reported
+
+# Pre-screen of light curves before SALT2 fitting
+screen_min_points = 5   # Fewer usable points than this cannot constrain t0, x0, x1 and c, so the fit is skipped
+screen_min_baseline = 5 # Days of photometry below which the user is asked before fitting
+
+# Columns kept for each photometry format, in the order they are stored
+photometry_columns = {'flux': [('id', int), ('mjd', float), ('filter', str), ('flux', float), ('fluxerr', float), ('zp', float), ('magsys', str)],
+                      'mag': [('id', int), ('mjd', float), ('filter', str), ('mag', float), ('magerr', float), ('magsys', str)]}
+
+class PhotometryStore:
+
+    ''' Info : Local columnar archive of Fritz photometry. Each source is saved as an .npz of typed columns together with the last MJD and
+               number of points seen, so a source is only downloaded again once Fritz reports a detection newer than what is stored.
+        Attributes: directory, max_age (days), columns already read this session
+    '''
+
+    def __init__(self, directory=photometry_dir, max_age=photometry_max_age):
+        self.directory = directory
+        self.max_age = max_age
+        self.memory = {}        # (source, format) -> columns
+        self.lock = threading.Lock()
+
+    def current(self, entry, last_detected):
+
+        ''' Info : Checks whether stored photometry can be used as is
+            Input : self, stored entry (from read), MJD of the latest detection reported by Fritz (None if unknown)
+            Returns : True if the entry is younger than max_age and has every reported detection, False otherwise
+        '''
+
+        if entry == None or last_detected == None:
+            return False
+
+        if time.time() - entry['fetched_at'] > self.max_age*86400:
+            return False
+
+        return last_detected <= entry['last_mjd'] + 1e-6
+
+    def get(self, source, format, fetch, last_detected):
+
+        ''' Info : Returns photometry for a source, reading it from the store when it is current and downloading it otherwise
+            Input : self, source, format ('flux' or 'mag'), function returning the list of photometry points from Fritz,
+                    function returning the MJD of the latest detection on Fritz (only called if the source is stored)
+            Returns : dictionary of columns
+        '''
+
+        with self.lock:
+            if (source, format) in self.memory:
+                return self.memory[(source, format)]
+
+        entry = self.read(source, format)
+
+        if entry == None or not self.current(entry, last_detected()):
+            entry = self.write(source, format, decode_photometry(fetch(), format))
+
+        with self.lock:
+            self.memory[(source, format)] = entry['columns']
+
+        return entry['columns']
+
+    def path(self, source, format):
+
+        ''' Info : File a source is stored in
+            Input : self, source, format
+            Returns : path
+        '''
+
+        return os.path.join(self.directory, source + '_' + format + '.npz')
+
+    def read(self, source, format):
+
+        ''' Info : Loads a stored source
+            Input : self, source, format
+            Returns : dictionary with columns, last_mjd, n and fetched_at, or None if the source is not stored (or the file is unreadable)
+        '''
+
+        try:
+            with np.load(self.path(source, format)) as f:
+                columns = {name: f[name] for name, dtype in photometry_columns[format]}
+                return {'columns': columns, 'last_mjd': float(f['last_mjd']), 'n': int(f['n']), 'fetched_at': float(f['fetched_at'])}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def write(self, source, format, columns):
+
+        ''' Info : Saves a source's columns along with the last MJD and number of points
+            Input : self, source, format, dictionary of columns
+            Returns : stored entry
+        '''
+
+        entry = {'columns': columns, 'last_mjd': float(np.max(columns['mjd'])) if len(columns['mjd']) > 0 else 0.0,
+                 'n': len(columns['mjd']), 'fetched_at': time.time()}
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+        path = self.path(source, format)
+        tmp = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+
+        with open(tmp, 'wb') as f:
+            np.savez(f, last_mjd=entry['last_mjd'], n=entry['n'], fetched_at=entry['fetched_at'], **columns)
+
+        os.replace(tmp, path)
+
+        return entry
+
+def decode_photometry(points, format):
+
+    ''' Info : Converts the photometry points returned by Fritz into typed columns. Fields are pulled out of every point in one pass and
+               each column is converted in one go, so there is no per-point Python work. Missing values become NaN (or -1 / '').
+        Input : list of photometry dictionaries, format ('flux' or 'mag')
+        Returns : dictionary of NumPy arrays
+    '''
+
+    names = [name for name, dtype in photometry_columns[format]]
+
+    try:
+        rows = list(map(itemgetter(*names), points))
+    except KeyError:
+        rows = [tuple(p.get(name) for name in names) for p in points] # Some points are missing a field
+
+    fields = np.empty((len(rows), len(names)), dtype=object)
+    if len(rows) > 0:
+        fields[:] = rows
+
+    columns = {}
+
+    for i, (name, dtype) in enumerate(photometry_columns[format]):
+        field = fields[:, i]
+
+        if dtype == float:
+            columns[name] = field.astype(float) # None becomes NaN
+        else:
+            missing = field == None
+            field[missing] = -1 if dtype == int else ''
+            columns[name] = field.astype(np.int64 if dtype == int else str)
+
+    return columns
+
+def photometry_table(columns, format, filters=('ztfg', 'ztfr')):
+
+    ''' Info : Selects the usable points of a source (value present, in one of the given filters) as a structured array, which sncosmo
+               accepts in place of an astropy table and which is cheap to pickle to worker processes
+        Input : dictionary of columns (from decode_photometry or the store), format ('flux' or 'mag'), filters to keep
+        Returns : NumPy structured array with mjd, filter, flux, fluxerr, zp, zpsys (or mjd, filter, mag, magerr, zpsys)
+    '''
+
+    keep = ~np.isnan(columns[format]) & np.isin(columns['filter'], filters)
+
+    if format == 'flux':
+        names = [('mjd', 'mjd'), ('filter', 'filter'), ('flux', 'flux'), ('fluxerr', 'fluxerr'), ('zp', 'zp'), ('zpsys', 'magsys')]
+    else:
+        names = [('mjd', 'mjd'), ('filter', 'filter'), ('mag', 'mag'), ('magerr', 'magerr'), ('zpsys', 'magsys')]
+
+    table = np.empty(int(np.sum(keep)), dtype=[(name, columns[column].dtype) for name, column in names])
+
+    for name, column in names:
+        table[name] = columns[column][keep]
+
+    return table
+
+def photometry_features(tables):
+
+    ''' Info : Computes light curve features for many sources at once. All points are concatenated with a source index and reduced per
+               source (and band) with array operations. Fluxes are scaled to a zero point of 25 so sources with different zero points compare.
+        Input : list of photometry tables (as from photometry_table, flux format)
+        Returns : Dictionary of arrays with one entry per source: n_points, n_epochs (distinct nights), baseline (days), and for ztfg and
+                  ztfr the peak flux, peak MJD, rise and decline rates (fraction of peak flux per day), plus g-r colour at peak (NaN if unknown)
+    '''
+
+    n = len(tables)
+    counts = np.array([len(t) for t in tables], dtype=int)
+
+    features = {'n_points': counts}
+
+    if n == 0 or np.sum(counts) == 0:
+        for key in ['n_epochs', 'baseline', 'colour'] + [key + '_' + band for band in ['ztfg', 'ztfr'] for key in ['peak_flux', 'peak_mjd', 'rise', 'decline']]:
+            features[key] = np.full(n, np.nan) if key != 'n_epochs' else np.zeros(n, dtype=int)
+        return features
+
+    idx = np.repeat(np.arange(n), counts)
+    mjd = np.concatenate([t['mjd'] for t in tables])
+    band = np.concatenate([t['filter'].astype(str) for t in tables])
+    flux = np.concatenate([t['flux']*10**(0.4*(25 - t['zp'])) for t in tables])
+
+    features['n_epochs'] = np.bincount(np.unique(np.stack([idx, np.floor(mjd).astype(int)]), axis=1)[0], minlength=n)
+
+    first = np.full(n, np.inf)
+    last = np.full(n, -np.inf)
+    np.minimum.at(first, idx, mjd)
+    np.maximum.at(last, idx, mjd)
+    features['baseline'] = np.where(counts > 0, last - first, np.nan)
+
+    for b in ['ztfg', 'ztfr']:
+        inband = band == b
+        bidx, bmjd, bflux = idx[inband], mjd[inband], flux[inband]
+
+        peak_flux = np.full(n, np.nan)
+        peak_mjd = np.full(n, np.nan)
+        rise = np.full(n, np.nan)
+        decline = np.full(n, np.nan)
+
+        if len(bidx) > 0:
+            # Brightest point of each source is the last of its group when sorted by source then flux
+            order = np.lexsort((bflux, bidx))
+            ends = np.r_[bidx[order][1:] != bidx[order][:-1], True]
+            peak_flux[bidx[order][ends]] = bflux[order][ends]
+            peak_mjd[bidx[order][ends]] = bmjd[order][ends]
+
+            # Earliest and latest point of each source in this band
+            order = np.lexsort((bmjd, bidx))
+            starts = np.r_[True, bidx[order][1:] != bidx[order][:-1]]
+            ends = np.r_[bidx[order][1:] != bidx[order][:-1], True]
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                s, e = bidx[order][starts], bidx[order][ends]
+                rise[s] = (peak_flux[s] - bflux[order][starts])/(peak_mjd[s] - bmjd[order][starts])/peak_flux[s]
+                decline[e] = (peak_flux[e] - bflux[order][ends])/(bmjd[order][ends] - peak_mjd[e])/peak_flux[e]
+
+        rise[~np.isfinite(rise)] = np.nan       # Peak is the first point, so no rise was seen
+        decline[~np.isfinite(decline)] = np.nan # Peak is the last point, so no decline was seen
+
+        features['peak_flux_' + b] = peak_flux
+        features['peak_mjd_' + b] = peak_mjd
+        features['rise_' + b] = rise
+        features['decline_' + b] = decline
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        colour = -2.5*np.log10(features['peak_flux_ztfg']/features['peak_flux_ztfr'])
+
+    colour[~np.isfinite(colour)] = np.nan
+    features['colour'] = colour
+
+    return features
+
+def screen_photometry(features, min_points=None, min_baseline=None):
+
+    ''' Info : Decides which light curves are worth a SALT2 fit, before any fitting, and ranks them so the most promising are fit first.
+               Sources with too few points or no positive flux are skipped, those with a short baseline are asked about, the rest are fit.
+               Sources seen in both bands and with both the rise and decline are ranked ahead, then by number of nights.
+        Input : features (from photometry_features), minimum number of points and baseline in days (module defaults if None)
+        Returns : array of decisions ('fit', 'ask' or 'skip'), array of the reason for each decision other than 'fit' (empty otherwise),
+                  indices of the sources in the order they should be fit
+    '''
+
+    if min_points == None:
+        min_points = screen_min_points
+    if min_baseline == None:
+        min_baseline = screen_min_baseline
+
+    peaked = (features['peak_flux_ztfg'] > 0) | (features['peak_flux_ztfr'] > 0)
+
+    decisions = np.full(len(features['n_points']), 'fit', dtype='<U4')
+    decisions[features['baseline'] < min_baseline] = 'ask'
+    decisions[(features['n_points'] < min_points) | ~peaked] = 'skip'
+
+    reasons = np.full(len(decisions), '', dtype=object)
+
+    for i in np.where(decisions != 'fit')[0]:
+        if features['n_points'][i] < min_points:
+            reasons[i] = 'only ' + str(int(features['n_points'][i])) + ' usable points (' + str(min_points) + ' needed)'
+        elif not peaked[i]:
+            reasons[i] = 'no positive flux in ztfg or ztfr'
+        else:
+            reasons[i] = ('only ' + str(np.round(features['baseline'][i], 1)) + ' days worth of photometry data (' + str(int(features['n_epochs'][i])) +
+                          ' nights)')
+
+    both_bands = np.isfinite(features['colour']).astype(int)
+    shape = (np.isfinite(features['rise_ztfg']) | np.isfinite(features['rise_ztfr'])).astype(int) + \
+        (np.isfinite(features['decline_ztfg']) | np.isfinite(features['decline_ztfr'])).astype(int)
+
+    rank = (decisions == 'ask').astype(int) + 2*(decisions == 'skip')
+
+    order = np.lexsort((-features['n_epochs'], -shape, -both_bands, rank))
+
+    return decisions, reasons, order
+
+# Shared by the pipeline
+photometry_store = PhotometryStore()
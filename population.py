@@ -0,0 +1,134 @@
+import json
+import numpy as np
+import os
+import threading
+
+population_file = 'population.json' # Running SALT2 parameter statistics of accepted Type Ia fits
+population_clip = 5                 # Fits further than this many standard deviations from the mean in x1 or c are left out
+population_clipped = ['x1', 'c']    # Parameters the clip applies to (those nsigma is reported for; z and x0 depend on distance)
+
+# Starting point of the statistics. These numbers come from running model fits on ~500 Type Ia supernovae
+population_seed_n = 500
+population_seed = {'z': (0.060574239946858476, 0.023994157056121096),     # (mean, standard deviation)
+                   'x1': (-0.14238796934437334, 1.4557579021314682),
+                   'c': (0.08928354223298558, 0.15670291093588692),
+                   'x0': (0.0007648532623426458, 0.0004363803462578883)}
+
+class PopulationStats:
+
+    ''' Info : Mean and standard deviation of SALT2 parameters over accepted Type Ia fits, updated one batch at a time with Welford's
+               algorithm (merged with Chan's formula for batches) so no past fits need to be kept. Saved to disk after every update.
+        Attributes: path, per parameter count, mean and sum of squared deviations (m2), sources already counted
+    '''
+
+    def __init__(self, path=population_file):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stats = None
+        self.sources = None
+
+    def add(self, source, params):
+
+        ''' Info : Adds one accepted Type Ia fit. Each source is only counted once, the first time it is added. Fits with a parameter that is
+                   not finite, or with x1 or c more than population_clip standard deviations from the mean, are left out, so a bad fit cannot skew
+                   the statistics. All tracked parameters of a fit that is kept are added.
+            Input : self, source, dictionary of SALT2 parameters (parameters that are not tracked are ignored)
+            Returns : True if the fit was added, False if the source was already counted or the fit was left out
+        '''
+
+        values = {name: float(params[name]) for name in population_seed if name in params}
+
+        if not all(np.isfinite(value) for value in values.values()):
+            return False
+
+        if any(np.abs(n) > population_clip for n in self.nsigma({name: values[name] for name in population_clipped if name in values}).values()):
+            return False
+
+        with self.lock:
+            self.load()
+
+            if source in self.sources:
+                return False
+
+            self.merge({name: [value] for name, value in values.items()})
+            self.sources.append(source)
+            self.save()
+
+        return True
+
+    def load(self):
+
+        ''' Info : Reads the statistics from disk the first time they are needed, starting from the seed if there is no file (call with self.lock held)
+            Input : self
+            Returns : None
+        '''
+
+        if self.stats != None:
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+            self.stats = saved['stats']
+            self.sources = saved['sources']
+        except (OSError, ValueError, KeyError):
+            self.stats = {name: {'n': population_seed_n, 'mean': mean, 'm2': std**2*(population_seed_n - 1)}
+                          for name, (mean, std) in population_seed.items()}
+            self.sources = []
+
+    def merge(self, values):
+
+        ''' Info : Merges a batch of values into the running statistics (call with self.lock held)
+            Input : self, dictionary of parameter name to list or array of values
+            Returns : None
+        '''
+
+        for name, batch in values.items():
+            batch = np.asarray(batch, dtype=float)
+            batch = batch[np.isfinite(batch)]
+
+            if len(batch) == 0:
+                continue
+
+            stat = self.stats[name]
+
+            n_b = len(batch)
+            mean_b = np.mean(batch)
+            m2_b = np.sum((batch - mean_b)**2)
+
+            n = stat['n'] + n_b
+            delta = mean_b - stat['mean']
+
+            stat['mean'] = float(stat['mean'] + delta*n_b/n)
+            stat['m2'] = float(stat['m2'] + m2_b + delta**2*stat['n']*n_b/n)
+            stat['n'] = int(n)
+
+    def nsigma(self, values):
+
+        ''' Info : Number of standard deviations of parameter values from the population mean, for one source or a whole batch in one call
+            Input : self, dictionary of parameter name to value or array of values
+            Returns : dictionary of parameter name to signed nsigma (same shape as the input)
+        '''
+
+        with self.lock:
+            self.load()
+            stats = {name: (self.stats[name]['mean'], np.sqrt(self.stats[name]['m2']/(self.stats[name]['n'] - 1))) for name in values}
+
+        return {name: (np.asarray(value, dtype=float) - stats[name][0])/stats[name][1] for name, value in values.items()}
+
+    def save(self):
+
+        ''' Info : Writes the statistics to disk (call with self.lock held)
+            Input : self
+            Returns : None
+        '''
+
+        tmp = self.path + '.' + str(os.getpid()) + '.tmp'
+
+        with open(tmp, 'w') as f:
+            json.dump({'stats': self.stats, 'sources': self.sources}, f, indent=2)
+
+        os.replace(tmp, self.path)
+
+# Shared by the pipeline
+population = PopulationStats()
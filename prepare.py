@@ -0,0 +1,121 @@
+import argparse
+import datetime
+import os
+import pickle
+
+from concurrent.futures import ProcessPoolExecutor
+
+from snid import *
+from hosts import *
+
+def prepare_class(unclassifys, unclassified_reds, workers=1):
+
+    ''' Info : Runs the headless part of the classification pipeline (spectrum download, SNID, ranking, plots, light curve fit and host lookup)
+               for a list of sources and saves the results so option 2 can review them without waiting
+        Input : list of unclassified sources, redshifts, number of worker processes
+        Returns : list of sources that were prepared
+    '''
+
+    if prepared_dir not in os.listdir(os.getcwd()):
+        os.mkdir(prepared_dir)
+
+    if 'data' not in os.listdir(os.getcwd()):
+        os.mkdir('data')
+
+    prepared = []
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(prepare_source, unclassifys, unclassified_reds))
+    else:
+        results = []
+        for s in np.arange(0,len(unclassifys)):
+            print(bcolors.OKCYAN + str(s+1) + '/' + str(len(unclassifys)) + bcolors.ENDC + ': ' + bcolors.OKBLUE + unclassifys[s] + bcolors.ENDC)
+            results.append(prepare_source(unclassifys[s], unclassified_reds[s]))
+
+    for s in np.arange(0,len(unclassifys)):
+        if results[s] == True:
+            prepared.append(unclassifys[s])
+
+    print(bcolors.OKGREEN + str(len(prepared)) + '/' + str(len(unclassifys)) + ' sources prepared for review.' + bcolors.ENDC)
+
+    return prepared
+
+def prepare_source(source, redshift):
+
+    ''' Info : Precomputes SNID, light curve and host results for one source without any prompts, using its most recent spectrum,
+               and saves them in the prepared directory
+        Input : source, redshift
+        Returns : True if results were saved, False otherwise
+    '''
+
+    if source in np.array(zoo):
+        print(source + ' already submitted to Zooniverse within the last 6 months.')
+        return False
+
+    try:
+        specid = get_latest_spectrum_id(source)
+
+        if specid == 'No Spectra Found':
+            print(source + ' has no spectrum on Fritz.')
+            return False
+
+        fname = write_ascii_file(source, path=os.getcwd(), specid=specid)[0] # Downloads spectrum data in ASCII from Fritz
+
+        if fname == None or fname == 'TNS_spectrum':
+            print(source + ': unable to read spectrum.')
+            return False
+
+        result = snid_compute(source, redshift, fname, outdir=prepared_dir)
+
+        if result == None:
+            return False
+
+        # Host lookup is only informational for review, so failures here should not discard the SNID results
+        try:
+            hostname, hostra, hostdec, hosttype, hostz = get_host_info(source, plotname=result['directory'] + source + '_host.png')
+        except Exception as e:
+            print(bcolors.FAIL + source + ' host lookup failed: ' + str(e) + bcolors.ENDC)
+            hostname = None
+        finally:
+            cone_cache.flush()
+
+        if hostname != None:
+            result['host'] = {'name': hostname, 'ra': hostra, 'dec': hostdec, 'type': hosttype, 'z': hostz}
+        else:
+            result['host'] = None
+
+        result['specid'] = specid
+        result['last_detection'] = get_last_detection(source) # With specid, tells load_prepared whether the results are still current
+        result['redshift'] = redshift
+        result['prepared_at'] = str(datetime.datetime.utcnow().replace(microsecond=0))
+
+        with open(os.getcwd() + '/' + prepared_dir + '/' + source + '.pkl', 'wb') as f:
+            pickle.dump(result, f)
+
+    except Exception as e:
+        print(bcolors.FAIL + source + ' could not be prepared: ' + str(e) + bcolors.ENDC)
+        return False
+
+    print(bcolors.OKGREEN + source + ' prepared.' + bcolors.ENDC)
+
+    return True
+
+if __name__ == '__main__':
+
+    # Run headless, e.g. overnight: python prepare.py y --workers 4
+    parser = argparse.ArgumentParser(description='Precompute classification results for unclassified sources saved since a date.')
+    parser.add_argument('date', help="earliest save date (YYYY-MM-DD) or 'y' for yesterday at midnight")
+    parser.add_argument('--workers', type=int, default=1, help='number of sources to prepare in parallel')
+    args = parser.parse_args()
+
+    if args.date == 'Y' or args.date == 'y':
+        startd = datetime.datetime.combine((datetime.datetime.utcnow().date() - datetime.timedelta(days=1)), datetime.datetime.min.time()).replace(tzinfo=datetime.timezone.utc)
+    else:
+        startd = datetime.datetime.strptime(args.date, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+
+    f = ascii.read("RCF_sources.ascii", delimiter='\t')
+
+    sources, tns_names, savedates, classifys, class_dates, reds, users, unclassifys, unclassified_reds = read_ascii(f, startd)
+
+    prepare_class(unclassifys, unclassified_reds, workers=args.workers)
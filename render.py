@@ -0,0 +1,258 @@
+import hashlib
+import numpy as np
+import os
+import pickle
+import shutil
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import MultipleLocator
+
+# Resolution of saved plots for each place they end up
+render_dpi = {'zooniverse': 600, # SNID template matches uploaded as Zooniverse subjects
+              'fritz': 100,      # Attachments on Fritz comments (light curves, hosts)
+              'preview': 72}     # Plots only shown locally before a prompt
+
+render_cache_dir = 'render_cache' # Directory of rendered plots, keyed by a hash of their inputs
+render_cache_max_mb = 200         # Size the cache is trimmed to (least recently used plots are removed first)
+render_trim_every = 100           # New plots between trims of the cache (it is also trimmed by wait)
+
+class RenderService:
+
+    ''' Info : Renders plots offscreen with the Agg canvas in a pool of worker processes, so the pipeline does not block on matplotlib.
+               Images are cached by a hash of their inputs, so an identical plot is never drawn twice, and the cache is kept under a size cap
+               by removing the least recently used plots.
+        Attributes: workers (number of processes), cache_dir, size cap (MB), futures of renders not yet waited on, new plots since the last trim
+    '''
+
+    def __init__(self, workers=None, cache_dir=render_cache_dir, max_mb=render_cache_max_mb):
+        self.workers = workers if workers != None else min(4, os.cpu_count() or 1)
+        self.cache_dir = cache_dir
+        self.max_mb = max_mb
+        self.executor = None
+        self.futures = []
+        self.added = 0
+
+    def close(self):
+
+        ''' Info : Waits for outstanding renders and shuts down the worker processes
+            Input : self
+            Returns : None
+        '''
+
+        self.wait()
+
+        if self.executor != None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def render(self, draw, path, dest, *args, **kwargs):
+
+        ''' Info : Queues a plot to be drawn and saved
+            Input : self, drawing function (returns a Figure), output path, destination (key of render_dpi), arguments of the drawing function
+            Returns : Future whose result is the output path
+        '''
+
+        dpi = render_dpi[dest]
+
+        key = hashlib.sha1(pickle.dumps((draw.__module__, draw.__name__, args, sorted(kwargs.items()), dpi))).hexdigest()
+        cached = os.path.join(self.cache_dir, key + '.png')
+
+        try:
+            shutil.copy(cached, path)
+            os.utime(cached) # Marks the plot as recently used
+            future = Future()
+            future.set_result(path)
+            return future
+        except FileNotFoundError:
+            pass # Not cached (or just trimmed), so it is drawn
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.added += 1
+        if self.added >= render_trim_every:
+            self.added = 0
+            self.trim()
+
+        if self.executor == None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        future = self.executor.submit(render_worker, draw, path, cached, dpi, args, kwargs)
+        self.futures.append(future)
+
+        return future
+
+    def trim(self):
+
+        ''' Info : Removes the least recently used plots until the cache is under its size cap
+            Input : self
+            Returns : None
+        '''
+
+        if not os.path.exists(self.cache_dir):
+            return
+
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue # Removed by another trim
+            files.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(f[1] for f in files)
+        limit = self.max_mb*1024*1024
+
+        for mtime, size, name in sorted(files):
+            if total <= limit:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            total -= size
+
+    def wait(self):
+
+        ''' Info : Blocks until every queued render has finished, reporting any that failed
+            Input : self
+            Returns : list of paths that were written
+        '''
+
+        paths = []
+
+        for future in self.futures:
+            try:
+                paths.append(future.result())
+            except Exception as e:
+                print('Plot rendering failed: ' + str(e))
+
+        self.futures = []
+
+        self.trim()
+
+        return paths
+
+def draw_empty():
+
+    ''' Info : Blank figure, used when there is nothing to plot but a file is still expected
+        Input : None
+        Returns : Figure
+    '''
+
+    return Figure()
+
+def draw_host(fim, header, snra, sndec, hostra, hostdec):
+
+    ''' Info : Draws the PS1 cutout around a host with the transient and host positions marked
+        Input : image data, FITS header as string, transient RA and dec, host RA and dec (deg)
+        Returns : Figure
+    '''
+
+    from astropy.io import fits
+    from astropy.visualization import PercentileInterval, AsinhStretch
+    from astropy.wcs import WCS
+
+    wcs = WCS(fits.Header.fromstring(header))
+    transform = AsinhStretch() + PercentileInterval(99.5)
+    bfim = transform(fim)
+
+    fig = Figure()
+    ax = fig.add_subplot(projection=wcs)
+
+    ax.imshow(bfim,cmap="gray",origin="lower")
+
+    ax.scatter(snra, sndec, transform=ax.get_transform('world'), c='red', marker='+', label='SNe')
+    ax.scatter(hostra, hostdec, transform=ax.get_transform('world'), c='blue', label='Host')
+
+    ax.legend(loc='best')
+
+    return fig
+
+def draw_lc(data, params):
+
+    ''' Info : Draws photometry with a SALT2 light curve model
+        Input : photometry table, dictionary of SALT2 parameters (z, t0, x0, x1, c)
+        Returns : Figure
+    '''
+
+    import sncosmo
+
+    from lcfit import get_salt2_model
+
+    model = get_salt2_model()
+    model.set(**params)
+
+    return sncosmo.plot_lc(data, model=model, fig=Figure())
+
+def draw_snid_match(x, y, xi, yi, snid_type, z_template, z_template_unc, z_snid, spec_num, show_redshift=False):
+
+    ''' Info : Draws a SNID template spectrum over the transient's spectrum
+        Input : template wavelength and flux, transient wavelength and flux, SNID type, template redshift and uncertainty, SNID redshift,
+                match number, whether to show redshift instead of the match number
+        Returns : Figure
+    '''
+
+    fig = Figure(figsize=(8,4.5))
+    ax = fig.subplots()
+    ax.plot(xi,yi,color='#32384D',alpha=0.5,
+             label='New SN')
+    ax.plot(x,y,color='#217CA3',
+             label='SNID template', lw=3)
+    if show_redshift:
+        ax.plot(x[-3],y[-3],color='white',lw=0,
+                 label=r'$z_\mathrm{} = $ {:.3f}$\,\pm\,${:.3f}'.format("{SNID}", z_template, z_template_unc))
+        ax.text(0.78, 0.955, r'$z_\mathrm{} = ${:.4f}'.format("{SN}", z_snid),
+                va='center',
+                fontsize=15, transform=fig.transFigure)
+    else:
+        ax.text(0.78, 0.955, 'Match #' + str(spec_num+1),
+                va='center',
+                fontsize=15, transform=fig.transFigure)
+
+    ax.plot(x[-3],y[-3],color='#217CA3', lw=3)
+    ax.set_xlabel(r'Rest Frame Wavelength ($\mathrm{\AA}$)', fontsize=17)
+    ax.set_ylabel('Relative Flux', fontsize=17)
+    ax.tick_params(which='both',labelsize=15)
+
+    ax.grid(axis='x', color='0.7', ls=':')
+    ax.xaxis.set_minor_locator(MultipleLocator(250))
+    ax.set_yticklabels([])
+
+    ax.text(0.105, 0.955, 'SNID type: ',
+            va='center',
+            fontsize=15, transform=fig.transFigure)
+    ax.text(0.245, 0.955, snid_type,
+            color='#217CA3', weight='bold', va='center',
+            fontsize=23, transform=fig.transFigure)
+
+    ax.legend(fancybox=True)
+    fig.subplots_adjust(left=0.055,right=0.99,top=0.925,bottom=0.145)
+
+    return fig
+
+def render_worker(draw, path, cached, dpi, args, kwargs):
+
+    ''' Info : Runs in a worker process, draws a figure and saves it to the cache and the output path
+        Input : drawing function, output path, cache path, dpi, arguments of the drawing function
+        Returns : output path
+    '''
+
+    fig = draw(*args, **kwargs)
+    FigureCanvasAgg(fig)
+
+    tmp = cached + '.' + str(os.getpid()) + '.tmp'
+    fig.savefig(tmp, dpi=dpi, format='png')
+
+    # Copied before it goes into the cache, where a trim may remove it at any time
+    shutil.copy(tmp, path)
+    os.replace(tmp, cached)
+
+    return path
+
+# Shared by the pipeline, worker processes are started on first use
+renderer = RenderService()
@@ -7,6 +7,7 @@ import matplotlib.gridspec as gridspec
 import numpy as np
 import os
 import pandas as pd
+import pickle
 import shlex
 import shutil
 import sncosmo
@@ -21,19 +22,23 @@ from matplotlib.backends.backend_pdf import PdfPages
 from matplotlib.ticker import MultipleLocator
 from mpl_toolkits.mplot3d import Axes3D
 from panoptes_client import Panoptes, Project, SubjectSet, Subject
+from PIL import Image
 
+from cosmology import *
 from func import *
+from lcfit import *
+from population import *
+from render import *
 from zooniverse import *
 
-# These numbers come from running model fits on ~500 Type Ia supernovae
-z = 0.060574239946858476
-z_std = 0.023994157056121096
-x1 = -0.14238796934437334
-x1_std = 1.4557579021314682
-c = 0.08928354223298558
-c_std = 0.15670291093588692
-x0 = 0.0007648532623426458
-x0_std = 0.0004363803462578883
+# Thresholds for accepting a SNID classification without interactive review
+auto_top_n = 5             # Number of highest-rlap templates that must agree
+auto_min_type_frac = 1.0   # Fraction of those templates with the same type as the best match
+auto_min_rlap = 10         # Minimum median rlap of those templates
+auto_max_z_spread = 0.02   # Maximum spread (max - min) of their redshifts
+
+prepared_dir = 'prepared' # Directory where prepare.py saves precomputed results for review
+accepted_fits = {}        # Source -> SALT2 parameters of Type Ia classifications accepted in run_class, added to the population once uploaded
 
 with open('info.info', 'r') as infofile:
     info = infofile.read()
@@ -44,73 +49,110 @@ with open('info.info', 'r') as infofile:
 # Grab all sources currently uploaded to Zooniverse
 zoo = get_all_in_set()
 
+def auto_accept_snid(agreement, min_type_frac=None, min_rlap=None, max_z_spread=None):
+
+    ''' Info : Decides whether a SNID result is unambiguous enough to be saved without asking the user
+        Input : agreement metrics from get_snid_agreement, thresholds (module defaults if None)
+        Returns : True if all thresholds are cleared, False otherwise
+    '''
+
+    if min_type_frac == None:
+        min_type_frac = auto_min_type_frac
+    if min_rlap == None:
+        min_rlap = auto_min_rlap
+    if max_z_spread == None:
+        max_z_spread = auto_max_z_spread
+
+    if agreement == None or agreement['n'] < agreement['top_n']:
+        return False
+
+    return agreement['type_frac'] >= min_type_frac and agreement['median_rlap'] >= min_rlap and agreement['z_spread'] <= max_z_spread
+
 def get_peak_absmag(z, x0):
 
-    ''' Info : Calcultes peak absolute magnitude with SALT2 model parameters
-        Input : SALT2-determined redshift and x0
+    ''' Info : Calcultes peak absolute magnitude with SALT2 model parameters, using the precomputed distance modulus table
+        Input : SALT2-determined redshift and x0 (or arrays of them)
         Returns : Peak absolute magnitude
     '''
 
-    peak_mag = -2.5*np.log10(x0) + 10.635
-    cosmo = FlatLambdaCDM(H0=70,Om0=0.3)
-    mu = cosmo.distmod(z).value
-    absmag = peak_mag -mu
-
-    return absmag
+    return peak_absmag(z, x0)
 
 def get_photometry(ztfname, format='flux'):
 
-    ''' Info : Retrieves photometry data for a source from Fritz and filters out Nonetype points
+    ''' Info : Retrieves photometry data for a source through the local photometry store (only downloaded from Fritz when there are new
+               detections) and filters out Nonetype points
         Input : Source name and brightness format ("flux" or "mag")
-        Returns : Astropy QTable with data that feeds into sncosmo.fit_lc
+        Returns : NumPy structured array with data that feeds into sncosmo.fit_lc
     '''
 
     url = BASEURL+'api/sources/'+ztfname+'/photometry' # Access photometry
 
-    if format == 'flux':
-        data = {"format": "flux"}
-    elif format == 'mag':
-        data = {'format': 'mag'}
+    def fetch():
+        status, response = api('GET', url, params={'format': format}, timeout=10)
+        return response['data']
+
+    columns = photometry_store.get(ztfname, format, fetch, lambda: get_last_detection(ztfname))
+
+    return photometry_table(columns, format)
 
-    status, response = api('GET', url, params=data, timeout=10)
+def get_snid_agreement(types, rlaps, reds, top_n=None):
 
-    if format == 'flux':
+    ''' Info : Computes agreement metrics over the rlap-ordered SNID template listing
+        Input : template types, rlap scores and redshifts (as read from the SNID output), number of top templates to consider
+        Returns : Dictionary with best type, number of templates used, type fraction, median rlap and redshift spread (None if no templates)
+    '''
 
-        flux = []
-        fluxerr = []
-        band = []
-        mjd = []
-        zpsys = []
-        zp = []
+    if top_n == None:
+        top_n = auto_top_n
 
-        for d in response['data']:
-            if d['flux'] != None and (d['filter'] == 'ztfg' or d['filter'] == 'ztfr'):
-                flux.append(d['flux'])
-                fluxerr.append(d['fluxerr'])
-                band.append(d['filter'])
-                mjd.append(d['mjd'])
-                zpsys.append(d['magsys'])
-                zp.append(d['zp'])
+    types = np.array(types[:top_n])
+    rlaps = np.array(rlaps[:top_n], dtype=float)
+    reds = np.array(reds[:top_n], dtype=float)
 
-        return QTable([mjd, band, flux, fluxerr, zp, zpsys], names=('mjd', 'filter', 'flux','fluxerr', 'zp', 'zpsys'))
+    if len(types) == 0:
+        return None
 
-    elif format == 'mag':
+    return {'type': types[0],
+            'top_n': top_n,
+            'n': len(types),
+            'type_frac': np.mean(types == types[0]),
+            'median_rlap': np.median(rlaps),
+            'z_spread': np.max(reds) - np.min(reds)}
 
-        mag = []
-        magerr = []
-        band = []
-        mjd = []
-        zpsys = []
+def load_prepared(source):
 
-        for d in response['data']:
-            if d['mag'] != None and (d['filter'] == 'ztfg' or d['filter'] == 'ztfr'):
-                mag.append(d['mag'])
-                magerr.append(d['magerr'])
-                band.append(d['filter'])
-                mjd.append(d['mjd'])
-                zpsys.append(d['magsys'])
+    ''' Info : Loads the results precomputed for a source by prepare.py, unless a newer spectrum or detection has been added on Fritz since
+        Input : source
+        Returns : Result dictionary for snid_review, or None if the source has not been prepared or its results are out of date
+    '''
 
-        return QTable([mjd, band, mag, magerr, zpsys], names=('mjd', 'filter', 'mag','magerr', 'zpsys'))
+    path = os.getcwd() + '/' + prepared_dir + '/' + source + '.pkl'
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f:
+        result = pickle.load(f)
+
+    if result.get('specid') != get_latest_spectrum_id(source) or 'last_detection' not in result or \
+            result['last_detection'] != get_last_detection(source):
+        print(source + ' has new data since it was prepared at ' + result['prepared_at'] + ' UTC, running it again.')
+        return None
+
+    return result
+
+def get_lc_comment(source):
+
+    ''' Info : Finds the light curve fit comment on a source's Fritz page
+        Input : ZTFname
+        Returns : comment dictionary, or None if the light curve has not been posted
+    '''
+
+    for comment_info in get_source_api(source)['comments']:
+        if 'sncosmo light curve fit' in comment_info['text']:
+            return comment_info
+
+    return None
 
 def listComplementElements(list1, list2):
 
@@ -128,41 +170,28 @@ def listComplementElements(list1, list2):
 
     return storeResults
 
-def model_lc(source, redshift):
+def lc_outdated(comment_info, data):
 
-    ''' Info : Fits photometry data to light curve using sncosmo.
-        Input : source
-        Returns : photometry data, fitted parameters, plottable model
+    ''' Info : Checks whether a posted light curve fit comment needs to be redone
+        Input : comment dictionary, photometry
+        Returns : True if new photometry has been uploaded since the fit or the comment is in an old format
     '''
 
-    data = get_photometry(source)
+    comment = comment_info['text']
 
-    red = redshift
-    red_err = 'No redshift error found'
-    model = sncosmo.Model(source='salt2')
+    return int(comment[int(comment.index('n='))+2:].split(',')[0]) != len(data) or 'gayatri' not in comment
 
-    if red != 'No redshift found':
+def model_lc(source, redshift, data=None):
 
-        if red_err != 'No redshift error found': # If both redshift and error present, use error as bounds to fit redshift
-            result, fitted_model = sncosmo.fit_lc(
-                data, model,
-                ['z', 't0', 'x0', 'x1', 'c'],  # parameters of model to vary
-                bounds={'z':(red-red_err, red+red_err)}, minsnr=5)  # bounds on parameters (if any)
-        else: # If no redshift error, don't determine redshift
-            model.set(z=red)
+    ''' Info : Fits photometry data to light curve using the shared SALT2 fitting engine.
+        Input : source, redshift, photometry (downloaded if not given)
+        Returns : photometry data, fit dictionary (see lcfit.fit_salt2)
+    '''
 
-            result, fitted_model = sncosmo.fit_lc(
-                data, model,
-                ['t0', 'x0', 'x1', 'c'],
-                guess_z=False, minsnr=5)
+    if data is None:
+        data = get_photometry(source)
 
-    else:
-        result, fitted_model = sncosmo.fit_lc(
-            data, model,
-            ['z', 't0', 'x0', 'x1', 'c'],
-            bounds={'z':(0,0.3)}, minsnr=5)
-
-    return data, result, fitted_model
+    return data, lc_engine.fit(data, redshift, name=source)
 
 def plot_box_spec(wave, flux):
     flux_plot = np.repeat(flux, 2)
@@ -174,94 +203,129 @@ def plot_box_spec(wave, flux):
 
     return wv_plot, flux_plot
 
-def post_lc(source, redshift):
+def post_lc(source, redshift, data=None, fit=None, ask=True, ia=False):
 
     ''' Info : Posts LC data on Fritz as comment, along with nsigma for c and x1 and peak absolute magnitude. Plot is also attached.
-        Input : ZTFname, redshift
+        Input : ZTFname, redshift, photometry and fit dictionary (computed here if not given, e.g. by post_lcs), whether to ask before
+                posting fits of less than 5 days of photometry (post_lcs asks before fitting instead), whether the source is a classified Ia
+                (its fit is then added to the population statistics)
         Returns : None
     '''
 
-    data = get_photometry(source)
-    comment_infos = get_source_api(source)['comments']
+    if data is None:
+        data = get_photometry(source)
 
-    for i in range (len(get_source_api(source)['comments'])):
+    comment_info = get_lc_comment(source)
 
-        comment_info = comment_infos[i]
-        comment = comment_info['text']
+    # Check if LC is already posted and no new photometry has been uploaded
+    if comment_info != None and not lc_outdated(comment_info, data):
+        print(source + ' LC up to date.')
+        return
 
-        # Check if LC is already posted
-        if 'sncosmo light curve fit' in comment:
-            if int(comment[int(comment.index('n='))+2:].split(',')[0]) != len(data) or 'gayatri' not in comment: # Check if new photometry has been uploaded
+    if fit == None:
+        fit = model_lc(source, redshift, data=data)[1]
 
-                try:
-                    dfit, result, fitted_model = model_lc(source, redshift)
-                except RuntimeError:
-                    print(bcolors.FAIL + 'sncosmo encountered runtime error. Skipping...' + bcolors.ENDC) # Did not converge on fit
-                    return
-                except ValueError:
-                    print(bcolors.FAIL + 'sncosmo encountered value error. Skipping...' + bcolors.ENDC) # Did not converge on fit
-                    return
+    if fit['error'] != None:
+        print(bcolors.FAIL + 'sncosmo encountered ' + fit['error'] + '. Skipping...' + bcolors.ENDC) # Did not converge on fit
+        return
 
-                x1_nstds = np.round(np.abs((result.parameters[3]-x1)/x1_std), 1)
-                c_nstds = np.round(np.abs((result.parameters[4]-c))/c_std, 1)
+    if fit['reused']:
+        print(source + ' new photometry is consistent with the previous fit, keeping its parameters.')
 
-                sncosmo.plot_lc(dfit, model=fitted_model)
+    dfit = data # Photometry the fit was run on
+    params = dict(zip(fit['param_names'], fit['parameters']))
 
-                if np.max(dfit['mjd']) - np.min(dfit['mjd']) < 5: # If <5 nights of photometry, check if user wants to upload
-                    plt.show(block=False)
+    nstds = population.nsigma({'x1': params['x1'], 'c': params['c']})
+    x1_nstds = np.round(np.abs(nstds['x1']), 1)
+    c_nstds = np.round(np.abs(nstds['c']), 1)
 
-                    res = input('There are only ' + str(np.round(np.max(dfit['mjd']) - np.min(dfit['mjd']), 1)) + ' days worth of photometry data. Do you still want to proceed? [y/n] ')
+    if ask and comment_info != None and np.max(dfit['mjd']) - np.min(dfit['mjd']) < 5: # If <5 nights of photometry, check if user wants to upload
+        Image.open(renderer.render(draw_lc, 'data/'+source+'_lc_preview.png', 'preview', dfit, params).result()).show()
 
-                    if res != 'y':
-                        plt.close()
-                        return
+        res = input('There are only ' + str(np.round(np.max(dfit['mjd']) - np.min(dfit['mjd']), 1)) + ' days worth of photometry data. Do you still want to proceed? [y/n] ')
 
-                    plt.close()
+        if res != 'y':
+            return
 
-                plt.savefig('temp.png')
+    lc_plot = renderer.render(draw_lc, 'data/'+source+'_sncosmo_lc.png', 'fritz', dfit, params).result()
 
-                # If comment exists but new photometry uploaded, edit comment
-                resp = edit_comment(source, comment_info['id'], comment_info['author_id'], 'sncosmo light curve fit n='+str(len(data))+', M_peak = '+str(np.round(get_peak_absmag(result.parameters[0], result.parameters[2]),1))+
-                    ', x1_nstds = '+str(x1_nstds)+', c_nstds = '+str(c_nstds)+'. LC page: http://gayatri.caltech.edu:88/query/lc/'+source, 'temp.png', source+'_sncosmo_lc.png')
+    text = ('sncosmo light curve fit n='+str(len(data))+', M_peak = '+str(np.round(get_peak_absmag(params['z'], params['x0']),1))+
+        ', x1_nstds = '+str(x1_nstds)+', c_nstds = '+str(c_nstds)+'. LC page: http://gayatri.caltech.edu:88/query/lc/'+source)
 
-                if resp['status'] == 'success':
-                    print(bcolors.OKGREEN + source + ' LC update successful.' + bcolors.ENDC)
-                else:
-                    print(bcolors.FAIL + source + ' LC update failed.' + bcolors.ENDC)
-                    print(bcolors.FAIL + json.dumps(resp, indent=2) + bcolors.ENDC)
+    if comment_info != None:
+        # If comment exists but new photometry uploaded, edit comment
+        resp = edit_comment(source, comment_info['id'], comment_info['author_id'], text, lc_plot, source+'_sncosmo_lc.png')
+
+        if resp['status'] == 'success':
+            print(bcolors.OKGREEN + source + ' LC update successful.' + bcolors.ENDC)
+        else:
+            print(bcolors.FAIL + source + ' LC update failed.' + bcolors.ENDC)
+            print(bcolors.FAIL + json.dumps(resp, indent=2) + bcolors.ENDC)
+    else:
+        resp = post_comment(source, text, lc_plot, source+'_sncosmo_lc.png')
 
-                plt.close('all')
+        if resp['status'] == 'success':
+            print(bcolors.OKGREEN + source + ' LC upload successful.' + bcolors.ENDC)
+        else:
+            print(bcolors.FAIL + source + ' LC upload failed.' + bcolors.ENDC)
+            print(bcolors.FAIL + json.dumps(resp, indent=2) + bcolors.ENDC)
 
-                return
-            else:
-                print(source + ' LC up to date.')
-                return
+    # Only fits that converged and made it onto Fritz count towards the population statistics
+    if ia and fit['success'] and resp['status'] == 'success':
+        population.add(source, params)
 
-    try:
-        dfit, result, fitted_model = model_lc(source, redshift)
-    except RuntimeError:
-        print(bcolors.FAIL + 'sncosmo encountered runtime error. Skipping...' + bcolors.ENDC)
-        return
-    except ValueError:
-        print(bcolors.FAIL + 'sncosmo encountered value error. Skipping...' + bcolors.ENDC) # Did not converge on fit
-        return
+def post_lcs(sources, redshifts, ias=None):
 
-    x1_nstds = np.round(np.abs((result.parameters[3]-x1)/x1_std), 1)
-    c_nstds = np.round(np.abs((result.parameters[4]-c)/c_std), 1)
+    ''' Info : Runs post_lc for many sources. Light curves are pre-screened on their photometry before any fitting: hopeless ones are skipped,
+               short ones are asked about up front, and the rest are fit together on the fitting engine, most promising first.
+        Input : list of ZTFnames, redshifts, whether each source is a classified Ia (None if none are)
+        Returns : None
+    '''
 
-    sncosmo.plot_lc(dfit, model=fitted_model)
-    plt.savefig('temp.png')
+    if ias is None:
+        ias = [False]*len(sources)
 
-    resp = post_comment(source, 'sncosmo light curve fit n='+str(len(data))+', M_peak = '+str(np.round(get_peak_absmag(result.parameters[0], result.parameters[2]),1))+
-        ', x1_nstds = '+str(x1_nstds)+', c_nstds = '+str(c_nstds)+'. LC page: http://gayatri.caltech.edu:88/query/lc/'+source, 'temp.png', source+'_sncosmo_lc.png')
+    datas = []
+    needed = []
 
-    if resp['status'] == 'success':
-        print(bcolors.OKGREEN + source + ' LC upload successful.' + bcolors.ENDC)
-    else:
-        print(bcolors.FAIL + source + ' LC upload failed.' + bcolors.ENDC)
-        print(bcolors.FAIL + json.dumps(resp, indent=2) + bcolors.ENDC)
+    for p in np.arange(0,len(sources)):
+        print(bcolors.OKCYAN + str(p+1) + '/' + str(len(sources)) + bcolors.ENDC + ': Downloading photometry for ' + bcolors.OKBLUE + sources[p] + bcolors.ENDC)
+
+        data = get_photometry(sources[p])
+        comment_info = get_lc_comment(sources[p])
+
+        datas.append(data)
+        needed.append(comment_info == None or lc_outdated(comment_info, data))
+
+    features = photometry_features(datas)
+    decisions, reasons, order = screen_photometry(features)
+
+    fitting = []
+
+    for p in order:
+        if not needed[p]:
+            print(sources[p] + ' LC up to date.')
+            continue
+
+        if decisions[p] == 'skip':
+            print(bcolors.WARNING + sources[p] + ': ' + reasons[p] + ', skipping LC fit.' + bcolors.ENDC)
+            continue
+
+        if decisions[p] == 'ask':
+            res = input(sources[p] + ' has ' + reasons[p] + '. Do you still want to fit it? [y/n] ')
 
-    plt.close('all')
+            if res != 'y':
+                continue
+
+        fitting.append(p)
+
+    # Sources with a redshift are fit together in one array job, the rest (and any that fail) on the worker processes
+    fits = lc_engine.fit_many([datas[p] for p in fitting], [redshifts[p] for p in fitting], names=[sources[p] for p in fitting], batched=True)
+
+    for n, p in enumerate(fitting):
+        print(bcolors.OKCYAN + str(n+1) + '/' + str(len(fitting)) + bcolors.ENDC + ': ' + bcolors.OKBLUE + sources[p] + bcolors.ENDC)
+
+        post_lc(sources[p], redshifts[p], data=datas[p], fit=fits[n], ask=False, ia=ias[p])
 
 def plot_best_5(source, output, spectra_name, z_snid, top_5, rlaps, show_redshift=False):
     source_folder = source + spectra_name
@@ -299,10 +363,10 @@ def read_tables(files):
         matches.append(row)
     return matches, spectra
 
-def run_class(unclassifys, unclassified_reds):
+def run_class(unclassifys, unclassified_reds, auto=False):
 
     ''' Info : Runs SNID analysis on list of sources
-        Input : list of unclassified sources
+        Input : list of unclassified sources, redshifts, auto (if True, high-confidence SNID results are saved without prompting)
         Returns : transients, SNID classifications, rlap scores, redshifts, redshift errors
     '''
 
@@ -336,9 +400,12 @@ def run_class(unclassifys, unclassified_reds):
 
     print('There are ' + str(len(unclassifys)) + ' unclassified transients.')
 
+    prefetch = start_prefetch(unclassifys, photometry=True) # Loads spectra and photometry of the next sources while the user answers prompts
+
     for s in np.arange(0,len(unclassifys)):
         print(bcolors.OKCYAN + str(s+1) + '/' + str(len(unclassifys)) + bcolors.ENDC + ': ' + bcolors.OKBLUE + unclassifys[s] + bcolors.ENDC)
-        t, f, r, re = snid_analyze(unclassifys[s], unclassified_reds[s])
+        prefetch.advance(s)
+        t, f, r, re = snid_analyze(unclassifys[s], unclassified_reds[s], auto=auto)
 
         if t != None:
             if t == 'II':
@@ -353,6 +420,8 @@ def run_class(unclassifys, unclassified_reds):
             reds.append(r)
             red_errs.append(re)
 
+    stop_prefetch()
+
     # Saves a csv of classified sources -- can be commented out if necessary
     np.savetxt('SNID_fits.csv', np.rot90(np.fliplr(np.vstack((transients, types, rlaps, reds, red_errs)))), delimiter=',', fmt='%s')
 
@@ -364,11 +433,11 @@ def run_class(unclassifys, unclassified_reds):
 
     return transients, types, rlaps, reds, red_errs
 
-def snid_analyze(source, redshift):
+def snid_analyze(source, redshift, auto=False):
 
     ''' Info : Runs SNID analysis on given source and returns classification data
-               Saves output files in individual folders
-        Input : source, redshift
+               Saves output files in individual folders, or uses the results saved by prepare.py if the source has been precomputed
+        Input : source, redshift, auto (if True, results passing auto_accept_snid are saved without prompting)
         Returns : classification, rlap score, redshift, redshift error
     '''
 
@@ -376,14 +445,40 @@ def snid_analyze(source, redshift):
         print(source + ' already submitted to Zooniverse within the last 6 months.')
         return None, None, None, None
 
-    fname = write_ascii_file(source, path=os.getcwd(), auto=True)[0] # Downloads spectrum data in ASCII from Fritz
+    prepared = load_prepared(source)
 
-    if fname == None:
-        print('Unable to read spectrum.')
-        return None, None, None, None
+    if prepared != None:
+        print(source + ' using results precomputed at ' + prepared['prepared_at'] + ' UTC.')
+        result = prepared
+    else:
+        fname = write_ascii_file(source, path=os.getcwd(), auto=True)[0] # Downloads spectrum data in ASCII from Fritz
 
-    if fname == 'No Spectra Found' or fname == 'Resuming...': # Return None if no spectrum on Fritz or if user prompts to continue
-        return None, None, None, None
+        if fname == None:
+            print('Unable to read spectrum.')
+            return None, None, None, None
+
+        if fname == 'No Spectra Found' or fname == 'Resuming...': # Return None if no spectrum on Fritz or if user prompts to continue
+            return None, None, None, None
+
+        result = snid_compute(source, redshift, fname)
+
+        if result == None:
+            return None, None, None, None
+
+    classification = snid_review(source, result, auto=auto)
+
+    # Light curves of accepted Type Ia classifications feed the population statistics used for nsigma, once submit_class has uploaded them
+    if classification[0] != None and 'Ia' in classification[0] and result['lc'] != None and result.get('lc_success', False):
+        accepted_fits[source] = dict(zip(['z', 't0', 'x0', 'x1', 'c'], result['lc']))
+
+    return classification
+
+def snid_compute(source, redshift, fname, outdir='outfiles'):
+
+    ''' Info : Runs the non-interactive part of the SNID analysis: SNID itself, template ranking, plots of the best matches and light curve fitting
+        Input : source, redshift, name of spectrum file in /data, directory to save output files in
+        Returns : Dictionary of results for snid_review, or None if SNID did not converge
+    '''
 
     # Runs SNID shell command, verbose suppresses output in terminal, plot suppresses XWindow, fluxout saves template spectra with 100 highest rlap scores
     bashc = shlex.split(SNID_loc + 'snid verbose=0 plot=0 fluxout=100 tempdir=' + SNID_loc + 'templates-2.0/ ' + os.getcwd() + '/data/' + fname)
@@ -398,7 +493,7 @@ def snid_analyze(source, redshift):
         count += 1
         if count > 1000:
             print('No file exists, there must not be a decent fit.')
-            return None, None, None, None
+            return None
 
     # The output file also is generated line-by-line so even if the file exists it might not have written up to where we need information
     # This waits until the file is written up to where we seek data
@@ -428,10 +523,10 @@ def snid_analyze(source, redshift):
         except IndexError:
             continue
 
-    print(tab_f)
-
-    # Generate outfile directory for transient
-    os.mkdir('outfiles/'+fname[:-6])
+    # Generate outfile directory for transient, replacing any left over from an earlier run
+    if os.path.exists(outdir+'/'+fname[:-6]):
+        shutil.rmtree(outdir+'/'+fname[:-6])
+    os.makedirs(outdir+'/'+fname[:-6])
 
     print('Determining best matches...')
 
@@ -440,11 +535,11 @@ def snid_analyze(source, redshift):
     t_spec = ascii.read(fname[:-6]+'_snidflux.dat')
     for item in test:
         if item.startswith(fname[:-6]):
-            shutil.move(item, os.getcwd()+'/outfiles/'+fname[:-6])
+            shutil.move(item, os.getcwd()+'/'+outdir+'/'+fname[:-6])
 
-    shutil.copy(os.getcwd() + '/data/' + fname, os.getcwd() + '/outfiles/' + fname[:-6])
+    shutil.copy(os.getcwd() + '/data/' + fname, os.getcwd() + '/' + outdir + '/' + fname[:-6])
 
-    directory = os.getcwd() + "/outfiles/" + fname[:-6] + "/"
+    directory = os.getcwd() + '/' + outdir + '/' + fname[:-6] + "/"
     file_list = glob.glob(directory + fname[:-6] + "_snid.output")
 
     Table_List = []
@@ -605,14 +700,11 @@ def snid_analyze(source, redshift):
             print(j[0])
         count += 1
 
-    datasource = os.getcwd() + "/outfiles/"
+    datasource = os.getcwd() + '/' + outdir + '/'
     output = directory
 
     sample_remaining = ZTable_best
 
-    for i in np.arange(1,6):
-        print(str(sample_remaining[0]['rank_' + str(i)]) + '\t' + str(sample_remaining[0]['sntemplate_' + str(i)]) + ' '*(14-len(str(sample_remaining[0]['sntemplate_' + str(i)]))) + '\t' + str(sample_remaining[0]['c_snid_' + str(i)]) + ' '*(10-len(str(sample_remaining[0]['c_snid_' + str(i)]))) + '\t' + str(sample_remaining[0]['rlap_' + str(i)]))
-
     top_5 = [int(sample_remaining['rank_1']), int(sample_remaining['rank_2']), int(sample_remaining['rank_3']), int(sample_remaining['rank_4']),
         int(sample_remaining['rank_5'])]
 
@@ -623,19 +715,55 @@ def snid_analyze(source, redshift):
         z_snid = i["z_snid"]
         plot_best_5(datasource,output,spectra_name,z_snid, top_5, [sample_remaining['rlap_1'][0], sample_remaining['rlap_2'][0], sample_remaining['rlap_3'][0],
             sample_remaining['rlap_4'][0], sample_remaining['rlap_5'][0]], show_redshift = False)
-        gc.collect()
 
-    #print(sample_remaining)
+    lc = None
+
+    # The plots render in the background while the light curve is fit
+    data, fit = model_lc(source, redshift) # Run light curve fitting on data
+
+    if fit['error'] == None:
+        lc = fit['parameters']
+
+    renderer.wait()
+
+    return {'source': source, 'fname': fname, 'directory': directory, 'tab_f': tab_f, 'typ_f': typ_f, 'rlap': rlap, 'red': red, 'red_err': red_err,
+            'sample_remaining': sample_remaining, 'lc': lc, 'lc_success': fit['error'] == None and fit['success']}
+
+def snid_review(source, result, auto=False):
+
+    ''' Info : Shows SNID and light curve results for a source and asks the user whether to save the classification or submit to Zooniverse
+        Input : source, result dictionary from snid_compute, auto (if True, results passing auto_accept_snid are saved without prompting)
+        Returns : classification, rlap score, redshift, redshift error
+    '''
+
+    typ_f = result['typ_f']
+    rlap = result['rlap']
+    red = result['red']
+    red_err = result['red_err']
+    sample_remaining = result['sample_remaining']
+    directory = result['directory']
+
+    print(result['tab_f'])
+
+    for i in np.arange(1,6):
+        print(str(sample_remaining[0]['rank_' + str(i)]) + '\t' + str(sample_remaining[0]['sntemplate_' + str(i)]) + ' '*(14-len(str(sample_remaining[0]['sntemplate_' + str(i)]))) + '\t' + str(sample_remaining[0]['c_snid_' + str(i)]) + ' '*(10-len(str(sample_remaining[0]['c_snid_' + str(i)]))) + '\t' + str(sample_remaining[0]['rlap_' + str(i)]))
+
+    if result['lc'] != None:
+        nstds = population.nsigma({'z': result['lc'][0], 'x0': result['lc'][2], 'x1': result['lc'][3], 'c': result['lc'][4]})
 
-    try:
-        data, result, fitted_model = model_lc(source, redshift) # Run light curve fitting on data
+        for name in ['z', 'x0', 'x1', 'c']:
+            print('Fitted ' + name + ' is ' + str(np.round(nstds[name], 1)) + ' standard deviations from mean')
 
-        print('Fitted z is ' + str(np.round((result.parameters[0]-z)/z_std, 1)) + ' standard deviations from mean')
-        print('Fitted x0 is ' + str(np.round((result.parameters[2]-x0)/x0_std, 1)) + ' standard deviations from mean')
-        print('Fitted x1 is ' + str(np.round((result.parameters[3]-x1)/x1_std, 1)) + ' standard deviations from mean')
-        print('Fitted c is ' + str(np.round((result.parameters[4]-c)/c_std, 1)) + ' standard deviations from mean')
-    except RuntimeError:
-        pass
+    if result.get('host') != None:
+        print('Potential host: ' + result['host']['name'] + ', type = ' + str(result['host']['type']) + ', z = ' + str(result['host']['z']))
+
+    if auto == True:
+        agreement = get_snid_agreement(typ_f, rlap, red)
+
+        if auto_accept_snid(agreement):
+            print(bcolors.OKGREEN + source + ' auto-accepted as ' + typ_f[0] + ': ' + str(int(np.round(agreement['type_frac']*agreement['n']))) + '/' + str(agreement['n']) +
+                ' templates agree, median rlap = ' + str(np.round(agreement['median_rlap'], 1)) + ', z spread = ' + str(np.round(agreement['z_spread'], 4)) + bcolors.ENDC)
+            return typ_f[0], rlap[0], red[0], red_err[0]
 
     save = input('Save classification for source? [y/n] ')
     #save == 'n'
@@ -745,54 +873,24 @@ def snid_analyze(source, redshift):
         return None, None, None, None
 
 def specplot(x, y, xi, yi, snid_type, fname, output, best_num, z_template, z_template_unc, z_snid, spec_num, rlap, show_redshift=False):
-    fig, ax = plt.subplots(figsize=(8,4.5))
-    ax.plot(xi,yi,color='#32384D',alpha=0.5,
-             label='New SN')
-    ax.plot(x,y,color='#217CA3',
-             label='SNID template', lw=3)
-    if show_redshift:
-        ax.plot(x[-3],y[-3],color='white',lw=0,
-                 label=r'$z_\mathrm{} = $ {:.3f}$\,\pm\,${:.3f}'.format("{SNID}", z_template, z_template_unc))
-        ax.text(0.78, 0.955, r'$z_\mathrm{} = ${:.4f}'.format("{SN}", z_snid),
-                va='center',
-                fontsize=15, transform=plt.gcf().transFigure)
-    else:
-        ax.text(0.78, 0.955, 'Match #' + str(spec_num+1),
-                va='center',
-                fontsize=15, transform=plt.gcf().transFigure)
-
-    ax.plot(x[-3],y[-3],color='#217CA3', lw=3)
-    ax.set_xlabel(r'Rest Frame Wavelength ($\mathrm{\AA}$)', fontsize=17)
-    ax.set_ylabel('Relative Flux', fontsize=17)
-    ax.tick_params(which='both',labelsize=15)
-
-    ax.grid(axis='x', color='0.7', ls=':')
-    ax.xaxis.set_minor_locator(MultipleLocator(250))
-    ax.set_yticklabels([])
 
+    ''' Info : Queues a plot of a SNID template over the source spectrum with the render service, saved for Zooniverse
+        Input : template and source spectra, SNID type, file name, output directory, template number, template redshift and uncertainty,
+                SNID redshift, match number, rlap score, whether to show redshift
+        Returns : Future of the saved image path
+    '''
 
-    ax.text(0.105, 0.955, 'SNID type: ',
-            va='center',
-            fontsize=15, transform=plt.gcf().transFigure)
-    ax.text(0.245, 0.955, snid_type,
-            color='#217CA3', weight='bold', va='center',
-            fontsize=23, transform=plt.gcf().transFigure)
-
-    ax.legend(fancybox=True)
-    fig.subplots_adjust(left=0.055,right=0.99,top=0.925,bottom=0.145)
-    fig.savefig(output + 'snidfits_emclip_' + fname + "_" + str(best_num) + '.png', dpi = 600)
-    #print(output + 'snidfits_emclip_' + fname + "_" + str(best_num) + '.png')
-    plt.close(fig)
-    plt.close()
+    return renderer.render(draw_snid_match, output + 'snidfits_emclip_' + fname + "_" + str(best_num) + '.png', 'zooniverse',
+        np.asarray(x), np.asarray(y), np.asarray(xi), np.asarray(yi), snid_type, z_template, z_template_unc, z_snid, spec_num, show_redshift=show_redshift)
 
-def submit_class(unclassifys, unclassified_reds, f):
+def submit_class(unclassifys, unclassified_reds, f, auto=False):
 
     ''' Info : Submits classification information to Fritz
-        Input : list of sources without classifications
+        Input : list of sources without classifications, redshifts, ASCII table, auto (if True, high-confidence SNID results are saved without prompting)
         Returns : None
     '''
 
-    transients, types, rlaps, reds, red_errs = run_class(unclassifys, unclassified_reds) # Runs SNID classification code
+    transients, types, rlaps, reds, red_errs = run_class(unclassifys, unclassified_reds, auto=auto) # Runs SNID classification code
 
     if len(transients) != 0:
         print('ZTFname\t\tClassification\t\tRedshift\t\trlaps')
@@ -820,6 +918,9 @@ def submit_class(unclassifys, unclassified_reds, f):
 
                 if fritz_class['status'] == 'success':
                     print(bcolors.OKGREEN + transients[tr] + ' classification upload successful.' + bcolors.ENDC)
+
+                    if 'Ia' in types[tr] and transients[tr] in accepted_fits:
+                        population.add(transients[tr], accepted_fits.pop(transients[tr]))
                 else:
                     print(bcolors.FAIL + transients[tr] + ' classification upload failed.' + bcolors.ENDC)
                     print(bcolors.FAIL + fritz_class['message'] + bcolors.ENDC)
@@ -0,0 +1,165 @@
+import requests
+import threading
+import time
+
+tns_rate_reserve = 1   # Requests of each budget left unused, so the pipeline stays just under TNS's limit
+tns_max_retries = 5    # Attempts per request on connection errors, timeouts or a 429 before giving up
+tns_timeout = 30       # Timeout (s) of a TNS request
+tns_probe_wait = 0.2   # Seconds between checks while another request finds out how much of a budget is left
+
+# TNS reports each budget in its own headers: <prefix>-limit, <prefix>-remaining and <prefix>-reset (seconds until the budget renews)
+tns_budgets = {'api': 'x-rate-limit',       # All API calls (search, object, file upload, reports, replies)
+               'cone': 'x-cone-rate-limit'} # Cone searches, limited separately
+
+class TNSClient:
+
+    ''' Info : Makes every request to TNS through shared rate-limit budgets. The remaining quota and reset time are read from the headers of
+               each response, requests are spread over what is left of the window so the quota is not used up early, and when only the reserve
+               is left requests wait for the reset. A 429 that still happens waits for the reset and retries.
+        Attributes: bot ID and name (for the User-Agent), budgets (name -> remaining, reset time, time of the last request, whether a request
+                    sent while the remaining quota was unknown is still waiting for its reply)
+    '''
+
+    def __init__(self, bot_id, bot_name):
+        self.bot_id = bot_id
+        self.bot_name = bot_name
+        self.lock = threading.Lock()
+        self.budgets = {name: {'remaining': None, 'reset': 0, 'last': 0, 'probing': False} for name in tns_budgets}
+
+    def acquire(self, budget):
+
+        ''' Info : Waits until a request fits in a budget, then reserves it
+            Input : self, budget name
+            Returns : True if the request is sent while the remaining quota is unknown (release the budget once it is answered), False otherwise
+        '''
+
+        while True:
+            with self.lock:
+                state = self.budgets[budget]
+                now = time.time()
+
+                if state['remaining'] == None or now >= state['reset']:
+                    # Nothing known yet, or the window has renewed: one request goes ahead and its response tells us where we stand,
+                    # the others wait for it rather than all going at once
+                    if not state['probing']:
+                        state['remaining'] = None
+                        state['last'] = now
+                        state['probing'] = True
+                        return True
+
+                    wait = tns_probe_wait
+                elif state['remaining'] <= tns_rate_reserve:
+                    wait = state['reset'] - now
+                else:
+                    # Spread the rest of the quota evenly over the rest of the window
+                    wait = state['last'] + (state['reset'] - now)/(state['remaining'] - tns_rate_reserve) - now
+
+                if wait <= 0:
+                    state['remaining'] -= 1
+                    state['last'] = now
+                    return False
+
+            time.sleep(min(wait, 60))
+
+    def headers(self):
+
+        ''' Info : TNS bot User-Agent header
+            Input : self
+            Returns : dictionary of headers
+        '''
+
+        return {'User-Agent': 'tns_marker{"tns_id":' + str(self.bot_id) + ', "type":"bot", "name":"' + self.bot_name + '"}'}
+
+    def release(self, budget):
+
+        ''' Info : Lets other requests through after the one sent while the remaining quota was unknown has been answered (or failed)
+            Input : self, budget name
+            Returns : None
+        '''
+
+        with self.lock:
+            self.budgets[budget]['probing'] = False
+
+    def request(self, method, url, budget='api', retry=True, **kwargs):
+
+        ''' Info : Sends a request to TNS within a budget
+            Input : self, 'GET' or 'POST', url, budget name, whether to resend after a connection error or timeout (False for requests
+                    that must not be made twice, such as reports and file uploads, since TNS may have received the first one),
+                    other arguments of requests.request (data, files, ...)
+            Returns : requests Response
+            Raises : the last error if every attempt fails
+        '''
+
+        kwargs.setdefault('timeout', tns_timeout)
+
+        for attempt in range(tns_max_retries):
+            if attempt > 0:
+                # Rewind any file uploads so the retry sends them in full
+                for f in kwargs.get('files') or []:
+                    f[1][1].seek(0)
+
+            probe = self.acquire(budget)
+
+            try:
+                response = requests.request(method, url, headers=self.headers(), **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                response = None
+                if not retry or attempt == tns_max_retries - 1:
+                    raise
+            else:
+                self.update(budget, response)
+            finally:
+                if probe:
+                    self.release(budget)
+
+            if response == None:
+                time.sleep(2**attempt)
+                continue
+
+            # A request turned down by the rate limit was not processed, so it is always safe to send again
+            if not limited(response) or attempt == tns_max_retries - 1:
+                return response
+
+        return response
+
+    def update(self, budget, response):
+
+        ''' Info : Reads the remaining quota and reset time of a budget from a response
+            Input : self, budget name, requests Response
+            Returns : None
+        '''
+
+        prefix = tns_budgets[budget]
+
+        try:
+            remaining = int(response.headers[prefix + '-remaining'])
+            reset = float(response.headers[prefix + '-reset'])
+        except (KeyError, ValueError):
+            return
+
+        with self.lock:
+            state = self.budgets[budget]
+            state['remaining'] = 0 if limited(response) else remaining
+            state['reset'] = time.time() + reset
+
+    def status(self):
+
+        ''' Info : Current state of the budgets, e.g. to print before a long run
+            Input : self
+            Returns : dictionary of budget name -> (remaining requests or None if unknown, seconds until reset)
+        '''
+
+        with self.lock:
+            return {name: (state['remaining'], max(0, state['reset'] - time.time())) for name, state in self.budgets.items()}
+
+def limited(response):
+
+    ''' Info : Checks whether TNS turned a request down for exceeding the rate limit (as the HTTP status or the id_code of the reply)
+        Input : requests Response
+        Returns : True or False
+    '''
+
+    if response.status_code == 429:
+        return True
+
+    return response.text[:200].replace(' ', '').startswith('{"id_code":429')
@@ -0,0 +1,113 @@
+import csv
+import io
+import os
+import threading
+import time
+import zipfile
+
+tns_index_dir = 'tns_index'  # Directory of the downloaded TNS public objects list
+tns_index_max_age = 1        # Days before the list is downloaded again (TNS regenerates it daily)
+tns_index_margin = 60        # Days before the start of the sync window from which discovered objects are indexed
+tns_local_csv = None         # Path of a local TNS objects CSV to use instead of downloading the list (e.g. a small stand-in for trial runs)
+
+tns_public_csv_url = 'https://www.wis-tns.org/system/files/tns_public_objects/tns_public_objects.csv.zip'
+
+class TNSNameIndex:
+
+    ''' Info : Local index from internal names (e.g. ZTF names) to TNS names, built from the TNS public objects list for the objects discovered
+               in a date window, so sources Fritz has not cross-matched are resolved without a TNS search each
+        Attributes: directory, index (internal name -> TNS name, None until built), start of the indexed window
+    '''
+
+    def __init__(self, directory=tns_index_dir):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.index = None
+        self.since = None
+
+    def build(self, since, fetch=None, path=None):
+
+        ''' Info : Builds the index from the TNS public objects list, downloading it first if the local copy is missing or too old
+            Input : self, earliest discovery date to index (YYYY-MM-DD), function returning the zipped list as bytes,
+                    CSV or zip file to read instead (tns_local_csv if None)
+            Returns : number of internal names indexed
+        '''
+
+        if path == None:
+            path = tns_local_csv
+
+        if path == None:
+            path = os.path.join(self.directory, 'tns_public_objects.csv.zip')
+
+            if not os.path.exists(path) or time.time() - os.path.getmtime(path) > tns_index_max_age*86400:
+                if fetch == None:
+                    raise ValueError('No TNS objects list in ' + self.directory + ' and nothing to download it with')
+
+                os.makedirs(self.directory, exist_ok=True)
+
+                tmp = path + '.' + str(os.getpid()) + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(fetch())
+                os.replace(tmp, path)
+
+        index = {}
+
+        for row in read_objects(path):
+            if (row.get('discoverydate') or '')[:10] < since:
+                continue
+
+            name = row['name_prefix'] + ' ' + row['name']
+
+            for internal in (row.get('internal_names') or '').split(','):
+                if internal.strip() != '':
+                    index[internal.strip()] = name
+
+        with self.lock:
+            self.index = index
+            self.since = since
+
+        return len(index)
+
+    def lookup(self, internal_name):
+
+        ''' Info : TNS name of a source from the index
+            Input : self, internal name (e.g. ZTF name)
+            Returns : TNS name with prefix (e.g. SN 2021abc), or None if it is not indexed
+        '''
+
+        with self.lock:
+            if self.index == None:
+                return None
+
+            return self.index.get(internal_name)
+
+def read_objects(path):
+
+    ''' Info : Reads the TNS public objects list (zipped or plain CSV). TNS puts the time the list was made on the first line, before the header.
+        Input : path
+        Returns : iterator of row dictionaries
+    '''
+
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as z:
+            with z.open(z.namelist()[0]) as raw:
+                yield from read_rows(io.TextIOWrapper(raw, encoding='utf-8'))
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from read_rows(f)
+
+def read_rows(f):
+
+    ''' Info : Reads rows of the TNS objects CSV from an open file, skipping the timestamp line if there is one
+        Input : text file
+        Returns : iterator of row dictionaries
+    '''
+
+    first = f.readline()
+
+    header = first if 'objid' in first else f.readline()
+
+    yield from csv.DictReader(f, fieldnames=next(csv.reader([header])))
+
+# Shared by the source list download
+tns_index = TNSNameIndex()
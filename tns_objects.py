@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+
+tns_object_file = 'tns_objects.json' # Cache of TNS object lookups
+tns_object_ttl = 6                    # Hours a cached TNS object is trusted (classifications can be added at any time)
+
+class TNSObjectCache:
+
+    ''' Info : Cache of TNS object API replies (including their classification spectra), per TNS name with a short TTL. Lookups for a whole
+               run can be made up front, in parallel, and are then answered locally. Saved to disk so a rerun soon after does not repeat them.
+        Attributes: path, TTL (hours), cached replies (TNS name -> reply and time it was fetched)
+    '''
+
+    def __init__(self, path=tns_object_file, ttl=tns_object_ttl):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.objects = None
+
+    def drop(self, name):
+
+        ''' Info : Forgets a TNS object, e.g. after submitting a report on it
+            Input : self, TNS name
+            Returns : None
+        '''
+
+        with self.lock:
+            self.load()
+            if self.objects.pop(name, None) != None:
+                self.save()
+
+    def fresh(self, entry):
+
+        ''' Info : Checks whether a cached reply is within the TTL
+            Input : self, cache entry
+            Returns : True or False
+        '''
+
+        return time.time() - entry['time'] < self.ttl*3600
+
+    def get(self, name, fetch):
+
+        ''' Info : TNS object through the cache. A lookup that fails raises before anything is cached, so it is tried again next time.
+            Input : self, TNS name (without prefix), function returning the object API reply (or None if TNS has no such object)
+            Returns : reply dictionary, or None
+        '''
+
+        with self.lock:
+            self.load()
+            entry = self.objects.get(name)
+
+        if entry != None and self.fresh(entry):
+            return entry['reply']
+
+        reply = fetch()
+
+        with self.lock:
+            self.objects[name] = {'reply': reply, 'time': time.time()}
+            self.save()
+
+        return reply
+
+    def load(self):
+
+        ''' Info : Reads the cache from disk the first time it is needed, dropping expired entries (call with self.lock held)
+            Input : self
+            Returns : None
+        '''
+
+        if self.objects != None:
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                self.objects = json.load(f)
+        except (OSError, ValueError):
+            self.objects = {}
+
+        self.objects = {name: entry for name, entry in self.objects.items() if self.fresh(entry)}
+
+    def lookup(self, name, fetch):
+
+        ''' Info : Fetches a TNS object into the cache for prefetch, leaving it out if the lookup fails
+            Input : self, TNS name, function taking a TNS name and returning its object API reply
+            Returns : True if it was fetched, False otherwise
+        '''
+
+        try:
+            self.get(name, lambda: fetch(name))
+        except Exception:
+            return False
+
+        return True
+
+    def prefetch(self, names, fetch, executor=None):
+
+        ''' Info : Looks up many TNS objects at once, skipping those already cached
+            Input : self, TNS names, function taking a TNS name and returning its object API reply, executor to run lookups in parallel
+                    (one at a time if None)
+            Returns : number of objects fetched (those that failed are left to be looked up when needed)
+        '''
+
+        with self.lock:
+            self.load()
+            missing = sorted(set(name for name in names if name not in self.objects or not self.fresh(self.objects[name])))
+
+        if executor == None:
+            fetched = [self.lookup(name, fetch) for name in missing]
+        else:
+            fetched = list(executor.map(lambda name: self.lookup(name, fetch), missing))
+
+        return sum(fetched)
+
+    def save(self):
+
+        ''' Info : Writes the cache to disk (call with self.lock held)
+            Input : self
+            Returns : None
+        '''
+
+        tmp = self.path + '.' + str(os.getpid()) + '.tmp'
+
+        with open(tmp, 'w') as f:
+            json.dump(self.objects, f)
+
+        os.replace(tmp, self.path)
+
+# Shared by the TNS submission steps
+tns_objects = TNSObjectCache()
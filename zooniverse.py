@@ -115,124 +115,139 @@ def pull_class(startd):
 
     sources = np.unique(class_sources)
 
-    for n, new in enumerate(sources):
-        print(bcolors.OKCYAN + str(n+1) + '/' + str(len(sources)) + ': ' + bcolors.ENDC + bcolors.OKBLUE + new + bcolors.ENDC)
-
-        un_class = np.array(classifications)[np.array(class_sources) == new]
-        un_class_users = np.array(class_users)[np.array(class_sources) == new]
-
-        images_available = False
-
-        for m in stats.mode(un_class).mode:
-            if m > 0:
-                #print(class_users)
-                #print(un_class)
-                #print(m)
-                images_available = True
-                image_url = image_urls[int(np.argwhere(np.array(news) == new))][m-1]['image/png']
-                #print(image_url)
-                rlap = all_rlaps[int(np.argwhere(np.array(news) == new))][m-1]
-                img_data = requests.get(image_url).content
-                with open('zooniverse/' + new + '.png', 'wb') as handler:
-                    handler.write(img_data)
-                image = Image.open('zooniverse/' + new + '.png')
-            elif m == 0:
-                print('No good match')
-            else:
-                print('Issues')
-
-        if images_available:
-            comment_infos = get_source_api(new)['comments']
-
-            uploaded = False
-            zoo_class = False
-            for i in range (len(get_source_api(new)['comments'])):
-
-                comment_info = comment_infos[i]
-                comment = comment_info['text']
-
-                if 'Uploaded to TNS' in comment:
-                    uploaded = True
-
-                if 'zooniverse classification' in comment:
-                    zoo_class = True
-
-            if uploaded == True:
-                print(new + ' has already been uploaded to TNS.')
-                continue
-
-            if zoo_class == True:
-                print(new + ' has already been classified from Zooniverse.')
-                continue
-
-            width, height = image.size
-            image = image.resize((width//5, height//5))
-            image.show()
-
-            print('Template #' + str(m) + ' has rlap=' + str(rlap))
-            upload = input('Enter in the name of the best classification (or <n> for none): ')
-
-            if upload == 'n':
-                continue
-            elif upload == 'II':
-                upload = 'Type II'
-            elif upload == 'Gal':
-                upload = 'Galactic Nuclei'
-            elif upload == 'Ia-csm':
-                upload = 'Ia-CSM'
-
-            if 'II' not in upload or rlap < 5: # We only upload classification to Fritz if Type II and rlap > 5
-
-                if 'II' not in upload:
-                    print('Not a Type II, skipping...')
-                elif rlap < 5:
-                    print('rlap < 5, skipping...')
+    # Sources the ledger already has as uploaded to TNS or classified from Zooniverse are skipped without looking at Fritz
+    handled = ledger.handled(sources, ['tns_uploaded', 'zooniverse'])
+
+    if len(handled) > 0:
+        print(bcolors.OKCYAN + 'Skipping ' + str(len(handled)) + ' sources already uploaded to TNS or classified from Zooniverse.' + bcolors.ENDC)
+        sources = np.array([source for source in sources if source not in handled])
+
+    prefetch = start_prefetch(sources) # Loads comments and spectra of the next sources while the user answers prompts
+
+    try:
+        for n, new in enumerate(sources):
+            print(bcolors.OKCYAN + str(n+1) + '/' + str(len(sources)) + ': ' + bcolors.ENDC + bcolors.OKBLUE + new + bcolors.ENDC)
+            prefetch.advance(n)
+
+            un_class = np.array(classifications)[np.array(class_sources) == new]
+            un_class_users = np.array(class_users)[np.array(class_sources) == new]
+
+            images_available = False
+
+            for m in stats.mode(un_class).mode:
+                if m > 0:
+                    #print(class_users)
+                    #print(un_class)
+                    #print(m)
+                    images_available = True
+                    image_url = image_urls[int(np.argwhere(np.array(news) == new))][m-1]['image/png']
+                    #print(image_url)
+                    rlap = all_rlaps[int(np.argwhere(np.array(news) == new))][m-1]
+                    img_data = requests.get(image_url).content
+                    with open('zooniverse/' + new + '.png', 'wb') as handler:
+                        handler.write(img_data)
+                    image = Image.open('zooniverse/' + new + '.png')
+                elif m == 0:
+                    print('No good match')
+                else:
+                    print('Issues')
 
-                resp = post_comment(new, 'zooniverse classification: ' + upload + ', ' + str(stats.mode(un_class).count) + '/' + str(len(un_class)) +
-                    ' classifications with rlap = ' + str(rlap), 'zooniverse/'+new+'.png', new+'_zooniverse.png')
+            if images_available:
+                comment_infos = get_source_api(new)['comments']
 
-                continue
+                uploaded = False
+                zoo_class = False
+                for i in range (len(get_source_api(new)['comments'])):
 
-            print('Running superfit...')
+                    comment_info = comment_infos[i]
+                    comment = comment_info['text']
 
-            run_superfit(new) # Should output an image with classification
+                    ledger.record_comment(new, comment) # Also picks up comments posted by hand
 
-            match = input('Does the superfit classification match SNID? [y/n] ')
+                    if comment == 'Uploaded to TNS': # Same test as class_submission and the ledger
+                        uploaded = True
 
-            if match != 'y':
+                    if 'zooniverse classification' in comment:
+                        zoo_class = True
 
-                print('No match, commenting classification')
+                if uploaded == True:
+                    print(new + ' has already been uploaded to TNS.')
+                    continue
 
-                resp = post_comment(new, 'zooniverse classification: ' + upload + ', ' + str(stats.mode(un_class).count) + '/' + str(len(un_class)) +
-                    ' classifications with rlap = ' + str(rlap), 'zooniverse/'+new+'.png', new+'_zooniverse.png')
+                if zoo_class == True:
+                    print(new + ' has already been classified from Zooniverse.')
+                    continue
 
-                continue
+                width, height = image.size
+                image = image.resize((width//5, height//5))
+                image.show()
 
-            pre_class = get_classification(new)[0]
+                print('Template #' + str(m) + ' has rlap=' + str(rlap))
+                upload = input('Enter in the name of the best classification (or <n> for none): ')
 
-            if pre_class == upload:
-                print(new + ' already classified with the same classification on Fritz.')
-                #subject_set.remove(news_ids[n])
-                continue
-            elif pre_class != 'No Classification found':
-                if input(new + ' already classified with classification ' + pre_class + '. Submit another? [y/n] ') == 'y':
-                    pass
-                else:
+                if upload == 'n':
                     continue
+                elif upload == 'II':
+                    upload = 'Type II'
+                elif upload == 'Gal':
+                    upload = 'Galactic Nuclei'
+                elif upload == 'Ia-csm':
+                    upload = 'Ia-CSM'
+
+                if 'II' not in upload or rlap < 5: # We only upload classification to Fritz if Type II and rlap > 5
+
+                    if 'II' not in upload:
+                        print('Not a Type II, skipping...')
+                    elif rlap < 5:
+                        print('rlap < 5, skipping...')
+
+                    resp = post_comment(new, 'zooniverse classification: ' + upload + ', ' + str(stats.mode(un_class).count) + '/' + str(len(un_class)) +
+                        ' classifications with rlap = ' + str(rlap), 'zooniverse/'+new+'.png', new+'_zooniverse.png')
+
+                    continue
+
+                print('Running superfit...')
+
+                run_superfit(new) # Should output an image with classification
 
-            fritz_class = submit_fritz_class(new, upload)
+                match = input('Does the superfit classification match SNID? [y/n] ')
 
-            if fritz_class['status'] == 'success':
-                print(bcolors.OKGREEN + new + ' classification upload successful.' + bcolors.ENDC)
-            else:
-                print(bcolors.FAIL + new + ' classification upload failed.' + bcolors.ENDC)
-                print(bcolors.FAIL + fritz_class['message'] + bcolors.ENDC)
+                if match != 'y':
 
-            resp = post_comment(new, 'zooniverse classification: ' + upload + ', ' + str(stats.mode(un_class).count) + '/' + str(len(un_class)) +
-                ' classifications', 'zooniverse/'+new+'.png', new+'_zooniverse.png')
+                    print('No match, commenting classification')
 
-            if resp['status'] == 'success':
-                print(bcolors.OKGREEN + new + ' comment upload successful.' + bcolors.ENDC)
-            else:
-                print(bcolors.FAIL + new + ' comment failed.' + bcolors.ENDC)
-                print(bcolors.FAIL + json.dumps(resp, indent=2) + bcolors.ENDC)
+                    resp = post_comment(new, 'zooniverse classification: ' + upload + ', ' + str(stats.mode(un_class).count) + '/' + str(len(un_class)) +
+                        ' classifications with rlap = ' + str(rlap), 'zooniverse/'+new+'.png', new+'_zooniverse.png')
+
+                    continue
+
+                pre_class = get_classification(new)[0]
+
+                if pre_class == upload:
+                    print(new + ' already classified with the same classification on Fritz.')
+                    #subject_set.remove(news_ids[n])
+                    continue
+                elif pre_class != 'No Classification found':
+                    if input(new + ' already classified with classification ' + pre_class + '. Submit another? [y/n] ') == 'y':
+                        pass
+                    else:
+                        continue
+
+                fritz_class = submit_fritz_class(new, upload)
+
+                if fritz_class['status'] == 'success':
+                    print(bcolors.OKGREEN + new + ' classification upload successful.' + bcolors.ENDC)
+                else:
+                    print(bcolors.FAIL + new + ' classification upload failed.' + bcolors.ENDC)
+                    print(bcolors.FAIL + fritz_class['message'] + bcolors.ENDC)
+
+                resp = post_comment(new, 'zooniverse classification: ' + upload + ', ' + str(stats.mode(un_class).count) + '/' + str(len(un_class)) +
+                    ' classifications', 'zooniverse/'+new+'.png', new+'_zooniverse.png')
+
+                if resp['status'] == 'success':
+                    print(bcolors.OKGREEN + new + ' comment upload successful.' + bcolors.ENDC)
+                else:
+                    print(bcolors.FAIL + new + ' comment failed.' + bcolors.ENDC)
+                    print(bcolors.FAIL + json.dumps(resp, indent=2) + bcolors.ENDC)
+    finally:
+        stop_prefetch()